@@ -1,23 +1,36 @@
-from typing import List
+import base64
+import json
+from typing import Iterator, List, Union
 
-from flask import request
+from flask import Flask, Response, g, request
 from flask_restful import Api, Resource, abort
-from flasgger import Swagger, swag_from
 
-from app import app
-from api.schemas import MeanSchema, RecordsSchema, MovingAverageSchema
+import config
+from api.docs import init_swagger, swag_from
+from api.instrumentation import init_instrumentation, timed_stage
+from api.response_cache import cached_response
+from api.schemas import (
+    MeanSchema, MeanBatchSchema, RecordsSchema, MovingAverageSchema,
+    NearbyCitiesSchema, RollupSchema, StatsSchema
+)
 
 from support_functions.calculators import calculate_moving_average
 
 from weather_db.db_manager import City, WeatherForecast
+from weather_db.sketches import RELATIVE_ACCURACY
+from weather_db.snapshots import (
+    pin_snapshot, resolve_db_name, unpin_snapshot
+)
+from weather_db.spatial_index import city_locator
 
 
-api = Api(app)
-swagger = Swagger(app)
-
 mean_schema = MeanSchema()
+mean_batch_schema = MeanBatchSchema()
 records_schema = RecordsSchema()
 moving_average_schema = MovingAverageSchema()
+rollup_schema = RollupSchema()
+nearby_cities_schema = NearbyCitiesSchema()
+stats_schema = StatsSchema()
 
 
 class CitiesApi(Resource):
@@ -35,6 +48,7 @@ class CitiesApi(Resource):
         return {'cities': cities_list}
 
     @classmethod
+    @cached_response
     @swag_from('yml_for_swagger/cities_swagger.yml')
     def get(cls) -> dict:
         cities = City.get_all_cities()
@@ -45,21 +59,111 @@ class CitiesApi(Resource):
         return cls.build_json_response(cities)
 
 
+class NearbyCitiesApi(Resource):
+    _forecast_fields = (
+        'date', 'temp', 'pcp', 'clouds', 'pressure', 'humidity', 'wind_speed'
+    )
+
+    @classmethod
+    def build_json_response(
+            cls, cities: List[tuple], forecasts: dict
+    ) -> dict:
+        cities_list = []
+
+        for distance, (city_id, name, lat, lon) in cities:
+            forecast = forecasts.get(city_id)
+
+            cities_list.append({
+                'id': city_id,
+                'name': name,
+                'coords': {'lat': lat, 'lon': lon},
+                'distance_km': round(distance, 3),
+                'latest_forecast': (
+                    dict(zip(cls._forecast_fields, forecast))
+                    if forecast else None
+                )
+            })
+
+        return {'cities': cities_list}
+
+    @staticmethod
+    def parse_bbox(value: str) -> List[float]:
+        try:
+            bbox = [float(item) for item in value.split(',')]
+        except ValueError:
+            bbox = []
+
+        if len(bbox) != 4:
+            raise ValueError('bbox must be min_lat,min_lon,max_lat,max_lon.')
+
+        return bbox
+
+    @classmethod
+    @cached_response
+    @swag_from('yml_for_swagger/nearby_cities_swagger.yml')
+    def get(cls) -> dict:
+        errors = nearby_cities_schema.validate(request.args)
+
+        if errors:
+            abort(404, msg=str(errors))
+
+        args = nearby_cities_schema.load(request.args)
+        limit = args.get('limit', 100)
+
+        cities = None
+        try:
+            index = city_locator.get_index()
+
+            if 'bbox' in request.args:
+                cities = index.within_bbox(
+                    *cls.parse_bbox(args['bbox']), limit=limit
+                )
+            elif 'lat' not in args or 'lon' not in args:
+                raise ValueError('Pass lat and lon or bbox.')
+            elif 'radius' in args:
+                cities = index.within_radius(
+                    args['lat'], args['lon'], args['radius'], limit
+                )
+            else:
+                cities = index.nearest(
+                    args['lat'], args['lon'], args.get('k', 10)
+                )
+        except ValueError as error:
+            abort(404, msg=str(error))
+
+        forecasts = WeatherForecast.select_latest_forecasts(
+            [city[0] for _, city in cities]
+        )
+
+        return cls.build_json_response(cities, forecasts)
+
+
 class MeanApi(Resource):
     @staticmethod
     def build_json_response(
-            city: str, value_type: str, mean_value: float
+            city: str, value_type: str, statistics: dict, extended: bool
     ) -> dict:
 
+        mean_value = {
+            'value_type': value_type,
+            'value': statistics['mean']
+        }
+
+        if extended:
+            mean_value.update({
+                'count': statistics['count'],
+                'std_dev': statistics['std_dev'],
+                'min': statistics['min'],
+                'max': statistics['max']
+            })
+
         return {
             'city': city,
-            'mean_value': {
-                'value_type': value_type,
-                'value': mean_value
-            }
+            'mean_value': mean_value
         }
 
     @classmethod
+    @cached_response
     @swag_from('yml_for_swagger/mean_swagger.yml')
     def get(cls) -> dict:
         errors = mean_schema.validate(request.args)
@@ -68,75 +172,229 @@ class MeanApi(Resource):
             abort(404, msg=str(errors))
 
         city, value_type = request.args['city'], request.args['value_type']
+        extended = mean_schema.load(request.args).get('extended', False)
 
-        mean_value = None
+        if config.use_column_store:
+            select_column_statistics = (
+                _get_column_store().select_column_statistics
+            )
+        else:
+            select_column_statistics = WeatherForecast.select_column_statistics
+
+        statistics = None
         try:
-            mean_value = WeatherForecast.select_mean_value_of_column(
-                city, value_type
+            statistics = select_column_statistics(city, value_type)
+        except ValueError as error:
+            abort(404, msg=str(error))
+
+        return cls.build_json_response(city, value_type, statistics, extended)
+
+
+class MeanBatchApi(Resource):
+    @staticmethod
+    def parse_list_arg(value: str) -> Union[List[str], None]:
+        """Parses comma separated values, 'all' is returned as None."""
+
+        if value.strip() == 'all':
+            return None
+
+        return [item.strip() for item in value.split(',') if item.strip()]
+
+    @staticmethod
+    def build_json_response(means: dict) -> dict:
+        return {
+            'means': [
+                {'city': city, 'mean_values': mean_values}
+                for city, mean_values in means.items()
+            ]
+        }
+
+    @classmethod
+    @cached_response
+    @swag_from('yml_for_swagger/mean_batch_swagger.yml')
+    def get(cls) -> dict:
+        errors = mean_batch_schema.validate(request.args)
+
+        if errors:
+            abort(404, msg=str(errors))
+
+        cities = cls.parse_list_arg(request.args['cities'])
+        value_types = cls.parse_list_arg(request.args['value_types'])
+
+        means = None
+        try:
+            means = WeatherForecast.select_mean_values_of_columns(
+                cities, value_types
             )
         except ValueError as error:
             abort(404, msg=str(error))
 
-        return cls.build_json_response(city, value_type, mean_value)
+        return cls.build_json_response(means)
 
 
 class RecordsApi(Resource):
     @staticmethod
+    def build_record(weather_forecast: tuple) -> dict:
+        (
+            forecast_id, date, temp,
+            pcp, clouds, pressure, humidity, wind_speed
+        ) = weather_forecast
+
+        return {
+            'id': forecast_id,
+            'date': date,
+            'temp': temp,
+            'pcp': pcp,
+            'clouds': clouds,
+            'pressure': pressure,
+            'humidity': humidity,
+            'wind_speed': wind_speed
+        }
+
+    @staticmethod
+    def encode_next_token(weather_forecast: tuple) -> str:
+        forecast_id, date = weather_forecast[:2]
+
+        return base64.urlsafe_b64encode(
+            f'{date}|{forecast_id}'.encode()
+        ).decode()
+
+    @staticmethod
+    def decode_next_token(token: str) -> tuple:
+        try:
+            date, forecast_id = base64.urlsafe_b64decode(
+                token.encode()
+            ).decode().split('|')
+
+            return date, int(forecast_id)
+        except ValueError:
+            raise ValueError('The next token is not valid.') from None
+
+    @classmethod
     def build_json_response(
-            city: str, start_dt: str, end_dt: str,
-            weather_forecast_data: List[tuple]
+            cls, city: str, start_dt: str, end_dt: str,
+            weather_forecast_data: List[tuple], paginated: bool = False,
+            next_token: str = None
     ) -> dict:
 
-        daily_weather_forecast = []
-
-        for weather_forecast in weather_forecast_data:
-            (
-                forecast_id, date, temp,
-                pcp, clouds, pressure, humidity, wind_speed
-            ) = weather_forecast
-
-            daily_weather_forecast.append(
-                {
-                    'id': forecast_id,
-                    'date': date,
-                    'temp': temp,
-                    'pcp': pcp,
-                    'clouds': clouds,
-                    'pressure': pressure,
-                    'humidity': humidity,
-                    'wind_speed': wind_speed
-                }
-            )
+        daily_weather_forecast = [
+            cls.build_record(weather_forecast)
+            for weather_forecast in weather_forecast_data
+        ]
 
-        return {
+        response = {
             'city': city, 'start_dt': start_dt, 'end_dt': end_dt,
             'daily_forecast': daily_weather_forecast
         }
 
+        if paginated:
+            response['next'] = next_token
+
+        return response
+
     @classmethod
-    @swag_from('yml_for_swagger/records_swagger.yml')
-    def get(cls) -> dict:
-        errors = records_schema.validate(request.args)
+    def build_streamed_json_response(
+            cls, city: str, start_dt: str, end_dt: str,
+            weather_forecast_data: Iterator[tuple], limit: int = None
+    ) -> Iterator[str]:
+        """Writes the same JSON as build_json_response piece by piece,
+        so the records are never held in memory all together.
+
+        """
+
+        yield (
+            f'{{"city": {json.dumps(city)}, '
+            f'"start_dt": {json.dumps(start_dt)}, '
+            f'"end_dt": {json.dumps(end_dt)}, "daily_forecast": ['
+        )
 
-        if errors:
-            abort(404, msg=str(errors))
+        last_forecast = None
+        for index, weather_forecast in enumerate(weather_forecast_data):
+            if index == limit:
+                yield (
+                    '], "next": '
+                    f'{json.dumps(cls.encode_next_token(last_forecast))}}}'
+                )
+                return
 
-        args = request.args
-        city, start_dt, end_dt = args['city'], args['start_dt'], args['end_dt']
+            separator = ', ' if index else ''
+            yield separator + json.dumps(cls.build_record(weather_forecast))
+            last_forecast = weather_forecast
 
-        forecast_records = WeatherForecast.select_records_in_given_range(
-            city, start_dt, end_dt
-        )
+        yield '], "next": null}' if limit is not None else ']}'
 
-        return cls.build_json_response(
-            city, start_dt, end_dt, forecast_records
+    @classmethod
+    @cached_response
+    @swag_from('yml_for_swagger/records_swagger.yml')
+    def get(cls) -> Union[dict, Response]:
+        with timed_stage('validate'):
+            errors = records_schema.validate(request.args)
+
+            if errors:
+                abort(404, msg=str(errors))
+
+            args = request.args
+            city = args['city']
+            start_dt, end_dt = args['start_dt'], args['end_dt']
+
+            options = records_schema.load(args)
+            limit = options.get('limit')
+
+            after = None
+            try:
+                if 'next' in options:
+                    after = cls.decode_next_token(options['next'])
+            except ValueError as error:
+                abort(404, msg=str(error))
+
+        if not options.get('stream') and limit is None and after is None:
+            with timed_stage('query'):
+                forecast_records = (
+                    WeatherForecast.select_records_in_given_range(
+                        city, start_dt, end_dt
+                    )
+                )
+
+            with timed_stage('build_json'):
+                return cls.build_json_response(
+                    city, start_dt, end_dt, forecast_records
+                )
+
+        # One record more is read to know whether there is a next page.
+        forecast_records = WeatherForecast.iter_records_in_given_range(
+            city, start_dt, end_dt, after,
+            limit + 1 if limit is not None else None
         )
 
+        if options.get('stream'):
+            return Response(
+                _stream_in_request_snapshot(
+                    cls.build_streamed_json_response(
+                        city, start_dt, end_dt, forecast_records, limit
+                    )
+                ),
+                mimetype='application/json'
+            )
+
+        with timed_stage('query'):
+            forecast_records = list(forecast_records)
+
+        with timed_stage('build_json'):
+            next_token = None
+            if limit is not None and len(forecast_records) > limit:
+                forecast_records = forecast_records[:limit]
+                next_token = cls.encode_next_token(forecast_records[-1])
+
+            return cls.build_json_response(
+                city, start_dt, end_dt, forecast_records, True, next_token
+            )
+
 
 class MovingAverageApi(Resource):
     @staticmethod
     def build_json_response(
-            city: str, value_type: str, n: str, moving_average: list
+            city: str, value_type: str, n: str, window: str,
+            moving_average: list
     ) -> dict:
 
         return {
@@ -144,11 +402,13 @@ class MovingAverageApi(Resource):
             'n': n,
             'moving_average': {
                 'value_type': value_type,
+                'window': window,
                 'values': moving_average
             }
         }
 
     @classmethod
+    @cached_response
     @swag_from('yml_for_swagger/moving_average_swagger.yml')
     def get(cls) -> dict:
         errors = moving_average_schema.validate(request.args)
@@ -158,24 +418,253 @@ class MovingAverageApi(Resource):
 
         args = request.args
         city, value_type, n = args['city'], args['value_type'], args['n']
+        window = args.get('window', 'simple')
+        start_dt, end_dt = args.get('start_dt'), args.get('end_dt')
+
+        if window == 'simple':
+            moving_average = None
+            try:
+                if config.use_column_store:
+                    moving_average = (
+                        _get_column_store().select_moving_average_of_column(
+                            city, value_type, int(n), start_dt, end_dt
+                        )
+                    )
+                else:
+                    moving_average = [
+                        moving_avg for _, moving_avg, *_ in
+                        WeatherForecast.select_moving_aggregates_of_column(
+                            city, value_type, int(n), start_dt, end_dt
+                        )
+                    ]
+            except ValueError as error:
+                abort(404, msg=str(error))
+
+            return cls.build_json_response(
+                city, value_type, n, window, moving_average
+            )
 
-        column_values = WeatherForecast.select_records_of_given_column(
-            city, value_type
-        )
+        if start_dt or end_dt:
+            abort(
+                404, msg='start_dt and end_dt are available '
+                         'only for the simple window.'
+            )
+
+        if config.use_column_store:
+            column_store = _get_column_store()
+            select_values = (
+                column_store.select_dated_column_values if window == 'time'
+                else column_store.select_column_values
+            )
+            column_values = select_values(city, value_type)
+        elif window == 'time':
+            column_values = [
+                (date, value if value else 0)
+                for date, value in
+                WeatherForecast.select_dated_records_of_given_column(
+                    city, value_type
+                )
+            ]
+        else:
+            column_values = [
+                value[0] if value[0] else 0 for value in
+                WeatherForecast.select_records_of_given_column(
+                    city, value_type
+                )
+            ]
 
         moving_average = None
         try:
             moving_average = calculate_moving_average(
-                [value[0] if value[0] else 0 for value in column_values],
-                int(n)
+                column_values, int(n), window
             )
         except ValueError as error:
             abort(404, msg=str(error))
 
-        return cls.build_json_response(city, value_type, n, moving_average)
+        return cls.build_json_response(
+            city, value_type, n, window, moving_average
+        )
+
+
+class RollupApi(Resource):
+    @staticmethod
+    def build_json_response(
+            city: str, value_type: str, period: str, buckets: List[dict]
+    ) -> dict:
+
+        return {
+            'city': city,
+            'rollup': {
+                'value_type': value_type,
+                'period': period,
+                'buckets': buckets
+            }
+        }
+
+    @classmethod
+    @cached_response
+    @swag_from('yml_for_swagger/rollup_swagger.yml')
+    def get(cls) -> dict:
+        errors = rollup_schema.validate(request.args)
+
+        if errors:
+            abort(404, msg=str(errors))
+
+        args = request.args
+        city, value_type = args['city'], args['value_type']
+        period = args['period']
+
+        buckets = None
+        try:
+            buckets = WeatherForecast.select_rollups_of_column(
+                city, value_type, period,
+                args.get('start_dt'), args.get('end_dt')
+            )
+        except ValueError as error:
+            abort(404, msg=str(error))
+
+        return cls.build_json_response(city, value_type, period, buckets)
+
+
+class StatsApi(Resource):
+    @staticmethod
+    def parse_percentiles(value: str) -> List[float]:
+        try:
+            percentiles = [float(item) for item in value.split(',')]
+        except ValueError:
+            percentiles = []
+
+        if not percentiles or not all(0 <= p <= 100 for p in percentiles):
+            raise ValueError(
+                'percentiles must be comma separated numbers in [0, 100].'
+            )
+
+        return percentiles
+
+    @staticmethod
+    def build_json_response(
+            city: str, value_type: str, distribution: dict
+    ) -> dict:
+
+        return {
+            'city': city,
+            'stats': {
+                'value_type': value_type,
+                'count': distribution['count'],
+                'min': distribution['min'],
+                'max': distribution['max'],
+                'relative_error': RELATIVE_ACCURACY,
+                'percentiles': [
+                    {'percentile': percentile, 'value': value}
+                    for percentile, value
+                    in distribution['percentiles'].items()
+                ],
+                'histogram': distribution['histogram']
+            }
+        }
+
+    @classmethod
+    @cached_response
+    @swag_from('yml_for_swagger/stats_swagger.yml')
+    def get(cls) -> dict:
+        errors = stats_schema.validate(request.args)
+
+        if errors:
+            abort(404, msg=str(errors))
+
+        args = stats_schema.load(request.args)
+        city, value_type = args['city'], args['value_type']
+
+        distribution = None
+        try:
+            percentiles = cls.parse_percentiles(
+                args.get('percentiles', '10,50,90')
+            )
+            distribution = WeatherForecast.select_distribution_of_column(
+                city, value_type, percentiles, args.get('bins', 10)
+            )
+        except ValueError as error:
+            abort(404, msg=str(error))
+
+        return cls.build_json_response(city, value_type, distribution)
+
+
+_resources = (
+    (CitiesApi, '/api/v1/cities/'),
+    (NearbyCitiesApi, '/api/v1/cities/nearby/'),
+    (MeanApi, '/api/v1/mean/'),
+    (MeanBatchApi, '/api/v1/mean/batch/'),
+    (RecordsApi, '/api/v1/records/'),
+    (MovingAverageApi, '/api/v1/moving_mean/'),
+    (RollupApi, '/api/v1/rollup/'),
+    (StatsApi, '/api/v1/stats/'),
+)
+
+
+def _get_column_store():
+    """The column store and NumPy are imported only
+    when use_column_store is set in the config.
+
+    """
+
+    from weather_db.column_store import column_store
+
+    return column_store
+
+
+def _pin_snapshot() -> None:
+    g.snapshot_token = pin_snapshot(config.db_name)
+
+
+def _unpin_snapshot(error: BaseException = None) -> None:
+    token = g.pop('snapshot_token', None)
+
+    if token is not None:
+        unpin_snapshot(token)
+
+
+def _iter_in_snapshot(snapshot: str, chunks: Iterator[str]) -> Iterator[str]:
+    token = pin_snapshot(config.db_name, snapshot)
+
+    try:
+        yield from chunks
+    finally:
+        unpin_snapshot(token)
+
+
+def _stream_in_request_snapshot(chunks: Iterator[str]) -> Iterator[str]:
+    """Streamed responses are read after the teardown of the request,
+    so the snapshot pinned by the request is pinned again for them.
+
+    """
+
+    if not config.snapshot_mode:
+        return chunks
+
+    return _iter_in_snapshot(resolve_db_name(config.db_name), chunks)
+
+
+def init_api(app: Flask) -> Api:
+    """Registers the resources, the docs and the metrics on the app.
+    In the snapshot mode every request reads the snapshot,
+    which was active when the request started.
+
+    """
+
+    api = Api(app)
+
+    for resource, url in _resources:
+        api.add_resource(resource, url)
+
+    if config.snapshot_mode:
+        app.before_request(_pin_snapshot)
+        app.teardown_request(_unpin_snapshot)
+
+    if config.use_column_store:
+        # Imported with the app, not by the first request.
+        _get_column_store()
 
+    init_swagger(app)
+    init_instrumentation(app)
 
-api.add_resource(CitiesApi, '/api/v1/cities/')
-api.add_resource(MeanApi, '/api/v1/mean/')
-api.add_resource(RecordsApi, '/api/v1/records/')
-api.add_resource(MovingAverageApi, '/api/v1/moving_mean/')
+    return api
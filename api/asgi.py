@@ -0,0 +1,50 @@
+"""This module contains an ASGI adapter of the Flask app.
+
+It is asgiref's WsgiToAsgi, which runs the app (and so every SQLite read)
+on a bounded thread pool instead of the single thread shared
+by asgiref's thread sensitive calls. A request holds its thread
+until the response is sent, streamed responses included.
+
+"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+from asgiref.sync import SyncToAsync
+from asgiref.wsgi import WsgiToAsgi as _WsgiToAsgi, WsgiToAsgiInstance
+
+# The undecorated run_wsgi_app, which asgiref runs as thread sensitive.
+_run_wsgi_app = WsgiToAsgiInstance.__dict__['run_wsgi_app'].func
+
+
+class _WsgiToAsgiInstance(WsgiToAsgiInstance):
+    def __init__(self, wsgi_app: Callable, executor: ThreadPoolExecutor):
+        super().__init__(wsgi_app)
+        self._executor = executor
+
+    async def run_wsgi_app(self, body) -> None:
+        await SyncToAsync(
+            _run_wsgi_app, thread_sensitive=False, executor=self._executor
+        )(self, body)
+
+
+class WsgiToAsgi(_WsgiToAsgi):
+    def __init__(self, wsgi_app: Callable, max_threads: int = 16):
+        super().__init__(wsgi_app)
+        self._max_threads = max_threads
+
+        # Created in the serving process, not in the one importing the app.
+        self._executor = None
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                self._max_threads, thread_name_prefix='asgi-worker'
+            )
+
+        return self._executor
+
+    async def __call__(self, scope: dict, receive: Callable, send: Callable):
+        await _WsgiToAsgiInstance(self.wsgi_application, self.executor)(
+            scope, receive, send
+        )
@@ -0,0 +1,36 @@
+"""This module attaches the yml docs to the resources.
+
+swag_from sets the same attributes as flasgger.swag_from,
+so flasgger reads them when the docs are served,
+but it is not imported when the docs are disabled.
+
+"""
+import os
+from typing import Callable
+
+from flask import Flask
+
+import config
+
+_root_path = os.path.dirname(os.path.abspath(__file__))
+
+
+def swag_from(specs_path: str) -> Callable:
+    def decorator(function: Callable) -> Callable:
+        function.swag_path = os.path.join(_root_path, specs_path)
+        function.swag_type = specs_path.rsplit('.', 1)[-1]
+
+        return function
+
+    return decorator
+
+
+def init_swagger(app: Flask) -> None:
+    """Serves the docs on /apidocs/ if they are enabled in the config."""
+
+    if not config.swagger_enabled:
+        return
+
+    from flasgger import Swagger
+
+    Swagger(app)
@@ -0,0 +1,66 @@
+"""This module contains latency metrics of the API requests
+and the /metrics endpoint in the Prometheus text format.
+
+"""
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+from flask import Flask, Response, g, request
+
+from support_functions.metrics import registry
+
+request_seconds = registry.histogram(
+    'api_request_seconds', 'Latency of the API requests.', ('route',)
+)
+requests_total = registry.counter(
+    'api_requests_total', 'Number of the API requests.',
+    ('route', 'method', 'status')
+)
+stage_seconds = registry.histogram(
+    'api_stage_seconds', 'Latency of the stages of the API requests.',
+    ('route', 'stage')
+)
+
+
+def _get_route() -> str:
+    # Rules are used instead of paths to keep the number of labels bounded.
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+
+@contextmanager
+def timed_stage(stage: str) -> Iterator[None]:
+    """Times a stage of the current request, for example the validation."""
+
+    with stage_seconds.time(_get_route(), stage):
+        yield
+
+
+def _start_timer() -> None:
+    g.request_started = time.perf_counter()
+
+
+def _observe_request(response: Response) -> Response:
+    started = g.pop('request_started', None)
+    route = _get_route()
+
+    if started is not None:
+        request_seconds.observe(time.perf_counter() - started, route)
+
+    requests_total.inc(route, request.method, str(response.status_code))
+
+    return response
+
+
+def get_metrics() -> Response:
+    return Response(
+        registry.render(), content_type='text/plain; version=0.0.4'
+    )
+
+
+def init_instrumentation(app: Flask) -> None:
+    """Times every request of the app and adds the /metrics endpoint."""
+
+    app.before_request(_start_timer)
+    app.after_request(_observe_request)
+    app.add_url_rule('/metrics', 'metrics', get_metrics)
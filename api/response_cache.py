@@ -0,0 +1,146 @@
+"""This module contains an LRU/TTL cache of the JSON API responses.
+
+Responses are stored as ready JSON bytes together with their ETag
+and the data version they were built from,
+so a new data version invalidates all of them at once.
+
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from typing import Callable, NamedTuple, Union
+
+from flask import Response, request
+
+from api.instrumentation import timed_stage
+from support_functions.metrics import registry
+from weather_db.db_manager import DataVersion
+
+
+class CachedResponse(NamedTuple):
+    data_version: int
+    created_at: float
+    body: bytes
+    etag: str
+
+
+class ResponseCache:
+    def __init__(self, max_size: int = 1024, ttl: float = 300.0):
+        self._max_size = max_size
+        self._ttl = ttl
+
+        self._responses = OrderedDict()
+        self._lock = threading.Lock()
+
+        self._stats = {'hits': 0, 'misses': 0, 'not_modified': 0}
+
+    def get(
+            self, key: tuple, data_version: int
+    ) -> Union[CachedResponse, None]:
+        with self._lock:
+            response = self._responses.get(key)
+
+            if (
+                    response is None
+                    or response.data_version != data_version
+                    or time.monotonic() - response.created_at > self._ttl
+            ):
+                self._stats['misses'] += 1
+                return None
+
+            self._responses.move_to_end(key)
+            self._stats['hits'] += 1
+
+        return response
+
+    def set(
+            self, key: tuple, data_version: int, body: bytes
+    ) -> CachedResponse:
+        response = CachedResponse(
+            data_version, time.monotonic(), body,
+            hashlib.sha1(body).hexdigest()
+        )
+
+        with self._lock:
+            self._responses[key] = response
+            self._responses.move_to_end(key)
+
+            if len(self._responses) > self._max_size:
+                self._responses.popitem(last=False)
+
+        return response
+
+    def record_not_modified(self) -> None:
+        with self._lock:
+            self._stats['not_modified'] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._responses.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._responses)
+
+        return stats
+
+
+response_cache = ResponseCache()
+
+registry.gauge(
+    'api_response_cache_stats', 'Hits, misses and size of the cache.',
+    lambda: {
+        (stat,): value for stat, value in response_cache.stats().items()
+    },
+    ('stat',)
+)
+
+
+def _get_request_key() -> tuple:
+    # The order of the query args does not change the response.
+    return request.path, tuple(sorted(request.args.items(multi=True)))
+
+
+def cached_response(get_method: Callable) -> Callable:
+    """Decorator for the resources get methods, which return dicts.
+    Successful responses are cached until the data version changes,
+    conditional requests with If-None-Match get 304.
+
+    """
+
+    @wraps(get_method)
+    def wrapper(*args, **kwargs):
+        with timed_stage('cache_lookup'):
+            key = _get_request_key()
+            data_version = DataVersion.get_version()
+
+            cached = response_cache.get(key, data_version)
+        cache_status = 'HIT'
+
+        if cached is None:
+            cache_status = 'MISS'
+            result = get_method(*args, **kwargs)
+
+            # Streamed responses are not cached.
+            if isinstance(result, Response):
+                return result
+
+            with timed_stage('serialize'):
+                body = json.dumps(result).encode()
+            cached = response_cache.set(key, data_version, body)
+
+        response = Response(cached.body, mimetype='application/json')
+        response.set_etag(cached.etag)
+        response.headers['X-Cache'] = cache_status
+        response.make_conditional(request)
+
+        if response.status_code == 304:
+            response_cache.record_not_modified()
+
+        return response
+
+    return wrapper
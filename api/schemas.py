@@ -1,18 +1,60 @@
-from marshmallow import Schema, fields
+from marshmallow import Schema, fields, validate
+
+from support_functions.calculators import WINDOW_KINDS
+from weather_db.rollups import PERIODS
+from weather_db.sketches import SKETCHED_COLUMNS
 
 
 class MeanSchema(Schema):
     value_type = fields.String(required=True)
     city = fields.String(required=True)
+    extended = fields.Boolean()
+
+
+class MeanBatchSchema(Schema):
+    cities = fields.String(required=True)
+    value_types = fields.String(required=True)
 
 
 class RecordsSchema(Schema):
     city = fields.String(required=True)
     start_dt = fields.Date('%Y-%m-%d', required=True)
     end_dt = fields.Date('%Y-%m-%d', required=True)
+    limit = fields.Integer(validate=validate.Range(min=1))
+    next = fields.String()
+    stream = fields.Boolean()
 
 
 class MovingAverageSchema(Schema):
     city = fields.String(required=True)
     value_type = fields.String(required=True)
     n = fields.Integer(required=True)
+    window = fields.String(validate=validate.OneOf(WINDOW_KINDS))
+    start_dt = fields.Date('%Y-%m-%d')
+    end_dt = fields.Date('%Y-%m-%d')
+
+
+class NearbyCitiesSchema(Schema):
+    lat = fields.Float(validate=validate.Range(min=-90, max=90))
+    lon = fields.Float(validate=validate.Range(min=-180, max=180))
+    k = fields.Integer(validate=validate.Range(min=1, max=500))
+    radius = fields.Float(validate=validate.Range(min=0))
+    bbox = fields.String()
+    limit = fields.Integer(validate=validate.Range(min=1, max=500))
+
+
+class RollupSchema(Schema):
+    city = fields.String(required=True)
+    value_type = fields.String(required=True)
+    period = fields.String(required=True, validate=validate.OneOf(PERIODS))
+    start_dt = fields.Date('%Y-%m-%d')
+    end_dt = fields.Date('%Y-%m-%d')
+
+
+class StatsSchema(Schema):
+    city = fields.String(required=True)
+    value_type = fields.String(
+        required=True, validate=validate.OneOf(SKETCHED_COLUMNS)
+    )
+    percentiles = fields.String()
+    bins = fields.Integer(validate=validate.Range(min=1, max=100))
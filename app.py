@@ -1,7 +1,35 @@
-"""Module with app settings."""
+"""Module with the app factory."""
 
 from flask import Flask
 
-app = Flask(__name__)
+import config
 
-db_name = 'weather.db'
+
+def create_app(**settings) -> Flask:
+    """Creates the API app. Passed settings override the ones
+    from the config module, for example create_app(db_name='bench.db').
+
+    """
+
+    for name, value in settings.items():
+        if not hasattr(config, name):
+            raise ValueError(f'There is no setting {name!r}.')
+
+        setattr(config, name, value)
+
+    app = Flask(__name__)
+
+    # Resources are imported here, so tools working only
+    # with the database do not import the web dependencies.
+    from api.api import init_api
+
+    init_api(app)
+
+    if config.refresh_scheduler_enabled:
+        from filler_db_openweather_data.scheduler import RefreshScheduler
+
+        scheduler = RefreshScheduler()
+        scheduler.start()
+        app.extensions['refresh_scheduler'] = scheduler
+
+    return app
@@ -0,0 +1,43 @@
+"""ASGI entry point of the API.
+
+Run it with `python asgi.py` or with any ASGI server:
+`uvicorn asgi:application --workers 4`.
+
+"""
+import argparse
+
+import config
+from app import create_app
+from api.asgi import WsgiToAsgi
+from weather_db.db_manager import WeatherDb
+
+# Threads would only wait for the connections of a smaller pool.
+application = WsgiToAsgi(
+    create_app().wsgi_app,
+    max_threads=min(config.asgi_threads, config.pool_max_size)
+)
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog='python asgi.py')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument(
+        '--workers', type=int, default=config.asgi_workers,
+        help='number of server processes'
+    )
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    args = _parse_args()
+
+    WeatherDb.create_tables()
+
+    uvicorn.run(
+        'asgi:application', host=args.host, port=args.port,
+        workers=args.workers
+    )
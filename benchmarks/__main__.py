@@ -0,0 +1,116 @@
+"""Command line entry point of the benchmarks.
+
+    python -m benchmarks generate --db bench.db --cities 100 --years 5
+    python -m benchmarks micro --db bench.db --output micro.json
+    python -m benchmarks load --db bench.db --requests 5000 --output load.json
+    python -m benchmarks imports --output imports.json
+
+"""
+import argparse
+import json
+
+import config
+
+
+def _parse_args() -> argparse.Namespace:
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument(
+        '--db', default='bench.db', help='database file to benchmark'
+    )
+    common.add_argument('--output', help='JSON file for the results')
+
+    parser = argparse.ArgumentParser(prog='python -m benchmarks')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    generate = commands.add_parser(
+        'generate', parents=[common],
+        help='fill the database with synthetic forecasts'
+    )
+    generate.add_argument('--cities', type=int, default=100)
+    generate.add_argument('--years', type=int, default=5)
+    generate.add_argument('--seed', type=int, default=0)
+    generate.add_argument(
+        '--dry-days-ratio', type=float, default=0.6,
+        help='share of the days with NULL pcp'
+    )
+
+    micro = commands.add_parser(
+        'micro', parents=[common],
+        help='measure the db_manager methods and the calculators'
+    )
+    micro.add_argument('--repeat', type=int, default=50)
+    micro.add_argument('--city', help='city to query, the first by default')
+
+    load = commands.add_parser(
+        'load', parents=[common], help='send requests to the API'
+    )
+    load.add_argument('--requests', type=int, default=1000)
+    load.add_argument('--concurrency', type=int, default=8)
+    load.add_argument('--cities', type=int, default=20)
+    load.add_argument(
+        '--base-url',
+        help='URL of a running server, the Flask test client by default'
+    )
+
+    imports = commands.add_parser(
+        'imports', parents=[common],
+        help='measure the import time of the entry points'
+    )
+    imports.add_argument('--repeat', type=int, default=5)
+
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = _parse_args()
+
+    config.db_name = args.db
+
+    from benchmarks.results import save_results
+
+    if args.command == 'generate':
+        from benchmarks.generator import generate_weather_db
+
+        results = generate_weather_db(
+            args.db, args.cities, args.years, seed=args.seed,
+            dry_days_ratio=args.dry_days_ratio
+        )
+    elif args.command == 'imports':
+        from benchmarks.imports import run_import_benchmarks
+
+        results = run_import_benchmarks(args.repeat)
+    elif args.command == 'micro':
+        from benchmarks.micro import run_microbenchmarks
+
+        results = run_microbenchmarks(args.repeat, args.city)
+    else:
+        from benchmarks.load import build_routes, run_load
+        from weather_db.db_manager import City, WeatherForecast
+
+        cities = City.get_all_cities()[:args.cities]
+        if not cities:
+            raise SystemExit('The database is empty, generate it first.')
+
+        dates = WeatherForecast.select_dated_records_of_given_column(
+            cities[0][1], 'temp'
+        )
+        routes = build_routes(
+            [name for _, name, _, _ in cities], dates[0][0], dates[-1][0],
+            [
+                (lat, lon) for _, _, lat, lon in cities
+                if lat is not None and lon is not None
+            ]
+        )
+
+        results = run_load(
+            routes, args.requests, args.concurrency, args.base_url
+        )
+
+    if args.output:
+        save_results(results, args.output)
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""This module fills a database with synthetic forecasts for the benchmarks.
+
+Every city gets one forecast per day with a seasonal temperature,
+pcp is NULL on dry days, like in the OpenWeatherMap data.
+The schema is created by the migrations, so aggregates
+and versions are maintained the same way as in the real database,
+rollups are refreshed like in WeatherForecast.insert_weather_forecasts.
+
+"""
+import math
+import random
+from datetime import date, timedelta
+from typing import Iterator, List
+
+from weather_db import rollups
+from weather_db.connection_pool import get_pool
+from weather_db.migrations import migrate
+
+
+def generate_cities(cities_count: int, rnd: random.Random) -> List[tuple]:
+    """Returns (name, lat, lon) tuples of the cities."""
+
+    return [
+        (
+            f'City {number:05d}',
+            round(rnd.uniform(44.0, 52.5), 4),
+            round(rnd.uniform(22.0, 40.5), 4)
+        )
+        for number in range(1, cities_count + 1)
+    ]
+
+
+def generate_forecasts(
+        city_id: int, lat: float, start_date: date, days: int,
+        rnd: random.Random, dry_days_ratio: float = 0.6
+) -> Iterator[tuple]:
+    """Yields (city_id, date, temp, pcp, clouds, pressure,
+    humidity, wind_speed) rows of the consecutive days.
+
+    """
+
+    # Northern cities are colder.
+    mean_temp = 28.0 - lat * 0.4
+
+    for day in range(days):
+        current_date = start_date + timedelta(days=day)
+        season = math.cos(
+            2 * math.pi * (current_date.timetuple().tm_yday - 200) / 365
+        )
+
+        pcp = None
+        if rnd.random() >= dry_days_ratio:
+            pcp = round(rnd.gammavariate(0.8, 3.0), 2)
+
+        clouds = rnd.randint(0, 40) if pcp is None else rnd.randint(40, 100)
+
+        yield (
+            city_id, current_date.isoformat(),
+            round(mean_temp + 12 * season + rnd.gauss(0, 3), 2), pcp,
+            clouds, int(rnd.gauss(1013, 8)),
+            min(100, max(20, int(rnd.gauss(60 + clouds * 0.3, 10)))),
+            round(rnd.gammavariate(2.0, 2.0), 2)
+        )
+
+
+def generate_weather_db(
+        db_name: str, cities_count: int = 100, years: int = 5,
+        start_date: date = date(2017, 1, 1), seed: int = 0,
+        dry_days_ratio: float = 0.6
+) -> dict:
+    """Creates the schema in db_name and fills it with synthetic cities
+    and daily forecasts. Cities which already exist are skipped.
+    Returns the numbers of the inserted cities and forecasts.
+
+    """
+
+    rnd = random.Random(seed)
+    days = (start_date.replace(year=start_date.year + years) - start_date).days
+
+    migrate(db_name)
+
+    inserted = {'cities': 0, 'forecasts': 0}
+    pool = get_pool(db_name)
+
+    for name, lat, lon in generate_cities(cities_count, rnd):
+        # Every city is written in its own transaction,
+        # so the generation can be interrupted and continued.
+        with pool.connection() as conn:
+            cur = conn.execute(
+                'INSERT OR IGNORE INTO City("name", latitude, longitude) '
+                'VALUES (?, ?, ?);', (name, lat, lon)
+            )
+            if not cur.rowcount:
+                continue
+
+            cur.executemany(
+                '''INSERT INTO WeatherForecast(
+                    city_id, "date", temp, pcp, clouds,
+                    pressure, humidity, wind_speed
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?);''',
+                generate_forecasts(
+                    cur.lastrowid, lat, start_date, days, rnd, dry_days_ratio
+                )
+            )
+
+            city_forecasts = (
+                '(SELECT city_id, "date" FROM WeatherForecast '
+                f'WHERE city_id = {cur.lastrowid:d})'
+            )
+            for statement in rollups.get_sql_for_refresh(city_forecasts):
+                conn.execute(statement)
+
+            inserted['cities'] += 1
+            inserted['forecasts'] += days
+
+            conn.execute('UPDATE DataVersion SET version = version + 1;')
+
+    with pool.connection() as conn:
+        conn.execute('ANALYZE;')
+
+    return inserted
@@ -0,0 +1,82 @@
+"""This module measures the import time of the entry points.
+
+Every module is imported in a fresh interpreter, so nothing is cached
+between the runs. Heavy third party packages loaded by the import
+are reported, to see which of them a tool drags in.
+
+"""
+import json
+import os
+import subprocess
+import sys
+from statistics import median
+from typing import List, Tuple
+
+ENTRY_POINTS = (
+    ('db_manager', 'import weather_db.db_manager'),
+    ('config', 'import config'),
+    ('filler', 'import filler_db_openweather_data.filler'),
+    ('main', 'import main'),
+    ('app', 'import app'),
+    ('create_app', 'import app; app.create_app()'),
+    (
+        'create_app without swagger',
+        'import app; app.create_app(swagger_enabled=False)'
+    ),
+    ('asgi', 'import asgi'),
+)
+
+_root_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_PACKAGES = (
+    'flask', 'flask_restful', 'flasgger', 'marshmallow',
+    'geopy', 'requests', 'numpy'
+)
+
+_script = '''
+import json, sys, time
+started = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - started
+print(json.dumps({{
+    'elapsed': elapsed,
+    'loaded': [name for name in {packages!r} if name in sys.modules],
+}}))
+'''
+
+
+def measure_import(statement: str) -> dict:
+    output = subprocess.run(
+        [
+            sys.executable, '-c',
+            _script.format(statement=statement, packages=HEAVY_PACKAGES)
+        ],
+        check=True, capture_output=True, text=True, cwd=_root_path
+    ).stdout
+
+    return json.loads(output.splitlines()[-1])
+
+
+def run_import_benchmarks(
+        repeat: int = 5,
+        entry_points: Tuple[Tuple[str, str], ...] = ENTRY_POINTS
+) -> dict:
+    """Returns the median import time in milliseconds
+    and the loaded heavy packages of every entry point.
+
+    """
+
+    results = {}
+
+    for name, statement in entry_points:
+        runs: List[dict] = [measure_import(statement) for _ in range(repeat)]
+
+        results[name] = {
+            'statement': statement,
+            'median_ms': round(
+                median(run['elapsed'] for run in runs) * 1000, 2
+            ),
+            'loaded': runs[-1]['loaded'],
+        }
+
+    return results
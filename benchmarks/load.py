@@ -0,0 +1,242 @@
+"""This module contains a concurrent load driver of the API.
+
+Requests are sent to every /api/v1/* route either through
+the Flask test client (in process) or to a running server,
+latencies are reported per route together with the throughput.
+
+"""
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from itertools import cycle, islice
+from typing import Callable, List, Tuple
+from urllib.parse import urlencode
+
+from benchmarks.results import summarize_latencies
+
+_value_types = ('temp', 'pcp', 'clouds', 'pressure', 'humidity', 'wind_speed')
+_periods = ('week', 'month', 'year')
+_sketched_value_types = ('temp', 'wind_speed', 'pcp')
+
+
+def _build_url(path: str, **params) -> str:
+    return f'{path}?{urlencode(params)}' if params else path
+
+
+def build_routes(
+        city_names: List[str], start_dt: str, end_dt: str,
+        city_points: List[Tuple[float, float]] = ()
+) -> List[Tuple[str, str]]:
+    """Returns (route name, url) pairs, which cover every /api/v1/* route.
+    Cities and value types are rotated, so the response cache
+    holds many different responses. Nearby cities are searched
+    around the (lat, lon) points.
+
+    """
+
+    month_end_dt = min(
+        (date.fromisoformat(start_dt) + timedelta(days=30)).isoformat(),
+        end_dt
+    )
+    routes = [('cities', _build_url('/api/v1/cities/'))]
+
+    for index, city in enumerate(city_names):
+        value_type = _value_types[index % len(_value_types)]
+
+        routes += [
+            (
+                'mean',
+                _build_url('/api/v1/mean/', city=city, value_type=value_type)
+            ),
+            (
+                'mean_extended',
+                _build_url(
+                    '/api/v1/mean/', city=city, value_type=value_type,
+                    extended='true'
+                )
+            ),
+            (
+                'records_month',
+                _build_url(
+                    '/api/v1/records/', city=city,
+                    start_dt=start_dt, end_dt=month_end_dt
+                )
+            ),
+            (
+                'records_page',
+                _build_url(
+                    '/api/v1/records/', city=city,
+                    start_dt=start_dt, end_dt=end_dt, limit=100
+                )
+            ),
+            (
+                'moving_mean_simple',
+                _build_url(
+                    '/api/v1/moving_mean/', city=city,
+                    value_type=value_type, n=7
+                )
+            ),
+            (
+                'moving_mean_exponential',
+                _build_url(
+                    '/api/v1/moving_mean/', city=city,
+                    value_type=value_type, n=7, window='exponential'
+                )
+            ),
+            (
+                'rollup',
+                _build_url(
+                    '/api/v1/rollup/', city=city, value_type=value_type,
+                    period=_periods[index % len(_periods)]
+                )
+            ),
+            (
+                'stats',
+                _build_url(
+                    '/api/v1/stats/', city=city,
+                    value_type=_sketched_value_types[
+                        index % len(_sketched_value_types)
+                    ],
+                    percentiles='1,50,99', bins=20
+                )
+            ),
+        ]
+
+    for lat, lon in city_points:
+        routes += [
+            (
+                'nearby_k',
+                _build_url('/api/v1/cities/nearby/', lat=lat, lon=lon, k=10)
+            ),
+            (
+                'nearby_radius',
+                _build_url(
+                    '/api/v1/cities/nearby/', lat=lat, lon=lon, radius=100
+                )
+            ),
+            (
+                'nearby_bbox',
+                _build_url(
+                    '/api/v1/cities/nearby/',
+                    bbox=f'{lat - 1},{lon - 1},{lat + 1},{lon + 1}'
+                )
+            ),
+        ]
+
+    routes.append((
+        'mean_batch',
+        _build_url(
+            '/api/v1/mean/batch/', cities=','.join(city_names[:10]),
+            value_types='all'
+        )
+    ))
+
+    return routes
+
+
+def _get_test_client_sender() -> Callable[[], Callable[[str], tuple]]:
+    from app import create_app
+
+    app = create_app()
+
+    def create_sender():
+        client = app.test_client()
+
+        def send(url: str) -> tuple:
+            response = client.get(url)
+            return response.status_code, response.headers.get('X-Cache')
+
+        return send
+
+    return create_sender
+
+
+def _get_http_sender(base_url: str) -> Callable[[], Callable[[str], tuple]]:
+    import requests
+
+    def create_sender():
+        session = requests.Session()
+
+        def send(url: str) -> tuple:
+            response = session.get(f'{base_url}{url}')
+            return response.status_code, response.headers.get('X-Cache')
+
+        return send
+
+    return create_sender
+
+
+def run_load(
+        routes: List[Tuple[str, str]], total_requests: int = 1000,
+        concurrency: int = 8, base_url: str = None
+) -> dict:
+    """Sends total_requests requests from concurrency threads,
+    the routes are taken in turn. Without base_url the requests
+    are sent through the Flask test client.
+
+    """
+
+    create_sender = (
+        _get_test_client_sender() if base_url is None
+        else _get_http_sender(base_url.rstrip('/'))
+    )
+
+    requests_left = islice(cycle(routes), total_requests)
+    lock = threading.Lock()
+
+    latencies = defaultdict(list)
+    statuses = defaultdict(Counter)
+    cache_statuses = defaultdict(Counter)
+
+    def worker() -> None:
+        send = create_sender()
+
+        while True:
+            with lock:
+                route = next(requests_left, None)
+            if route is None:
+                return
+
+            route_name, url = route
+
+            started = time.perf_counter()
+            try:
+                status, cache_status = send(url)
+            except Exception as error:
+                status, cache_status = type(error).__name__, None
+            latency = time.perf_counter() - started
+
+            with lock:
+                latencies[route_name].append(latency)
+                statuses[route_name][str(status)] += 1
+                cache_statuses[route_name][cache_status or 'NONE'] += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        for future in [executor.submit(worker) for _ in range(concurrency)]:
+            future.result()
+    elapsed = time.perf_counter() - started
+
+    all_latencies = [
+        latency for route_latencies in latencies.values()
+        for latency in route_latencies
+    ]
+
+    return {
+        'mode': 'http' if base_url else 'test_client',
+        'concurrency': concurrency,
+        'requests': len(all_latencies),
+        'elapsed_s': round(elapsed, 4),
+        'throughput_rps': round(len(all_latencies) / elapsed, 2),
+        'latency': summarize_latencies(all_latencies),
+        'routes': {
+            route_name: {
+                **summarize_latencies(route_latencies),
+                'statuses': dict(statuses[route_name]),
+                'cache': dict(cache_statuses[route_name]),
+            }
+            for route_name, route_latencies in sorted(latencies.items())
+        },
+    }
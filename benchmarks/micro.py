@@ -0,0 +1,200 @@
+"""This module contains microbenchmarks of the db_manager methods
+and of the moving average calculators.
+
+"""
+import random
+import time
+from datetime import date, timedelta
+from typing import Callable, Iterator, List, Tuple
+
+from support_functions.calculators import (
+    WINDOW_KINDS, calculate_moving_average
+)
+from weather_db.db_manager import City, WeatherForecast
+
+from benchmarks.results import summarize_latencies
+
+
+def measure(function: Callable, repeat: int, warmup: int = 1) -> dict:
+    """Calls the function repeat times and summarizes the latencies.
+    Errors are reported instead of the latencies.
+
+    """
+
+    try:
+        for _ in range(warmup):
+            function()
+
+        latencies = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            function()
+            latencies.append(time.perf_counter() - started)
+    except Exception as error:
+        return {'error': repr(error)}
+
+    return summarize_latencies(latencies)
+
+
+def _iter_db_cases(
+        city: Tuple[int, str, float, float], repeat: int
+) -> Iterator[Tuple[str, Callable, int]]:
+    """Yields (name, function, repeat) of every City
+    and WeatherForecast method.
+
+    """
+
+    city_id, name, lat, lon = city
+    forecasts = WeatherForecast.select_columns_of_city(city_id)
+    start_dt = forecasts[0][0]
+    end_dt = forecasts[min(30, len(forecasts) - 1)][0]
+    # Upserts of the same rows do not change the data.
+    month = [(city_id, *forecast) for forecast in forecasts[:31]]
+    column = 'temp'
+    full_scan_repeat = max(repeat // 10, 1)
+
+    yield 'City.get_all_cities', City.get_all_cities, repeat
+    yield (
+        'City.get_city_id_by_name',
+        lambda: City.get_city_id_by_name(name), repeat
+    )
+    yield (
+        'City.get_cached_city_id_by_name',
+        lambda: City.get_cached_city_id_by_name(name), repeat
+    )
+    yield (
+        'City.get_city_data_by_id',
+        lambda: City.get_city_data_by_id(city_id), repeat
+    )
+    yield (
+        'City.insert_city', lambda: City.insert_city(name, (lat, lon)), repeat
+    )
+    yield (
+        'City.insert_cities',
+        lambda: City.insert_cities([(name, lat, lon)]), repeat
+    )
+
+    yield (
+        'WeatherForecast.select_all_weather_forecasts',
+        WeatherForecast.select_all_weather_forecasts, full_scan_repeat
+    )
+    yield (
+        'WeatherForecast.select_mean_value_of_column',
+        lambda: WeatherForecast.select_mean_value_of_column(name, column),
+        repeat
+    )
+    yield (
+        'WeatherForecast.select_column_statistics',
+        lambda: WeatherForecast.select_column_statistics(name, column),
+        repeat
+    )
+    yield (
+        'WeatherForecast.select_mean_values_of_columns',
+        WeatherForecast.select_mean_values_of_columns, repeat
+    )
+    yield (
+        'WeatherForecast.select_records_in_given_range',
+        lambda: WeatherForecast.select_records_in_given_range(
+            name, start_dt, end_dt
+        ),
+        repeat
+    )
+    yield (
+        'WeatherForecast.iter_records_in_given_range',
+        lambda: list(WeatherForecast.iter_records_in_given_range(
+            name, start_dt, '9999-12-31', limit=100
+        )),
+        repeat
+    )
+    yield (
+        'WeatherForecast.select_records_of_given_column',
+        lambda: WeatherForecast.select_records_of_given_column(name, column),
+        repeat
+    )
+    yield (
+        'WeatherForecast.select_dated_records_of_given_column',
+        lambda: WeatherForecast.select_dated_records_of_given_column(
+            name, column
+        ),
+        repeat
+    )
+    yield (
+        'WeatherForecast.select_columns_of_city',
+        lambda: WeatherForecast.select_columns_of_city(city_id), repeat
+    )
+    yield (
+        'WeatherForecast.select_moving_aggregates_of_column',
+        lambda: WeatherForecast.select_moving_aggregates_of_column(
+            name, column, 7
+        ),
+        repeat
+    )
+    yield (
+        'WeatherForecast.insert_weather_forecast',
+        lambda: WeatherForecast.insert_weather_forecast(name, *forecasts[0]),
+        repeat
+    )
+    yield (
+        'WeatherForecast.insert_weather_forecasts',
+        lambda: WeatherForecast.insert_weather_forecasts(month), repeat
+    )
+
+
+def _iter_calculator_cases(
+        repeat: int, sizes: Tuple[int, ...] = (1_000, 100_000),
+        windows: Tuple[int, ...] = (7, 30)
+) -> Iterator[Tuple[str, Callable, int]]:
+    rnd = random.Random(0)
+
+    for size in sizes:
+        values = [rnd.gauss(10, 5) for _ in range(size)]
+        dated_values = [
+            ((date(2000, 1, 1) + timedelta(days=day)).isoformat(), value)
+            for day, value in enumerate(values)
+        ]
+        # Big inputs are measured less times.
+        size_repeat = max(repeat * 1_000 // size, 3)
+
+        for kind in WINDOW_KINDS:
+            data = dated_values if kind == 'time' else values
+
+            for n in windows:
+                yield (
+                    f'calculate_moving_average[{kind}, size={size}, n={n}]',
+                    lambda data=data, n=n, kind=kind:
+                        calculate_moving_average(data, n, kind),
+                    size_repeat
+                )
+
+
+def run_microbenchmarks(
+        repeat: int = 50, city_name: str = None
+) -> dict:
+    """Measures every City and WeatherForecast method on the given
+    (or the first) city and calculate_moving_average on random data.
+
+    """
+
+    cities = City.get_all_cities()
+    if not cities:
+        raise ValueError('The database is empty, generate it first.')
+
+    city = cities[0]
+    if city_name is not None:
+        city = next(
+            (city for city in cities if city[1] == city_name), None
+        )
+        if city is None:
+            raise ValueError(f'There is no city {city_name!r}.')
+
+    cases: List[Tuple[str, Callable, int]] = [
+        *_iter_db_cases(city, repeat), *_iter_calculator_cases(repeat)
+    ]
+
+    return {
+        'city': city[1],
+        'benchmarks': {
+            name: measure(function, case_repeat)
+            for name, function, case_repeat in cases
+        },
+    }
@@ -0,0 +1,74 @@
+"""This module contains helpers to summarize and save benchmark results."""
+import json
+import math
+import platform
+import sqlite3
+import sys
+import time
+from typing import List
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Nearest-rank percentile of the already sorted values."""
+
+    if not sorted_values:
+        return math.nan
+
+    rank = math.ceil(q / 100 * len(sorted_values))
+
+    return sorted_values[min(max(rank, 1), len(sorted_values)) - 1]
+
+
+def summarize_latencies(latencies: List[float]) -> dict:
+    """Returns count, mean, p50, p95, p99 and max of the latencies
+    in milliseconds. Latencies are passed in seconds.
+
+    """
+
+    latencies = sorted(latencies)
+
+    if not latencies:
+        return {'count': 0}
+
+    def to_ms(seconds: float) -> float:
+        return round(seconds * 1000, 4)
+
+    return {
+        'count': len(latencies),
+        'mean_ms': to_ms(sum(latencies) / len(latencies)),
+        'p50_ms': to_ms(percentile(latencies, 50)),
+        'p95_ms': to_ms(percentile(latencies, 95)),
+        'p99_ms': to_ms(percentile(latencies, 99)),
+        'max_ms': to_ms(latencies[-1]),
+    }
+
+
+def get_environment() -> dict:
+    try:
+        import numpy
+        numpy_version = numpy.__version__
+    except ImportError:
+        numpy_version = None
+
+    return {
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'sqlite': sqlite3.sqlite_version,
+        'numpy': numpy_version,
+    }
+
+
+def save_results(results: dict, path: str) -> None:
+    """Saves the results with the environment and the time of the run,
+    so results of different runs can be compared.
+
+    """
+
+    document = {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'environment': get_environment(),
+        'results': results,
+    }
+
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(document, file, indent=2)
@@ -0,0 +1,100 @@
+"""Module with the settings.
+
+Every setting can be overridden with an environment variable
+named as the setting in upper case with the WEATHER_ prefix,
+for example WEATHER_DB_NAME=bench.db.
+This module must stay free of heavy imports,
+it is imported by every tool working with the database.
+
+"""
+import os
+from typing import Callable, Union
+
+
+def _to_bool(value: str) -> bool:
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def _to_optional_float(value: str) -> Union[float, None]:
+    return None if value.strip().lower() in ('', 'none') else float(value)
+
+
+def _get_setting(name: str, default, convert: Callable = str):
+    value = os.getenv(f'WEATHER_{name.upper()}')
+
+    return default if value is None else convert(value)
+
+
+db_name = _get_setting('db_name', 'weather.db')
+
+# Ingestion writes to a copy of the database, which is published
+# as a whole when finished, so readers never wait on the writer
+# (see weather_db.snapshots).
+snapshot_mode = _get_setting('snapshot_mode', False, _to_bool)
+# Snapshots are built one at a time, a build waits for the running one
+# up to this number of seconds.
+snapshot_lock_timeout = _get_setting('snapshot_lock_timeout', 3600, float)
+
+# Analytics endpoints are answered from the in-memory columnar store
+# instead of SQLite (see weather_db.column_store).
+use_column_store = _get_setting('use_column_store', False, _to_bool)
+
+# Statements slower than this number of seconds are logged
+# with their query plans (see weather_db.query_metrics), None disables it.
+slow_query_seconds = _get_setting(
+    'slow_query_seconds', 0.25, _to_optional_float
+)
+slow_query_explain = _get_setting('slow_query_explain', True, _to_bool)
+
+# Swagger docs on /apidocs/, flasgger is not imported without them.
+swagger_enabled = _get_setting('swagger_enabled', True, _to_bool)
+
+# ASGI serving mode (see asgi.py): number of server processes
+# and number of threads per process, which run the app and SQLite reads.
+asgi_workers = _get_setting('asgi_workers', 1, int)
+asgi_threads = _get_setting('asgi_threads', 16, int)
+
+# Connections of every database file per process. Every ASGI thread
+# can hold one (a streamed response for the whole stream),
+# a few more are left for the background work.
+pool_max_size = _get_setting('pool_max_size', asgi_threads + 4, int)
+
+# Cache of the openweathermap responses (see openweathermap.onecall_cache):
+# responses are fresh for onecall_cache_ttl seconds (None disables the cache)
+# and are served stale up to onecall_cache_max_stale seconds:
+# by OpenWeatherMapParser while they are refreshed in the background,
+# by the fetcher only when a new response can not be received.
+onecall_cache_db_name = _get_setting(
+    'onecall_cache_db_name', 'onecall_cache.db'
+)
+onecall_cache_ttl = _get_setting(
+    'onecall_cache_ttl', 3 * 60 * 60, _to_optional_float
+)
+onecall_cache_max_stale = _get_setting(
+    'onecall_cache_max_stale', 24 * 60 * 60, float
+)
+
+# Background refresh of the forecasts
+# (see filler_db_openweather_data.scheduler): every city is fetched again
+# refresh_interval seconds after its last successful fetch,
+# spread by +-refresh_jitter of the interval.
+# With refresh_scheduler_enabled the scheduler runs in a thread of the API,
+# it can run as a separate process as well.
+refresh_scheduler_enabled = _get_setting(
+    'refresh_scheduler_enabled', False, _to_bool
+)
+refresh_interval = _get_setting('refresh_interval', 3 * 60 * 60, float)
+refresh_jitter = _get_setting('refresh_jitter', 0.1, float)
+refresh_max_workers = _get_setting('refresh_max_workers', 4, int)
+refresh_requests_per_minute = _get_setting(
+    'refresh_requests_per_minute', 60, float
+)
+# In the snapshot mode every refresh copies the whole database,
+# so the scheduler waits until refresh_snapshot_min_cities cities are due
+# or the most overdue one waits refresh_snapshot_max_delay seconds.
+refresh_snapshot_min_cities = _get_setting(
+    'refresh_snapshot_min_cities', 100, int
+)
+refresh_snapshot_max_delay = _get_setting(
+    'refresh_snapshot_max_delay', 15 * 60, float
+)
@@ -0,0 +1,368 @@
+"""This module imports directories of raw OneCall JSON dumps.
+
+Dumps (written by OpenWeatherMapParser.write_json_data,
+optionally gzip-compressed) are read and converted by a process pool.
+Cities are matched by the coordinates with the City table,
+so the import never goes to the network. The converted rows are
+written by a single writer, every batch in one transaction,
+while the pool parses the next dumps, so the memory of the import
+does not grow with the number of the dumps.
+
+    python -m filler_db_openweather_data.bulk_import dumps/ --workers 8
+
+"""
+import argparse
+import math
+import os
+import sqlite3
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Tuple, Union
+
+import config
+from filler_db_openweather_data.pipeline import PipelineStats, stage_seconds
+from openweathermap.weather_parser import OpenWeatherMapParser
+# The same conversion as in the pipeline, without the city lookup.
+from support_functions.converters import _convert_daily_data
+from weather_db.db_manager import City, WeatherDb, WeatherForecast
+from weather_db.snapshots import staging_snapshot
+from weather_db.spatial_index import SpatialIndex
+
+DUMP_SUFFIXES = ('.json', '.json.gz')
+
+
+class ImportStats(PipelineStats):
+    """Only the first max_errors errors are kept, the rest are counted
+    in errors_dropped, so a directory of bad dumps does not grow
+    the memory of the import.
+
+    """
+
+    _counters = (
+        'files_read', 'files_failed', 'files_unmatched', 'rows_parsed',
+        'rows_written', 'rows_inserted', 'rows_updated', 'rows_unchanged',
+        'batches_written', 'errors_dropped'
+    )
+
+    def __init__(self, max_errors: int = 100):
+        super().__init__()
+        self._max_errors = max_errors
+
+    def add_error(self, message: str) -> None:
+        with self._lock:
+            if len(self.errors) < self._max_errors:
+                self.errors.append(message)
+            else:
+                self._values['errors_dropped'] += 1
+
+
+class ParsedDump(NamedTuple):
+    filepath: str
+    coords: Union[Tuple[float, float], None] = None
+    # Time of the first forecasted day, the latest dump wins.
+    issued: int = 0
+    # (date, temp, pcp, clouds, pressure, humidity, wind_speed) rows.
+    rows: Tuple[tuple, ...] = ()
+    error: Union[str, None] = None
+
+
+def iter_dump_files(directory: str) -> Iterator[str]:
+    """Yields paths of the dumps in the directory and its subdirectories
+    in a stable order.
+
+    """
+
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+
+        for filename in sorted(files):
+            if filename.endswith(DUMP_SUFFIXES):
+                yield os.path.join(root, filename)
+
+
+def parse_dump(filepath: str) -> ParsedDump:
+    """Reads and converts the dump, runs in the worker processes."""
+
+    try:
+        data = OpenWeatherMapParser.read_json_data_from_file(filepath)
+
+        rows = tuple(
+            tuple(daily_data.values())
+            for daily_data in _convert_daily_data(data['daily'])
+        )
+        issued = min((day['dt'] for day in data['daily']), default=0)
+
+        return ParsedDump(filepath, (data['lat'], data['lon']), issued, rows)
+    except (OSError, ValueError, KeyError, TypeError) as error:
+        return ParsedDump(filepath, error=repr(error))
+
+
+def parse_dumps(filepaths: List[str]) -> List[ParsedDump]:
+    return [parse_dump(filepath) for filepath in filepaths]
+
+
+class LatestForecasts:
+    """Keeps for every written (city_id, date) the issued time
+    of its dump, so the forecasts of older dumps are not written
+    over the newer ones. The times are kept in a private temporary
+    database, which SQLite moves to disk when it grows.
+
+    """
+
+    def __init__(self):
+        self._conn = sqlite3.connect('')
+        self._conn.execute(
+            '''CREATE TABLE Issued
+            (
+                city_id INTEGER NOT NULL,
+                "date" TEXT NOT NULL,
+                issued INTEGER NOT NULL,
+
+                PRIMARY KEY (city_id, "date")
+            ) WITHOUT ROWID;
+            '''
+        )
+
+    def select_latest_rows(
+            self, city_id: int, issued: int, rows: Tuple[tuple, ...]
+    ) -> List[tuple]:
+        """Returns the (city_id, date, ...) rows of the dump,
+        which are not forecasted by a later dump already,
+        and saves the issued time of them.
+
+        """
+
+        if not rows:
+            return []
+
+        dates = [row[0] for row in rows]
+
+        with self._conn:
+            cur = self._conn.execute(
+                '''SELECT "date" FROM Issued
+                WHERE city_id = ? AND "date" BETWEEN ? AND ? AND issued > ?;
+                ''',
+                (city_id, min(dates), max(dates), issued)
+            )
+            newer_dates = {date for date, in cur}
+
+            latest_rows = [
+                (city_id, *row) for row in rows if row[0] not in newer_dates
+            ]
+
+            self._conn.executemany(
+                '''INSERT OR REPLACE INTO Issued(city_id, "date", issued)
+                VALUES (?, ?, ?);
+                ''',
+                [(city_id, row[1], issued) for row in latest_rows]
+            )
+
+        return latest_rows
+
+    def close(self) -> None:
+        """Removes the temporary database."""
+
+        self._conn.close()
+
+
+class CityMatcher:
+    """Finds the nearest city of the City table to the coordinates
+    of a dump, within max_distance degrees. Only the cities
+    of the grid cells around the dump are compared.
+
+    """
+
+    def __init__(self, cities: List[tuple], max_distance: float = 0.05):
+        self._index = SpatialIndex(cities)
+        self._max_distance = max_distance
+        self._matched: Dict[tuple, Union[int, None]] = {}
+
+    def _find_city_id(self, lat: float, lon: float) -> Union[int, None]:
+        distance = self._max_distance
+        west = (lon - distance + 180) % 360 - 180
+        east = (lon + distance + 180) % 360 - 180
+
+        try:
+            candidates = self._index.within_bbox(
+                max(lat - distance, -90), west, min(lat + distance, 90), east,
+                limit=len(self._index)
+            )
+        except ValueError:
+            # Coordinates of the dump are out of range.
+            return None
+
+        distance, city_id = min(
+            (
+                (
+                    math.hypot(
+                        lat - city_lat, (lon - city_lon + 180) % 360 - 180
+                    ),
+                    city_id
+                )
+                for _, (city_id, _, city_lat, city_lon) in candidates
+            ),
+            default=(math.inf, None)
+        )
+
+        return city_id if distance <= self._max_distance else None
+
+    def get_city_id(self, coords: Tuple[float, float]) -> Union[int, None]:
+        if coords not in self._matched:
+            self._matched[coords] = self._find_city_id(*coords)
+
+        return self._matched[coords]
+
+
+class BulkImporter:
+    """Dumps are parsed by chunk_size in max_workers processes,
+    not more than two chunks per process are parsed ahead of the writer.
+
+    """
+
+    def __init__(
+            self, max_workers: int = None, batch_size: int = 20000,
+            chunk_size: int = 16, max_distance: float = 0.05,
+            skip_unchanged: bool = True, max_errors: int = 100
+    ):
+        self._max_workers = max_workers
+        self._batch_size = batch_size
+        self._chunk_size = chunk_size
+        self._max_distance = max_distance
+        self._skip_unchanged = skip_unchanged
+
+        self.stats = ImportStats(max_errors)
+
+    def _iter_parsed_dumps(
+            self, filepaths: Iterable[str]
+    ) -> Iterator[ParsedDump]:
+        """Paths are read lazily. Unlike executor.map, which submits
+        all the paths at once, the parsed dumps are not piled up
+        when the writer is slower than the pool.
+
+        """
+
+        if self._max_workers == 1:
+            yield from map(parse_dump, filepaths)
+            return
+
+        filepaths = iter(filepaths)
+        chunks = iter(lambda: list(islice(filepaths, self._chunk_size)), [])
+        max_pending = 2 * (self._max_workers or os.cpu_count() or 1)
+
+        with ProcessPoolExecutor(self._max_workers) as executor:
+            pending = deque()
+
+            for chunk in chunks:
+                pending.append(executor.submit(parse_dumps, chunk))
+
+                if len(pending) >= max_pending:
+                    yield from pending.popleft().result()
+
+            while pending:
+                yield from pending.popleft().result()
+
+    def _write_batch(self, batch: List[tuple]) -> None:
+        with stage_seconds.time('write'):
+            counts = WeatherForecast.insert_weather_forecasts(
+                batch, self._skip_unchanged
+            )
+
+        self.stats.increment('rows_written', len(batch))
+        self.stats.increment('rows_inserted', counts.inserted)
+        self.stats.increment('rows_updated', counts.updated)
+        self.stats.increment('rows_unchanged', counts.unchanged)
+        self.stats.increment('batches_written')
+
+    def run(self, filepaths: Iterable[str]) -> ImportStats:
+        """Imports the dumps. Several dumps can forecast the same day
+        of a city, the forecast of the latest dump is kept:
+        forecasts of the older dumps are skipped or written over.
+
+        """
+
+        matcher = CityMatcher(City.get_all_cities(), self._max_distance)
+        latest_forecasts = LatestForecasts()
+        batch: List[tuple] = []
+
+        try:
+            for dump in self._iter_parsed_dumps(filepaths):
+                if dump.error is not None:
+                    self.stats.increment('files_failed')
+                    self.stats.add_error(f'{dump.filepath}: {dump.error}')
+                    continue
+
+                self.stats.increment('files_read')
+
+                city_id = matcher.get_city_id(dump.coords)
+                if city_id is None:
+                    self.stats.increment('files_unmatched')
+                    self.stats.add_error(
+                        f'{dump.filepath}: no city near {dump.coords}'
+                    )
+                    continue
+
+                self.stats.increment('rows_parsed', len(dump.rows))
+
+                # Rows of a later dump follow the rows of the earlier one
+                # of the same batch, the last row of a day is written.
+                batch += latest_forecasts.select_latest_rows(
+                    city_id, dump.issued, dump.rows
+                )
+
+                if len(batch) >= self._batch_size:
+                    self._write_batch(batch)
+                    batch = []
+
+            if batch:
+                self._write_batch(batch)
+        finally:
+            latest_forecasts.close()
+
+        return self.stats
+
+
+def import_dumps(directory: str, **importer_options) -> ImportStats:
+    """Imports all the dumps of the directory.
+    Keyword arguments are passed to the BulkImporter.
+    In the snapshot mode the dumps are imported into a new snapshot.
+
+    """
+
+    with staging_snapshot(config.db_name):
+        WeatherDb.create_tables()
+
+        return BulkImporter(**importer_options).run(
+            iter_dump_files(directory)
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        prog='python -m filler_db_openweather_data.bulk_import'
+    )
+    parser.add_argument('directory', help='directory with the JSON dumps')
+    parser.add_argument(
+        '--workers', type=int, default=None,
+        help='number of the parsing processes, all CPUs by default'
+    )
+    parser.add_argument('--batch-size', type=int, default=20000)
+    parser.add_argument(
+        '--max-distance', type=float, default=0.05,
+        help='max distance in degrees between a dump and its city'
+    )
+    args = parser.parse_args()
+
+    stats = import_dumps(
+        args.directory, max_workers=args.workers,
+        batch_size=args.batch_size, max_distance=args.max_distance
+    ).as_dict()
+
+    for error in stats.pop('errors'):
+        print(error)
+
+    print(stats)
+
+
+if __name__ == '__main__':
+    main()
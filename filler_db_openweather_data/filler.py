@@ -2,67 +2,41 @@ import os
 
 from typing import List
 
-from weather_db.db_manager import City, WeatherForecast
+import config
+from weather_db.db_manager import City, WeatherDb
+from weather_db.snapshots import staging_snapshot
 
-from openweathermap.weather_parser import OpenWeatherMapParser
-from support_functions.converters import (
-    convert_openweather_data_to_desired_format
+from filler_db_openweather_data.pipeline import (
+    IngestionPipeline, PipelineStats
 )
+from support_functions.metrics import registry
 
-
-def send_requests_for_cities(api_key: str, cities: List[tuple]) -> List[dict]:
-    """For every city sends request to openweather API.
-    All received data are placed in a list that will be returned.
-
-    """
-
-    parser = OpenWeatherMapParser(api_key)
-
-    received_data = []
-
-    for name, lat, lon in cities:
-        received_data.append(
-            parser.get_daily_one_call_request_data((lat, lon))
-        )
-
-    return received_data
-
-
-def _create_weather_data_to_insert(converted_data: dict) -> list:
-    data_to_insert = []
-
-    for daily_data in converted_data['daily']:
-        city = converted_data['city']
-
-        data_to_insert.append(
-            (City.get_city_id_by_name(city), *daily_data.values())
-        )
-
-    return data_to_insert
+run_seconds = registry.histogram(
+    'ingestion_run_seconds', 'Time of the whole fill_weather_db runs.',
+    buckets=(1.0, 5.0, 15.0, 30.0, 60.0, 300.0, 900.0, 1800.0, 3600.0)
+)
 
 
 def fill_weather_db(
-        cities: List[tuple], api_key: str = os.getenv('openweathermap_key')
-) -> None:
+        cities: List[tuple], api_key: str = os.getenv('openweathermap_key'),
+        **pipeline_options
+) -> PipelineStats:
 
     """Function for filling the database. Depending on the specified cities,
     it sends requests to the openweathermap API,
     converts the raw data into a single format
     and inserts the data into the database.
+    Keyword arguments are passed to the IngestionPipeline.
+    In the snapshot mode the data is written to a new snapshot,
+    which is published when the run is finished.
+    Returns counters of the pipeline.
 
     """
 
-    City.insert_cities(cities)
-
-    received_weather_list = send_requests_for_cities(api_key, cities)
-
-    weather_list_length = len(received_weather_list)
-    for index, weather_data in enumerate(received_weather_list):
-        print(f'Processing the {index + 1} requests of {weather_list_length}')
+    with staging_snapshot(config.db_name), run_seconds.time():
+        WeatherDb.create_tables()
+        City.insert_cities(cities)
 
-        converted_data = convert_openweather_data_to_desired_format(
-            weather_data
-        )
-        weather_data_to_insert = _create_weather_data_to_insert(converted_data)
+        pipeline = IngestionPipeline(api_key, **pipeline_options)
 
-        WeatherForecast.insert_weather_forecasts(weather_data_to_insert)
+        return pipeline.run(cities)
@@ -0,0 +1,248 @@
+"""This module contains a streaming ingestion pipeline.
+
+Fetched payloads flow through bounded queues into the conversion stage
+and then into a single writer, which inserts rows by large batches,
+every batch in its own transaction.
+
+"""
+import contextvars
+import threading
+from queue import Empty, Full, Queue
+from typing import Callable, Iterable, List
+
+from openweathermap.fetcher import FetchResult, OpenWeatherMapFetcher
+from openweathermap.onecall_cache import get_onecall_cache
+from openweathermap.weather_parser import OpenWeatherMapParser
+from support_functions.converters import (
+    convert_openweather_data_to_desired_format
+)
+from support_functions.metrics import registry
+from weather_db.db_manager import City, WeatherForecast
+
+# Marks the end of the stream in the queues.
+_STOP = object()
+
+stage_seconds = registry.histogram(
+    'ingestion_stage_seconds',
+    'Time of fetching a city, converting a payload and writing a batch.',
+    ('stage',)
+)
+rows_total = registry.counter(
+    'ingestion_rows_total', 'Number of the written forecast rows.',
+    ('outcome',)
+)
+
+
+class PipelineStats:
+    """Thread-safe counters of the pipeline progress."""
+
+    _counters = (
+        'fetched', 'fetched_stale', 'fetch_failed', 'converted',
+        'convert_failed', 'rows_written', 'rows_inserted', 'rows_updated',
+        'rows_unchanged', 'batches_written'
+    )
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = dict.fromkeys(self._counters, 0)
+        self.errors: List[str] = []
+
+    def increment(self, counter: str, value: int = 1) -> None:
+        with self._lock:
+            self._values[counter] += value
+
+    def add_error(self, message: str) -> None:
+        with self._lock:
+            self.errors.append(message)
+
+    def __getitem__(self, counter: str) -> int:
+        return self._values[counter]
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            stats = dict(self._values)
+            stats['errors'] = list(self.errors)
+
+        return stats
+
+
+def create_weather_rows(converted_data: dict) -> List[tuple]:
+    city_id = City.get_cached_city_id_by_name(converted_data['city'])
+
+    return [
+        (city_id, *daily_data.values())
+        for daily_data in converted_data['daily']
+    ]
+
+
+class IngestionPipeline:
+    def __init__(
+            self, api_key: str, max_workers: int = 8,
+            requests_per_minute: float = 60, queue_size: int = 64,
+            batch_size: int = 5000,
+            on_progress: Callable[[PipelineStats], None] = None,
+            base_url: str = None, skip_unchanged: bool = True,
+            use_cache: bool = True,
+            on_city_done: Callable[[str, bool], None] = None
+    ):
+        self._fetcher = OpenWeatherMapFetcher(
+            OpenWeatherMapParser(
+                api_key, base_url=base_url,
+                cache=get_onecall_cache() if use_cache else None
+            ),
+            max_workers=max_workers,
+            requests_per_minute=requests_per_minute
+        )
+        self._queue_size = queue_size
+        self._batch_size = batch_size
+        self._on_progress = on_progress
+        self._skip_unchanged = skip_unchanged
+        # Called with the city name and True, when rows of the city
+        # are written, or False, when its new data was not received.
+        self._on_city_done = on_city_done
+
+        self.stats = PipelineStats()
+        self._stopped = threading.Event()
+
+    def _put(self, queue: Queue, item) -> None:
+        """Puts the item unless the pipeline was stopped,
+        so stages do not hang on a full queue after the writer failed.
+
+        """
+
+        while not self._stopped.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return
+            except Full:
+                continue
+
+    def _city_done(self, city: str, ok: bool) -> None:
+        if self._on_city_done is not None:
+            self._on_city_done(city, ok)
+
+    def _fetch_stage(self, cities: Iterable[tuple], output: Queue) -> None:
+        try:
+            for result in self._fetcher.iter_fetch(cities):
+                if not result.ok:
+                    self.stats.increment('fetch_failed')
+                    self.stats.add_error(f'{result.city}: {result.error}')
+                    self._city_done(result.city, False)
+                    continue
+
+                self.stats.increment('fetched')
+                if result.stale:
+                    self.stats.increment('fetched_stale')
+                stage_seconds.observe(result.elapsed, 'fetch')
+                self._put(output, result)
+
+                if self._stopped.is_set():
+                    break
+        except Exception as error:
+            self.stats.add_error(f'Fetching was interrupted: {error!r}')
+        finally:
+            self._put(output, _STOP)
+
+    def _convert_stage(self, source: Queue, output: Queue) -> None:
+        try:
+            while True:
+                try:
+                    result = source.get(timeout=0.1)
+                except Empty:
+                    if self._stopped.is_set():
+                        break
+                    continue
+
+                if result is _STOP:
+                    break
+
+                try:
+                    with stage_seconds.time('convert'):
+                        converted_data = (
+                            convert_openweather_data_to_desired_format(
+                                result.data, result.city
+                            )
+                        )
+                        rows = create_weather_rows(converted_data)
+                except (KeyError, TypeError, ValueError) as error:
+                    self.stats.increment('convert_failed')
+                    self.stats.add_error(f'{result.city}: {error!r}')
+                    self._city_done(result.city, False)
+                    continue
+
+                self.stats.increment('converted')
+                self._put(output, (result, rows))
+        finally:
+            self._put(output, _STOP)
+
+    def _write_batch(
+            self, batch: List[tuple], results: List[FetchResult]
+    ) -> None:
+        with stage_seconds.time('write'):
+            counts = WeatherForecast.insert_weather_forecasts(
+                batch, self._skip_unchanged
+            )
+
+        for outcome, count in counts._asdict().items():
+            rows_total.inc(outcome, value=count)
+
+        self.stats.increment('rows_written', len(batch))
+        self.stats.increment('rows_inserted', counts.inserted)
+        self.stats.increment('rows_updated', counts.updated)
+        self.stats.increment('rows_unchanged', counts.unchanged)
+        self.stats.increment('batches_written')
+
+        # Stale data is written, but the city still waits for new data.
+        for result in results:
+            self._city_done(result.city, not result.stale)
+
+        if self._on_progress is not None:
+            self._on_progress(self.stats)
+
+    def run(self, cities: Iterable[tuple]) -> PipelineStats:
+        """Fetches, converts and writes data of the cities.
+        The calling thread is the single writer.
+
+        """
+
+        fetched = Queue(self._queue_size)
+        converted = Queue(self._queue_size)
+
+        # Stages see the database snapshot pinned by the caller.
+        stages = (
+            threading.Thread(
+                target=contextvars.copy_context().run,
+                args=(self._fetch_stage, cities, fetched), daemon=True
+            ),
+            threading.Thread(
+                target=contextvars.copy_context().run,
+                args=(self._convert_stage, fetched, converted), daemon=True
+            ),
+        )
+        for stage in stages:
+            stage.start()
+
+        try:
+            batch, batch_results = [], []
+            while True:
+                item = converted.get()
+                if item is _STOP:
+                    break
+
+                result, rows = item
+                batch.extend(rows)
+                batch_results.append(result)
+
+                if len(batch) >= self._batch_size:
+                    self._write_batch(batch, batch_results)
+                    batch, batch_results = [], []
+
+            if batch_results:
+                self._write_batch(batch, batch_results)
+        finally:
+            self._stopped.set()
+
+            for stage in stages:
+                stage.join()
+
+        return self.stats
@@ -0,0 +1,268 @@
+"""This module contains a scheduler, which refreshes the forecasts
+of the cities in the background.
+
+A city is due refresh_interval seconds (+-jitter) after its last
+successful fetch, failed cities are retried with exponential backoff.
+Every tick the scheduler claims the most overdue cities, not more than
+the rate limit allows in a tick, and fetches them by the ingestion
+pipeline, so the load follows the number of the stale cities
+instead of coming as one burst. Claims are kept in the CityRefresh table,
+so concurrent schedulers (for example in several API workers)
+do not refresh the same city twice. In the snapshot mode every tick
+with work builds a whole new snapshot, so the due cities are batched
+until enough of them are due or the most overdue one waited too long.
+
+    python -m filler_db_openweather_data.scheduler
+
+"""
+import argparse
+import logging
+import os
+import random
+import threading
+import time
+from typing import Dict, List
+
+import config
+from filler_db_openweather_data.pipeline import (
+    IngestionPipeline, PipelineStats
+)
+from support_functions.metrics import registry
+from weather_db.db_manager import City, CityRefresh, WeatherDb
+from weather_db.snapshots import staging_snapshot
+
+logger = logging.getLogger(__name__)
+
+refreshed_total = registry.counter(
+    'refresh_cities_total', 'Number of the refreshed and failed cities.',
+    ('outcome',)
+)
+ticks_total = registry.counter(
+    'refresh_ticks_total', 'Number of the refresh scheduler ticks.'
+)
+
+
+class RefreshScheduler:
+    """Settings, which are not passed, are taken from the config module.
+    Other keyword arguments are passed to the IngestionPipeline.
+
+    """
+
+    def __init__(
+            self, api_key: str = None, interval: float = None,
+            jitter: float = None, max_workers: int = None,
+            requests_per_minute: float = None, tick_seconds: float = 60,
+            lease_seconds: float = None, snapshot_min_cities: int = None,
+            snapshot_max_delay: float = None, **pipeline_options
+    ):
+        self._api_key = api_key or os.getenv('openweathermap_key')
+        self._interval = interval or config.refresh_interval
+        self._jitter = config.refresh_jitter if jitter is None else jitter
+        self._max_workers = max_workers or config.refresh_max_workers
+        self._requests_per_minute = (
+            requests_per_minute or config.refresh_requests_per_minute
+        )
+        self._tick_seconds = tick_seconds
+        # Claims of a scheduler, which died in the middle of a tick,
+        # expire after the lease.
+        self._lease_seconds = lease_seconds or 10 * tick_seconds
+        self._pipeline_options = pipeline_options
+
+        # Not more cities than the rate limit allows in a tick.
+        self._max_cities_per_tick = max(
+            1, int(self._requests_per_minute * tick_seconds / 60)
+        )
+        self._snapshot_min_cities = (
+            snapshot_min_cities or config.refresh_snapshot_min_cities
+        )
+        self._snapshot_max_delay = (
+            config.refresh_snapshot_max_delay if snapshot_max_delay is None
+            else snapshot_max_delay
+        )
+
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def _get_due_at(self, fetched_at: float) -> float:
+        """Jitter spreads the cities fetched together over the interval."""
+
+        return fetched_at + self._interval * (
+            1 + random.uniform(-self._jitter, self._jitter)
+        )
+
+    def _get_retry_at(self, failed_at: float, failures: int) -> float:
+        return failed_at + min(
+            self._tick_seconds * 2 ** failures, self._interval
+        )
+
+    def _release(
+            self, cities: Dict[str, tuple], done: Dict[str, bool]
+    ) -> None:
+        """Saves the refresh state of the claimed cities,
+        cities without the result are counted as failed.
+
+        """
+
+        now = time.time()
+        refreshed, failed = [], []
+
+        for name, (city_id, failures) in cities.items():
+            if done.get(name):
+                refreshed.append((now, self._get_due_at(now), city_id))
+            else:
+                failed.append((self._get_retry_at(now, failures), city_id))
+
+        CityRefresh.set_refreshed(refreshed)
+        CityRefresh.set_failed(failed)
+
+        refreshed_total.inc('refreshed', value=len(refreshed))
+        refreshed_total.inc('failed', value=len(failed))
+
+    def _is_batch_ready(self, now: float) -> bool:
+        count, due_at = CityRefresh.get_due_summary(now)
+
+        return count >= self._snapshot_min_cities or (
+            count > 0 and now - due_at >= self._snapshot_max_delay
+        )
+
+    def run_once(self, now: float = None) -> PipelineStats:
+        """Refreshes the cities, which are due at the time.
+        In the snapshot mode the forecasts are written to a new snapshot,
+        the refresh state to the active one.
+
+        """
+
+        now = time.time() if now is None else now
+        ticks_total.inc()
+
+        # The write lock is not taken in the ticks without work.
+        if not CityRefresh.has_due_cities(now):
+            return PipelineStats()
+
+        limit, lease_seconds = self._max_cities_per_tick, self._lease_seconds
+
+        # A batch of the cities is refreshed in one snapshot,
+        # its requests are spread by the rate limiter.
+        if config.snapshot_mode:
+            if not self._is_batch_ready(now):
+                return PipelineStats()
+
+            limit = max(limit, self._snapshot_min_cities)
+            lease_seconds += limit * 60 / self._requests_per_minute
+
+        # Claims are kept in the active database, where the other
+        # schedulers see them, only the forecasts go to the new snapshot.
+        claimed = CityRefresh.claim_due_cities(now, limit, lease_seconds)
+        if not claimed:
+            return PipelineStats()
+
+        # {name: (city_id, failures)}
+        cities = {
+            name: (city_id, failures)
+            for city_id, name, _, _, failures in claimed
+        }
+        # {name: True if the new data of the city was written}
+        done: Dict[str, bool] = {}
+
+        pipeline = IngestionPipeline(
+            self._api_key, max_workers=self._max_workers,
+            requests_per_minute=self._requests_per_minute,
+            on_city_done=done.__setitem__, **self._pipeline_options
+        )
+
+        try:
+            with staging_snapshot(config.db_name):
+                return pipeline.run(
+                    [(name, lat, lon) for _, name, lat, lon, _ in claimed]
+                )
+        finally:
+            # After the snapshot is published or discarded,
+            # so the refresh state is saved to the active database.
+            self._release(cities, done)
+
+    def run_forever(self) -> None:
+        """Runs the ticks until the scheduler is stopped."""
+
+        while not self._stopped.is_set():
+            started = time.monotonic()
+
+            try:
+                stats = self.run_once()
+            except Exception:
+                logger.exception('Refresh tick failed')
+            else:
+                for error in stats.errors:
+                    logger.warning('Refresh of a city failed: %s', error)
+
+            self._stopped.wait(
+                max(0.0, self._tick_seconds - (time.monotonic() - started))
+            )
+
+    def start(self) -> None:
+        """Runs the scheduler in a daemon thread."""
+
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self.run_forever, name='refresh-scheduler', daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, timeout: float = None) -> None:
+        """Stops the scheduler after the current tick."""
+
+        self._stopped.set()
+
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+
+def refresh_cities(cities: List[tuple]) -> None:
+    """Makes the cities (name, lat, lon) due before all the others,
+    so they are claimed by the next tick. Cities, which are being
+    refreshed already, are refreshed again when their claim is released.
+
+    """
+
+    for name, _, _ in cities:
+        city_id = City.get_cached_city_id_by_name(name)
+
+        if city_id is not None:
+            CityRefresh.set_due(city_id, 0)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        prog='python -m filler_db_openweather_data.scheduler'
+    )
+    parser.add_argument(
+        '--tick-seconds', type=float, default=60,
+        help='time between the checks of the due cities'
+    )
+    parser.add_argument(
+        '--once', action='store_true',
+        help='refresh the due cities once and exit'
+    )
+    args = parser.parse_args()
+
+    WeatherDb.create_tables()
+
+    scheduler = RefreshScheduler(tick_seconds=args.tick_seconds)
+
+    if args.once:
+        stats = scheduler.run_once().as_dict()
+
+        for error in stats.pop('errors'):
+            print(error)
+
+        print(stats)
+        return
+
+    try:
+        scheduler.run_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,5 @@
-from app import app
-from api import api
-from filler_db_openweather_data.filler import fill_weather_db
+from app import create_app
+from weather_db.db_manager import WeatherDb
 
 if __name__ == '__main__':
     cities = [
@@ -11,5 +10,11 @@ if __name__ == '__main__':
         ('Dnipro', 48.45, 34.9833),
     ]
 
+    WeatherDb.create_tables()
+
+    # The ingestion dependencies are imported only to fill the database.
+    # from filler_db_openweather_data.filler import fill_weather_db
     # fill_weather_db(cities)
-    app.run()
+    # Later the forecasts are refreshed by the scheduler,
+    # see refresh_scheduler_enabled in config.py.
+    create_app().run()
@@ -0,0 +1,212 @@
+"""This module contains a concurrent fetcher of the openweathermap data.
+
+Requests are sent from a thread pool through the shared keep-alive
+session of the parser, are limited by a token bucket
+and retried with exponential backoff on 429 and 5xx responses.
+
+"""
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Iterable, Iterator, List, NamedTuple, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from openweathermap.weather_parser import OpenWeatherMapParser
+
+
+class RateLimiter:
+    """Token bucket, that allows requests_per_minute requests per minute
+    with bursts up to the capacity.
+
+    """
+
+    def __init__(self, requests_per_minute: float, capacity: int = None):
+        if requests_per_minute <= 0:
+            raise ValueError('requests_per_minute must be a positive number.')
+
+        self._rate = requests_per_minute / 60
+        self._capacity = capacity or max(1, int(self._rate))
+
+        self._tokens = float(self._capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+
+        self._tokens = min(
+            self._capacity, self._tokens + (now - self._updated) * self._rate
+        )
+        self._updated = now
+
+    def acquire(self) -> float:
+        """Blocks until a token is available.
+        Returns the time spent waiting.
+
+        """
+
+        waited = 0.0
+
+        while True:
+            with self._lock:
+                self._refill()
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+
+                delay = (1 - self._tokens) / self._rate
+
+            time.sleep(delay)
+            waited += delay
+
+
+class FetchResult(NamedTuple):
+    city: str
+    coords: tuple
+    data: Union[dict, None]
+    elapsed: float
+    attempts: int
+    error: Union[str, None]
+    # Cached response served, because a new one was not received.
+    stale: bool = False
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+class OpenWeatherMapFetcher:
+    """Sends onecall requests for many cities concurrently."""
+
+    _retry_statuses = frozenset((429, 500, 502, 503, 504))
+
+    def __init__(
+            self, parser: OpenWeatherMapParser, max_workers: int = 8,
+            requests_per_minute: float = 60, max_retries: int = 3,
+            backoff_factor: float = 0.5, max_backoff: float = 60.0
+    ):
+        self._parser = parser
+        self._max_workers = max_workers
+        self._rate_limiter = RateLimiter(requests_per_minute)
+        self._max_retries = max_retries
+        self._backoff_factor = backoff_factor
+        self._max_backoff = max_backoff
+
+        # Every worker thread should have its own keep-alive connection.
+        adapter = HTTPAdapter(
+            pool_connections=max_workers, pool_maxsize=max_workers
+        )
+        parser.session.mount('https://', adapter)
+        parser.session.mount('http://', adapter)
+
+    def _get_backoff(
+            self, attempt: int, response: requests.Response = None
+    ) -> float:
+        retry_after = None
+        if response is not None:
+            retry_after = response.headers.get('Retry-After')
+
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), self._max_backoff)
+
+        return min(self._backoff_factor * 2 ** attempt, self._max_backoff)
+
+    def _fetch_city(self, city: tuple) -> FetchResult:
+        """Fresh cached responses do not wait for the rate limiter,
+        stale ones are returned when all the attempts failed.
+
+        """
+
+        name, lat, lon = city
+
+        started = time.perf_counter()
+        attempt = 0
+
+        data = self._parser.get_cached_daily_one_call_request_data((lat, lon))
+        if data is not None:
+            return FetchResult(
+                name, (lat, lon), data, time.perf_counter() - started, 0, None
+            )
+
+        while True:
+            attempt += 1
+            self._rate_limiter.acquire()
+
+            try:
+                data = self._parser.get_daily_one_call_request_data(
+                    (lat, lon), use_cache=False
+                )
+            except requests.HTTPError as error:
+                last_error, response = error, error.response
+                retryable = (
+                    response is not None
+                    and response.status_code in self._retry_statuses
+                )
+            except (requests.ConnectionError, requests.Timeout) as error:
+                last_error, response, retryable = error, None, True
+            except (requests.RequestException, ValueError) as error:
+                last_error, response, retryable = error, None, False
+            else:
+                return FetchResult(
+                    name, (lat, lon), data,
+                    time.perf_counter() - started, attempt, None
+                )
+
+            if not retryable or attempt > self._max_retries:
+                data = self._parser.get_cached_daily_one_call_request_data(
+                    (lat, lon), allow_stale=True
+                )
+                if data is not None:
+                    return FetchResult(
+                        name, (lat, lon), data,
+                        time.perf_counter() - started, attempt, None, True
+                    )
+
+                # Url of the HTTPError contains the api key,
+                # so only the status is reported.
+                if response is not None:
+                    error_message = (
+                        f'{response.status_code} {response.reason}'
+                    )
+                else:
+                    error_message = repr(last_error)
+
+                return FetchResult(
+                    name, (lat, lon), None,
+                    time.perf_counter() - started, attempt, error_message
+                )
+
+            time.sleep(self._get_backoff(attempt - 1, response))
+
+    def iter_fetch(self, cities: Iterable[tuple]) -> Iterator[FetchResult]:
+        """Yields results in order of completion.
+        Not more than 2 * max_workers requests are queued at once,
+        so cities can be a lazy iterable.
+
+        """
+
+        max_pending = 2 * self._max_workers
+
+        with ThreadPoolExecutor(self._max_workers) as executor:
+            pending = set()
+
+            for city in cities:
+                pending.add(executor.submit(self._fetch_city, city))
+
+                if len(pending) >= max_pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+                    for future in done:
+                        yield future.result()
+
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    yield future.result()
+
+    def fetch(self, cities: Iterable[tuple]) -> List[FetchResult]:
+        return list(self.iter_fetch(cities))
@@ -0,0 +1,234 @@
+"""This module contains a TTL cache of the openweathermap responses.
+
+Responses are kept in an in-memory LRU in front of a sqlite table,
+so they survive restarts and repeated ingestion runs
+do not spend the API quota on unchanged forecasts.
+
+"""
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, NamedTuple, Union
+
+import config
+from support_functions.metrics import registry
+from weather_db.connection_pool import get_pool
+
+
+class CachedData(NamedTuple):
+    created_at: float
+    data: dict
+
+
+class OneCallCache:
+    """Responses are fresh for ttl seconds. Stale responses
+    (up to max_stale seconds old) are returned only on request:
+    while they are revalidated or when a new response can not be received.
+    Keys are built from the url and the request parameters
+    with coordinates rounded to the given number of decimal places.
+    Returned dicts are shared and must not be modified.
+
+    """
+
+    def __init__(
+            self, db_name: str = 'onecall_cache.db', ttl: float = 3 * 60 * 60,
+            max_stale: float = 24 * 60 * 60, max_size: int = 1024,
+            precision: int = 2
+    ):
+        self._db_name = db_name
+        self._ttl = ttl
+        self._max_stale = max(max_stale, ttl)
+        self._max_size = max_size
+        self._precision = precision
+
+        self._responses = OrderedDict()
+        self._lock = threading.Lock()
+
+        self._stats = {
+            'hits': 0, 'misses': 0, 'stale_hits': 0,
+            'revalidations': 0, 'revalidation_errors': 0
+        }
+        # Keys, which are being revalidated.
+        self._revalidating = set()
+
+        with get_pool(self._db_name).connection() as conn:
+            conn.execute(
+                '''CREATE TABLE IF NOT EXISTS OneCallCache
+                (
+                    "key" TEXT NOT NULL PRIMARY KEY,
+                    data TEXT NOT NULL,
+                    created_at FLOAT NOT NULL
+                );
+                '''
+            )
+
+    def get_key(self, url: str, params: dict) -> str:
+        """The api key is not a part of the key."""
+
+        params = {
+            name: (
+                round(value, self._precision) if name in ('lat', 'lon')
+                else value
+            )
+            for name, value in params.items() if name != 'appid'
+        }
+
+        return json.dumps([url, params], sort_keys=True)
+
+    def _remember(self, key: str, cached: CachedData) -> None:
+        with self._lock:
+            self._responses[key] = cached
+            self._responses.move_to_end(key)
+
+            if len(self._responses) > self._max_size:
+                self._responses.popitem(last=False)
+
+    def _get_cached_data(self, key: str) -> Union[CachedData, None]:
+        with self._lock:
+            cached = self._responses.get(key)
+
+            if cached is not None:
+                self._responses.move_to_end(key)
+                return cached
+
+        with get_pool(self._db_name).connection(read_only=True) as conn:
+            row = conn.execute(
+                'SELECT created_at, data FROM OneCallCache WHERE "key" = ?',
+                (key,)
+            ).fetchone()
+
+        if row is None:
+            return None
+
+        cached = CachedData(row[0], json.loads(row[1]))
+        self._remember(key, cached)
+
+        return cached
+
+    def get(self, key: str, allow_stale: bool = False) -> Union[dict, None]:
+        max_age = self._max_stale if allow_stale else self._ttl
+
+        cached = self._get_cached_data(key)
+        found = (
+            cached is not None and time.time() - cached.created_at <= max_age
+        )
+
+        with self._lock:
+            if allow_stale:
+                self._stats['stale_hits'] += found
+            else:
+                self._stats['hits' if found else 'misses'] += 1
+
+        return cached.data if found else None
+
+    def set(self, key: str, data: dict) -> None:
+        cached = CachedData(time.time(), data)
+
+        with get_pool(self._db_name).connection() as conn:
+            conn.execute(
+                '''INSERT OR REPLACE INTO OneCallCache("key", data, created_at)
+                VALUES (?, ?, ?)''',
+                (key, json.dumps(data), cached.created_at)
+            )
+
+        self._remember(key, cached)
+
+    def revalidate(self, key: str, fetch: Callable[[], dict]) -> bool:
+        """Calls fetch, which sets the new response of the key,
+        in a background thread, unless the key is being revalidated.
+        Returns True if the revalidation was started.
+
+        """
+
+        with self._lock:
+            if key in self._revalidating:
+                return False
+
+            self._revalidating.add(key)
+            self._stats['revalidations'] += 1
+
+        def run() -> None:
+            try:
+                fetch()
+            except Exception:
+                # The stale response is served until the next revalidation.
+                with self._lock:
+                    self._stats['revalidation_errors'] += 1
+            finally:
+                with self._lock:
+                    self._revalidating.discard(key)
+
+        threading.Thread(
+            target=run, name='onecall-revalidate', daemon=True
+        ).start()
+
+        return True
+
+    def clear_expired(self) -> None:
+        """Deletes the responses, which can not be served even stale."""
+
+        expired = time.time() - self._max_stale
+
+        with self._lock:
+            for key, cached in list(self._responses.items()):
+                if cached.created_at < expired:
+                    del self._responses[key]
+
+        with get_pool(self._db_name).connection() as conn:
+            conn.execute(
+                'DELETE FROM OneCallCache WHERE created_at < ?', (expired,)
+            )
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._responses)
+
+        return stats
+
+
+_onecall_cache = None
+
+
+def configure_onecall_cache(**cache_options) -> OneCallCache:
+    """Sets the cache returned by get_onecall_cache.
+    Keyword arguments are passed to the OneCallCache.
+
+    """
+
+    global _onecall_cache
+
+    _onecall_cache = OneCallCache(**cache_options)
+
+    return _onecall_cache
+
+
+def get_onecall_cache() -> Union[OneCallCache, None]:
+    """Returns the configured cache or creates it from the settings,
+    None if onecall_cache_ttl is None.
+
+    """
+
+    if _onecall_cache is None and config.onecall_cache_ttl is not None:
+        return configure_onecall_cache(
+            db_name=config.onecall_cache_db_name,
+            ttl=config.onecall_cache_ttl,
+            max_stale=config.onecall_cache_max_stale
+        )
+
+    return _onecall_cache
+
+
+registry.gauge(
+    'openweathermap_cache_stats',
+    'Hits, misses, stale hits, revalidations and size '
+    'of the onecall responses cache.',
+    lambda: {
+        (stat,): value
+        for stat, value in (
+            _onecall_cache.stats() if _onecall_cache is not None else {}
+        ).items()
+    },
+    ('stat',)
+)
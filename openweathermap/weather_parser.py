@@ -2,35 +2,113 @@
 for sending requests to the openweathermap API.
 
 """
+import gzip
 import json
+from typing import Union
 
 import requests
 
+from openweathermap.onecall_cache import OneCallCache
+
 
 class OpenWeatherMapParser:
-    def __init__(self, weather_api_key):
+    _base_url = 'https://api.openweathermap.org/data/2.5/'
+
+    def __init__(
+            self, weather_api_key, session: requests.Session = None,
+            timeout: float = 10.0, base_url: str = None,
+            cache: OneCallCache = None
+    ):
         self._api_key = weather_api_key
+        # Keep-alive connections are reused by all requests of the parser.
+        self._session = session or requests.Session()
+        self._timeout = timeout
+        self._cache = cache
 
-    def _send_daily_one_call_request(self, coords: tuple) -> dict:
-        """Sends a request to the onecall API openweathermap endpoint."""
+        if base_url is not None:
+            self._base_url = base_url
+
+    @property
+    def session(self) -> requests.Session:
+        return self._session
 
+    def _get_daily_one_call_request(self, coords: tuple) -> tuple:
         lat, lon = coords
 
-        data = requests.get(
-            'https://api.openweathermap.org/data/2.5/'
-            f'onecall?lat={lat}&lon={lon}&exclude=current,minutely,hourly'
-            '&units=metric'
-            f'&appid={self._api_key}&lang=ua'
-        ).json()
+        return f'{self._base_url}onecall', {
+            'lat': lat, 'lon': lon, 'exclude': 'current,minutely,hourly',
+            'units': 'metric', 'appid': self._api_key, 'lang': 'ua'
+        }
+
+    def _send_daily_one_call_request(self, coords: tuple) -> dict:
+        """Sends a request to the onecall API openweathermap endpoint.
+        Raises requests.HTTPError if the response status is not successful.
+
+        """
+
+        url, params = self._get_daily_one_call_request(coords)
+
+        response = self._session.get(url, params=params, timeout=self._timeout)
+        response.raise_for_status()
+
+        data = response.json()
+
+        if self._cache is not None:
+            self._cache.set(self._cache.get_key(url, params), data)
 
         return data
 
-    def get_daily_one_call_request_data(self, coords: tuple) -> dict:
+    def get_cached_daily_one_call_request_data(
+            self, coords: tuple, allow_stale: bool = False
+    ) -> Union[dict, None]:
+        """Returns the cached response or None if there is no cache,
+        stale responses are returned only with allow_stale.
+
+        """
+
+        if self._cache is None:
+            return None
+
+        return self._cache.get(
+            self._cache.get_key(*self._get_daily_one_call_request(coords)),
+            allow_stale
+        )
+
+    def get_daily_one_call_request_data(
+            self, coords: tuple, use_cache: bool = True
+    ) -> dict:
+        """Received responses are cached anyway,
+        use_cache=False only skips the lookup.
+        Stale cached responses are returned at once
+        and are refreshed in a background thread (stale-while-revalidate).
+
+        """
+
+        if use_cache and self._cache is not None:
+            key = self._cache.get_key(
+                *self._get_daily_one_call_request(coords)
+            )
+
+            data = self._cache.get(key)
+            if data is not None:
+                return data
+
+            data = self._cache.get(key, allow_stale=True)
+            if data is not None:
+                self._cache.revalidate(
+                    key, lambda: self._send_daily_one_call_request(coords)
+                )
+                return data
+
         return self._send_daily_one_call_request(coords)
 
     @staticmethod
     def write_json_data(data: dict, filepath: str) -> None:
-        with open(filepath, 'w', encoding='utf-8') as file:
+        """Files with the .gz suffix are compressed."""
+
+        opener = gzip.open if filepath.endswith('.gz') else open
+
+        with opener(filepath, 'wt', encoding='utf-8') as file:
             json.dump(data, file, indent=4)
 
     def get_and_write_daily_one_call_requests_data(
@@ -45,5 +123,9 @@ class OpenWeatherMapParser:
 
     @staticmethod
     def read_json_data_from_file(filepath: str) -> dict:
-        with open(filepath, encoding='utf-8') as file:
+        """Files with the .gz suffix are decompressed."""
+
+        opener = gzip.open if filepath.endswith('.gz') else open
+
+        with opener(filepath, 'rt', encoding='utf-8') as file:
             return json.load(file)
@@ -1,23 +1,234 @@
-from typing import List
+"""This module contains moving average calculators.
 
-from statistics import mean
+All the calculators work in O(n) using running sums
+and can be consumed lazily via iter_moving_average.
 
+"""
+from collections import deque
+from datetime import date, timedelta
+from functools import lru_cache
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple, Union
 
-def calculate_moving_average(value_list: List[float], n: int) -> List[float]:
-    moving_average = []
 
+@lru_cache(maxsize=None)
+def _get_numpy():
+    """NumPy is imported by the first calculation, which uses it,
+    so it is not loaded with the modules importing the calculators.
+
+    """
+
+    try:
+        import numpy
+    except ImportError:  # NumPy is optional, pure python is used without it.
+        return None
+
+    return numpy
+
+
+def _check_window(n: int) -> None:
+    if n < 1:
+        raise ValueError('N must be a positive number!')
+
+
+def iter_simple_moving_average(
+        values: Iterable[float], n: int
+) -> Iterator[float]:
+    """Yields the mean of every n consecutive values."""
+
+    _check_window(n)
+
+    window = deque()
+    window_sum = 0.0
+
+    for value in values:
+        window.append(value)
+        window_sum += value
+
+        if len(window) > n:
+            window_sum -= window.popleft()
+
+        if len(window) == n:
+            yield window_sum / n
+
+
+def iter_exponential_moving_average(
+        values: Iterable[float], n: int
+) -> Iterator[float]:
+    """Yields the exponential moving average with alpha = 2 / (n + 1).
+    The average is seeded with the simple mean of the first n values.
+
+    """
+
+    _check_window(n)
+
+    alpha = 2 / (n + 1)
+    seed_sum, count = 0.0, 0
+    average = None
+
+    for value in values:
+        if average is None:
+            seed_sum += value
+            count += 1
+
+            if count == n:
+                average = seed_sum / n
+                yield average
+            continue
+
+        average += alpha * (value - average)
+        yield average
+
+
+def iter_weighted_moving_average(
+        values: Iterable[float], n: int
+) -> Iterator[float]:
+    """Yields the linearly weighted moving average,
+    the latest value of the window has the weight n, the oldest - 1.
+
+    """
+
+    _check_window(n)
+
+    denominator = n * (n + 1) / 2
+    window = deque()
+    window_sum = weighted_sum = 0.0
+
+    for value in values:
+        if len(window) == n:
+            # Every value loses one weight unit and the oldest one drops out.
+            weighted_sum += n * value - window_sum
+            window_sum += value - window.popleft()
+            window.append(value)
+        else:
+            window.append(value)
+            window_sum += value
+            weighted_sum += len(window) * value
+
+        if len(window) == n:
+            yield weighted_sum / denominator
+
+
+def iter_centered_moving_average(
+        values: Iterable[float], n: int
+) -> Iterator[float]:
+    """Yields a mean for every value, taken over the window of n values
+    centered on it. The window is truncated at the edges of the data,
+    so the result has the same length as the data.
+
+    """
+
+    _check_window(n)
+
+    before, after = (n - 1) // 2, n // 2
+
+    window = deque()
+    window_sum = 0.0
+    # Index of the value in the window, for which the mean will be yielded.
+    center = 0
+
+    for value in values:
+        window.append(value)
+        window_sum += value
+
+        if len(window) - center - 1 < after:
+            continue
+
+        yield window_sum / len(window)
+
+        if center < before:
+            center += 1
+        else:
+            window_sum -= window.popleft()
+
+    while center < len(window):
+        yield window_sum / len(window)
+
+        if center < before:
+            center += 1
+        else:
+            window_sum -= window.popleft()
+
+
+def iter_time_moving_average(
+        dated_values: Iterable[Tuple[str, float]], n: int
+) -> Iterator[float]:
+    """Yields for every value the mean of values for the last n days
+    (including the current one). Values must be sorted by date.
+
+    """
+
+    _check_window(n)
+
+    period = timedelta(days=n)
+
+    window = deque()
+    window_sum = 0.0
+
+    for value_date, value in dated_values:
+        current_date = date.fromisoformat(value_date)
+
+        window.append((current_date, value))
+        window_sum += value
+
+        while window[0][0] <= current_date - period:
+            window_sum -= window.popleft()[1]
+
+        yield window_sum / len(window)
+
+
+_calculators: Dict[str, Callable[[Iterable, int], Iterator[float]]] = {
+    'simple': iter_simple_moving_average,
+    'exponential': iter_exponential_moving_average,
+    'weighted': iter_weighted_moving_average,
+    'centered': iter_centered_moving_average,
+    'time': iter_time_moving_average,
+}
+
+WINDOW_KINDS = tuple(_calculators)
+
+
+def iter_moving_average(
+        values: Iterable[Union[float, Tuple[str, float]]],
+        n: int, kind: str = 'simple'
+) -> Iterator[float]:
+    """Lazily calculates the moving average of the given kind.
+    For the 'time' kind values are (date, value) pairs
+    and n is the number of days.
+
+    """
+
+    if kind not in _calculators:
+        raise ValueError(
+            f'Pass the correct window kind. Available kinds: {WINDOW_KINDS}'
+        )
+
+    return _calculators[kind](values, n)
+
+
+def _calculate_simple_moving_average_np(
+        value_list: List[float], n: int
+) -> List[float]:
+    np = _get_numpy()
+
+    cumulative_sum = np.cumsum(np.asarray(value_list, dtype=float))
+    window_sums = cumulative_sum[n - 1:].copy()
+    window_sums[1:] -= cumulative_sum[:-n]
+
+    return (window_sums / n).tolist()
+
+
+def calculate_moving_average(
+        value_list: List[Union[float, Tuple[str, float]]],
+        n: int, kind: str = 'simple'
+) -> List[float]:
     data_length = len(value_list)
-    if n > data_length:
+    if kind != 'time' and n > data_length:
         raise ValueError(
             'N cannot be greater than the length'
             f' of the data! Maximum is {data_length}'
         )
 
-    for i, elem in enumerate(value_list):
-        if i < n - 1:
-            continue
-
-        matched_sublist = value_list[i - (n - 1): i + 1]
-        moving_average.append(mean(matched_sublist))
+    if kind == 'simple' and n > 1 and _get_numpy() is not None:
+        return _calculate_simple_moving_average_np(value_list, n)
 
-    return moving_average
+    return list(iter_moving_average(value_list, n, kind))
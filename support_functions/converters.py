@@ -1,16 +1,58 @@
 from datetime import datetime
 from statistics import mean
 
-from geopy.geocoders import Nominatim
+from support_functions.geocode_cache import GeocodeCache
+
+_geolocator = None
+_geocode_cache = None
+
+
+def configure_geocode_cache(
+        db_name: str = 'geocode_cache.db', precision: int = 2,
+        ttl: float = 30 * 24 * 60 * 60
+) -> GeocodeCache:
+    """Sets the cache used by get_city_name_from_coords."""
+
+    global _geocode_cache
+
+    _geocode_cache = GeocodeCache(db_name, precision, ttl)
+
+    return _geocode_cache
+
+
+def _get_geolocator() -> 'Nominatim':
+    global _geolocator
+
+    if _geolocator is None:
+        # geopy is imported only when a city is not passed
+        # with the data and is not in the geocode cache.
+        from geopy.geocoders import Nominatim
+
+        _geolocator = Nominatim(user_agent='my_app')
+
+    return _geolocator
 
 
 def get_city_name_from_coords(coords: tuple) -> str:
-    geolocator = Nominatim(user_agent='my_app')
+    """Reverse geocodes coordinates,
+    the result is cached on disk (see configure_geocode_cache).
+
+    """
+
+    cache = _geocode_cache or configure_geocode_cache()
+
+    city = cache.get(coords)
+    if city is not None:
+        return city
 
-    return geolocator.reverse(
+    city = _get_geolocator().reverse(
         coords, language='en', exactly_one=True
     ).raw['address']['city']
 
+    cache.set(coords, city)
+
+    return city
+
 
 def convert_unix_time_to_date(unix_time: int) -> str:
     return datetime.fromtimestamp(unix_time).strftime(
@@ -40,9 +82,17 @@ def _convert_daily_data(daily_data: list) -> list:
     return daily_list
 
 
-def convert_openweather_data_to_desired_format(openweather_data: dict) -> dict:
-    coordinates = openweather_data['lat'], openweather_data['lon']
-    city = get_city_name_from_coords(coordinates)
+def convert_openweather_data_to_desired_format(
+        openweather_data: dict, city: str = None
+) -> dict:
+    """If the city is not passed,
+    it is found by the coordinates of the data.
+
+    """
+
+    if city is None:
+        coordinates = openweather_data['lat'], openweather_data['lon']
+        city = get_city_name_from_coords(coordinates)
 
     data_in_desired_format = {
         'city': city,
@@ -0,0 +1,66 @@
+"""This module contains an on-disk cache of reverse geocoding results."""
+import time
+from typing import Union
+
+from weather_db.connection_pool import get_pool
+
+
+class GeocodeCache:
+    """Sqlite cache of city names keyed by coordinates
+    rounded to the given number of decimal places.
+    Entries older than ttl seconds are ignored.
+
+    """
+
+    def __init__(
+            self, db_name: str = 'geocode_cache.db', precision: int = 2,
+            ttl: float = 30 * 24 * 60 * 60
+    ):
+        self._db_name = db_name
+        self._precision = precision
+        self._ttl = ttl
+
+        with get_pool(self._db_name).connection() as conn:
+            conn.execute(
+                '''CREATE TABLE IF NOT EXISTS GeocodeCache
+                (
+                    latitude FLOAT NOT NULL,
+                    longitude FLOAT NOT NULL,
+                    city VARCHAR(255) NOT NULL,
+                    created_at FLOAT NOT NULL,
+
+                    PRIMARY KEY (latitude, longitude)
+                );
+                '''
+            )
+
+    def _get_key(self, coords: tuple) -> tuple:
+        lat, lon = coords
+
+        return round(lat, self._precision), round(lon, self._precision)
+
+    def get(self, coords: tuple) -> Union[str, None]:
+        with get_pool(self._db_name).connection(read_only=True) as conn:
+            city = conn.execute(
+                '''SELECT city FROM GeocodeCache
+                WHERE latitude = ? AND longitude = ? AND created_at > ?''',
+                (*self._get_key(coords), time.time() - self._ttl)
+            ).fetchone()
+
+        return city[0] if city else None
+
+    def set(self, coords: tuple, city: str) -> None:
+        with get_pool(self._db_name).connection() as conn:
+            conn.execute(
+                '''INSERT OR REPLACE INTO GeocodeCache(
+                    latitude, longitude, city, created_at
+                ) VALUES (?, ?, ?, ?)''',
+                (*self._get_key(coords), city, time.time())
+            )
+
+    def clear_expired(self) -> None:
+        with get_pool(self._db_name).connection() as conn:
+            conn.execute(
+                'DELETE FROM GeocodeCache WHERE created_at <= ?',
+                (time.time() - self._ttl,)
+            )
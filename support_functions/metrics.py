@@ -0,0 +1,214 @@
+"""This module contains in-process metrics in the Prometheus text format.
+
+Counters and histograms are cheap enough to be always on:
+an observation is a bisect and two additions under a lock.
+Gauges are read from callbacks only when the metrics are rendered.
+
+"""
+import math
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Tuple
+
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+
+def _escape(value: str) -> str:
+    return (
+        str(value).replace('\\', '\\\\').replace('\n', '\\n')
+        .replace('"', '\\"')
+    )
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    if not names:
+        return ''
+
+    labels = ','.join(
+        f'{name}="{_escape(value)}"' for name, value in zip(names, values)
+    )
+
+    return f'{{{labels}}}'
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(
+            self, name: str, documentation: str,
+            label_names: Tuple[str, ...] = ()
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+
+        self._values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values: str, value: float = 1) -> None:
+        with self._lock:
+            self._values[label_values] = (
+                self._values.get(label_values, 0) + value
+            )
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+
+        return [
+            f'{self.name}{_format_labels(self.label_names, labels)} '
+            f'{_format_value(value)}'
+            for labels, value in values
+        ]
+
+
+class Histogram:
+    def __init__(
+            self, name: str, documentation: str,
+            label_names: Tuple[str, ...] = (),
+            buckets: Tuple[float, ...] = DEFAULT_BUCKETS
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.buckets = tuple(sorted(buckets))
+
+        # For every labels: counts of the buckets (and +Inf), sum.
+        self._values: Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str) -> None:
+        index = bisect_left(self.buckets, value)
+
+        with self._lock:
+            values = self._values.get(label_values)
+            if values is None:
+                values = self._values[label_values] = [
+                    [0] * (len(self.buckets) + 1), 0.0
+                ]
+
+            values[0][index] += 1
+            values[1] += value
+
+    @contextmanager
+    def time(self, *label_values: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *label_values)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = sorted(
+                (labels, list(counts), total)
+                for labels, (counts, total) in self._values.items()
+            )
+
+        label_names = (*self.label_names, 'le')
+        lines = []
+
+        for labels, counts, total in values:
+            cumulative_count = 0
+            for upper_bound, count in zip(
+                    (*self.buckets, math.inf), counts
+            ):
+                cumulative_count += count
+                bucket_labels = _format_labels(
+                    label_names, (*labels, _format_value(upper_bound))
+                )
+                lines.append(
+                    f'{self.name}_bucket{bucket_labels} {cumulative_count}'
+                )
+
+            labels = _format_labels(self.label_names, labels)
+            lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+            lines.append(f'{self.name}_count{labels} {cumulative_count}')
+
+        return lines
+
+
+class Gauge:
+    """Gauge, whose values are returned by the callback
+    as {label values: value} at the time of rendering.
+
+    """
+
+    def __init__(
+            self, name: str, documentation: str,
+            callback: Callable[[], Dict[tuple, float]],
+            label_names: Tuple[str, ...] = ()
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self._callback = callback
+
+    def render(self) -> List[str]:
+        return [
+            f'{self.name}{_format_labels(self.label_names, labels)} '
+            f'{_format_value(value)}'
+            for labels, value in sorted(self._callback().items())
+        ]
+
+
+class MetricsRegistry:
+    _types = {Counter: 'counter', Histogram: 'histogram', Gauge: 'gauge'}
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            # Modules can be reloaded, the existing metric is kept then.
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(
+            self, name: str, documentation: str,
+            label_names: Tuple[str, ...] = ()
+    ) -> Counter:
+        return self._register(Counter(name, documentation, label_names))
+
+    def histogram(
+            self, name: str, documentation: str,
+            label_names: Tuple[str, ...] = (),
+            buckets: Tuple[float, ...] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self._register(
+            Histogram(name, documentation, label_names, buckets)
+        )
+
+    def gauge(
+            self, name: str, documentation: str,
+            callback: Callable[[], Dict[tuple, float]],
+            label_names: Tuple[str, ...] = ()
+    ) -> Gauge:
+        return self._register(
+            Gauge(name, documentation, callback, label_names)
+        )
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda m: m.name)
+
+        lines = []
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {self._types[type(metric)]}')
+            lines.extend(metric.render())
+
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
@@ -0,0 +1,81 @@
+import json
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+import pytest
+
+
+class StubOpenWeatherMap:
+    """Answers the onecall requests with the queued (status, headers)
+    responses, then with 200 and a forecast, which contains
+    the number of the request.
+
+    """
+
+    def __init__(self):
+        self.responses = deque()
+        self.requests = []
+        self._lock = threading.Lock()
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                params = dict(parse_qsl(urlsplit(self.path).query))
+
+                with stub._lock:
+                    stub.requests.append(params)
+                    number = len(stub.requests)
+                    status, headers = (
+                        stub.responses.popleft() if stub.responses
+                        else (200, {})
+                    )
+
+                body = b''
+                if status == 200:
+                    body = json.dumps({
+                        'lat': float(params['lat']),
+                        'lon': float(params['lon']),
+                        'request': number, 'daily': []
+                    }).encode()
+
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, kwargs={'poll_interval': 0.05},
+            daemon=True
+        )
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address
+
+        return f'http://{host}:{port}/'
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+
+@pytest.fixture
+def openweathermap():
+    stub = StubOpenWeatherMap()
+    stub.start()
+
+    yield stub
+
+    stub.stop()
@@ -0,0 +1,54 @@
+import json
+
+import pytest
+
+import config
+from app import create_app
+from weather_db.connection_pool import close_pools
+from weather_db.db_manager import City, WeatherDb, WeatherForecast
+from weather_db.snapshots import build_snapshot
+
+
+def _forecast(city_id, date, temp):
+    return city_id, date, temp, None, 40, 1013, 60, 3.5
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'db_name', str(tmp_path / 'weather.db'))
+    monkeypatch.setattr(config, 'snapshot_mode', True)
+    monkeypatch.setattr(config, 'swagger_enabled', False)
+
+    with build_snapshot(config.db_name):
+        WeatherDb.create_tables()
+        City.insert_city('Kyiv', (50.45, 30.52))
+        WeatherForecast.insert_weather_forecasts([
+            _forecast(City.get_city_id_by_name('Kyiv'), '2021-01-01', 1.0)
+        ])
+
+    yield create_app().test_client()
+
+    close_pools()
+
+
+def test_stream_reads_pinned_snapshot(client):
+    response = client.get(
+        '/api/v1/records/?city=Kyiv&start_dt=2021-01-01&end_dt=2021-12-31'
+        '&stream=true',
+        buffered=False
+    )
+    chunks = iter(response.response)
+    first_chunk = next(chunks)
+
+    # Published after the request started, before its records are read.
+    with build_snapshot(config.db_name):
+        WeatherForecast.insert_weather_forecasts([
+            _forecast(City.get_city_id_by_name('Kyiv'), '2021-01-02', 2.0)
+        ])
+
+    body = json.loads(b''.join([first_chunk, *chunks]))
+    response.close()
+
+    assert [
+        record['date'] for record in body['daily_forecast']
+    ] == ['2021-01-01']
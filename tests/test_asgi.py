@@ -0,0 +1,56 @@
+import asyncio
+import threading
+import time
+
+from api.asgi import WsgiToAsgi
+
+
+def _call(application, query_string):
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b''}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {
+        'type': 'http', 'method': 'GET', 'path': '/', 'http_version': '1.1',
+        'query_string': query_string, 'headers': []
+    }
+
+    return application(scope, receive, send), messages
+
+
+def test_requests_run_on_bounded_threads():
+    lock = threading.Lock()
+    running, peak = [0], [0]
+
+    def wsgi_app(environ, start_response):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+
+        time.sleep(0.05)
+
+        with lock:
+            running[0] -= 1
+
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return [b'query: ', environ['QUERY_STRING'].encode()]
+
+    application = WsgiToAsgi(wsgi_app, max_threads=2)
+    calls = [_call(application, f'n={number}'.encode()) for number in range(6)]
+
+    async def run_all():
+        await asyncio.gather(*(call for call, _ in calls))
+
+    asyncio.run(run_all())
+
+    assert peak[0] == 2
+
+    for number, (_, messages) in enumerate(calls):
+        assert messages[0]['status'] == 200
+        assert b''.join(
+            message.get('body', b'') for message in messages[1:]
+        ) == f'query: n={number}'.encode()
@@ -0,0 +1,67 @@
+import math
+import random
+
+from filler_db_openweather_data.bulk_import import CityMatcher, ImportStats
+
+
+def _brute_force_city_id(cities, lat, lon, max_distance):
+    distance, city_id = min(
+        (
+            (
+                math.hypot(
+                    lat - city_lat, (lon - city_lon + 180) % 360 - 180
+                ),
+                city_id
+            )
+            for city_id, _, city_lat, city_lon in cities
+        ),
+        default=(math.inf, None)
+    )
+
+    return city_id if distance <= max_distance else None
+
+
+def test_matcher_matches_brute_force():
+    rnd = random.Random(1)
+    cities = [
+        (city_id, f'City {city_id}', rnd.uniform(44, 53), rnd.uniform(22, 41))
+        for city_id in range(1, 2001)
+    ]
+    matcher = CityMatcher(cities, max_distance=0.05)
+
+    for _ in range(2000):
+        # Near a city or anywhere in the area.
+        if rnd.random() < 0.5:
+            _, _, lat, lon = rnd.choice(cities)
+            lat += rnd.uniform(-0.06, 0.06)
+            lon += rnd.uniform(-0.06, 0.06)
+        else:
+            lat, lon = rnd.uniform(44, 53), rnd.uniform(22, 41)
+
+        assert matcher.get_city_id((lat, lon)) == _brute_force_city_id(
+            cities, lat, lon, 0.05
+        )
+
+
+def test_matcher_across_antimeridian():
+    matcher = CityMatcher([(1, 'Fiji', -17.0, 179.99)], max_distance=0.05)
+
+    assert matcher.get_city_id((-17.0, -179.99)) == 1
+    assert matcher.get_city_id((-17.0, 179.5)) is None
+
+
+def test_matcher_skips_cities_without_coords():
+    matcher = CityMatcher([(1, 'Nowhere', None, None)])
+
+    assert matcher.get_city_id((50.45, 30.52)) is None
+    assert matcher.get_city_id((91.0, 30.52)) is None
+
+
+def test_import_stats_keep_first_errors():
+    stats = ImportStats(max_errors=2)
+
+    for number in range(5):
+        stats.add_error(f'dump {number}')
+
+    assert stats.errors == ['dump 0', 'dump 1']
+    assert stats['errors_dropped'] == 3
@@ -0,0 +1,16 @@
+import config
+from weather_db.connection_pool import close_pool, get_pool
+
+
+def test_pool_size_is_configured(tmp_path, monkeypatch):
+    db_name = str(tmp_path / 'weather.db')
+    monkeypatch.setattr(config, 'pool_max_size', 3)
+
+    try:
+        assert get_pool(db_name).stats()['max_size'] == 3
+    finally:
+        close_pool(db_name)
+
+
+def test_pool_is_not_smaller_than_asgi_threads():
+    assert config.pool_max_size >= config.asgi_threads
@@ -0,0 +1,140 @@
+import time
+
+import pytest
+
+from openweathermap.fetcher import OpenWeatherMapFetcher, RateLimiter
+from openweathermap.onecall_cache import OneCallCache
+from openweathermap.weather_parser import OpenWeatherMapParser
+from weather_db.connection_pool import close_pool
+
+CITY = ('Kyiv', 50.45, 30.52)
+
+
+def _create_fetcher(openweathermap, cache=None, **fetcher_options):
+    parser = OpenWeatherMapParser(
+        'key', base_url=openweathermap.base_url, cache=cache
+    )
+    fetcher_options.setdefault('backoff_factor', 0.01)
+    fetcher_options.setdefault('requests_per_minute', 60000)
+
+    return OpenWeatherMapFetcher(parser, **fetcher_options)
+
+
+def test_fetch(openweathermap):
+    cities = [(f'City {number}', 50.0 + number, 30.0) for number in range(5)]
+
+    results = _create_fetcher(openweathermap).fetch(cities)
+
+    assert sorted(result.city for result in results) == sorted(
+        name for name, _, _ in cities
+    )
+    assert all(result.ok and result.attempts == 1 for result in results)
+    assert all(result.data['lat'] == result.coords[0] for result in results)
+    assert all(
+        params['appid'] == 'key' for params in openweathermap.requests
+    )
+
+
+@pytest.mark.parametrize('status', [429, 500, 502, 503, 504])
+def test_retry_on_status(openweathermap, status):
+    openweathermap.responses.extend([(status, {}), (status, {})])
+
+    result, = _create_fetcher(openweathermap).fetch([CITY])
+
+    assert result.ok
+    assert result.attempts == 3
+    assert result.data['request'] == 3
+
+
+def test_retry_after_header(openweathermap):
+    openweathermap.responses.append((429, {'Retry-After': '1'}))
+
+    started = time.monotonic()
+    result, = _create_fetcher(openweathermap).fetch([CITY])
+
+    assert result.ok and result.attempts == 2
+    assert time.monotonic() - started >= 1
+
+
+def test_no_retry_on_client_error(openweathermap):
+    openweathermap.responses.append((401, {}))
+
+    result, = _create_fetcher(openweathermap).fetch([CITY])
+
+    assert not result.ok
+    assert result.attempts == 1
+    assert result.error == '401 Unauthorized'
+    assert len(openweathermap.requests) == 1
+
+
+def test_retries_are_limited(openweathermap):
+    openweathermap.responses.extend([(500, {})] * 3)
+
+    result, = _create_fetcher(openweathermap, max_retries=2).fetch([CITY])
+
+    assert result.error == '500 Internal Server Error'
+    assert result.attempts == 3
+    assert len(openweathermap.requests) == 3
+
+
+def test_connection_error(openweathermap):
+    fetcher = _create_fetcher(openweathermap, max_retries=1)
+    openweathermap.stop()
+
+    result, = fetcher.fetch([CITY])
+
+    assert not result.ok
+    assert result.attempts == 2
+    assert 'ConnectionError' in result.error
+
+
+def test_cached_and_stale_responses(openweathermap, tmp_path):
+    cache_db_name = str(tmp_path / 'onecall_cache.db')
+    cache = OneCallCache(cache_db_name, ttl=60)
+
+    try:
+        fetcher = _create_fetcher(openweathermap, cache, max_retries=0)
+        assert fetcher.fetch([CITY])[0].attempts == 1
+
+        # Fresh responses are not requested again.
+        result, = fetcher.fetch([CITY])
+        assert result.attempts == 0 and result.data['request'] == 1
+
+        # Stale responses are used only when the request fails.
+        stale_cache = OneCallCache(cache_db_name, ttl=0, max_stale=60)
+        fetcher = _create_fetcher(openweathermap, stale_cache, max_retries=0)
+        openweathermap.responses.append((503, {}))
+
+        result, = fetcher.fetch([CITY])
+        assert result.ok and result.stale
+        assert result.data['request'] == 1
+    finally:
+        close_pool(cache_db_name)
+
+
+def test_fetcher_is_rate_limited(openweathermap):
+    # 10 requests per second with bursts up to 10.
+    fetcher = _create_fetcher(
+        openweathermap, max_workers=8, requests_per_minute=600
+    )
+    cities = [(f'City {number}', 50.0 + number, 30.0) for number in range(13)]
+
+    started = time.monotonic()
+    results = fetcher.fetch(cities)
+
+    assert all(result.ok for result in results)
+    assert time.monotonic() - started >= 0.25
+
+
+def test_rate_limiter():
+    limiter = RateLimiter(requests_per_minute=1200, capacity=2)
+
+    waited = [limiter.acquire() for _ in range(4)]
+
+    assert waited[:2] == [0.0, 0.0]
+    assert sum(waited) == pytest.approx(0.1, abs=0.03)
+
+
+def test_rate_limiter_needs_positive_rate():
+    with pytest.raises(ValueError):
+        RateLimiter(0)
@@ -0,0 +1,95 @@
+import time
+
+import pytest
+import requests
+
+from openweathermap.onecall_cache import OneCallCache
+from openweathermap.weather_parser import OpenWeatherMapParser
+from weather_db.connection_pool import close_pool
+
+COORDS = (50.45, 30.52)
+
+
+@pytest.fixture
+def cache_db_name(tmp_path):
+    db_name = str(tmp_path / 'onecall_cache.db')
+
+    yield db_name
+
+    close_pool(db_name)
+
+
+def _wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+def test_fresh_response_is_cached(openweathermap, cache_db_name):
+    parser = OpenWeatherMapParser(
+        'key', base_url=openweathermap.base_url,
+        cache=OneCallCache(cache_db_name, ttl=60)
+    )
+
+    assert parser.get_daily_one_call_request_data(COORDS)['request'] == 1
+    assert parser.get_daily_one_call_request_data(COORDS)['request'] == 1
+    assert len(openweathermap.requests) == 1
+
+
+def test_key_skips_api_key_and_rounds_coordinates(cache_db_name):
+    cache = OneCallCache(cache_db_name, precision=2)
+
+    assert cache.get_key('url', {'lat': 50.451, 'appid': 'a'}) == (
+        cache.get_key('url', {'lat': 50.449, 'appid': 'b'})
+    )
+
+
+def test_stale_response_is_revalidated(openweathermap, cache_db_name):
+    cache = OneCallCache(cache_db_name, ttl=0, max_stale=60)
+    parser = OpenWeatherMapParser(
+        'key', base_url=openweathermap.base_url, cache=cache
+    )
+
+    assert parser.get_daily_one_call_request_data(COORDS)['request'] == 1
+
+    # The stale response is returned, the new one is requested
+    # in the background.
+    assert parser.get_daily_one_call_request_data(COORDS)['request'] == 1
+    _wait_for(lambda: cache.stats()['revalidations'] == 1)
+    _wait_for(
+        lambda: parser.get_cached_daily_one_call_request_data(
+            COORDS, allow_stale=True
+        )['request'] == 2
+    )
+
+
+def test_stale_response_is_kept_on_error(openweathermap, cache_db_name):
+    cache = OneCallCache(cache_db_name, ttl=0, max_stale=60)
+    parser = OpenWeatherMapParser(
+        'key', base_url=openweathermap.base_url, cache=cache
+    )
+    parser.get_daily_one_call_request_data(COORDS)
+
+    openweathermap.responses.append((500, {}))
+
+    assert parser.get_daily_one_call_request_data(COORDS)['request'] == 1
+    _wait_for(lambda: cache.stats()['revalidation_errors'] == 1)
+
+    assert parser.get_cached_daily_one_call_request_data(
+        COORDS, allow_stale=True
+    )['request'] == 1
+
+
+def test_expired_response_is_not_served(openweathermap, cache_db_name):
+    cache = OneCallCache(cache_db_name, ttl=0, max_stale=0)
+    parser = OpenWeatherMapParser(
+        'key', base_url=openweathermap.base_url, cache=cache
+    )
+    parser.get_daily_one_call_request_data(COORDS)
+
+    openweathermap.responses.append((500, {}))
+
+    with pytest.raises(requests.HTTPError):
+        parser.get_daily_one_call_request_data(COORDS)
@@ -0,0 +1,104 @@
+import time
+
+import pytest
+
+import config
+from filler_db_openweather_data.scheduler import (
+    RefreshScheduler, refresh_cities
+)
+from weather_db.connection_pool import close_pool
+from weather_db.db_manager import (
+    City, CityRefresh, WeatherDb, _db_connect
+)
+from weather_db.snapshots import get_snapshots
+
+NOW = time.time()
+KYIV = ('Kyiv', 50.45, 30.52)
+
+
+@pytest.fixture
+def city_id(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'db_name', str(tmp_path / 'weather.db'))
+    monkeypatch.setattr(config, 'snapshot_mode', False)
+
+    WeatherDb.create_tables()
+    City.insert_city('Kyiv', (50.45, 30.52))
+
+    yield City.get_city_id_by_name('Kyiv')
+
+    close_pool(config.db_name)
+
+
+def _create_scheduler(**options):
+    return RefreshScheduler(
+        'key', interval=3600, jitter=0, tick_seconds=60, **options
+    )
+
+
+def test_claimed_city_is_not_due(city_id):
+    assert [city[0] for city in CityRefresh.claim_due_cities(
+        NOW, 10, 600
+    )] == [city_id]
+
+    assert not CityRefresh.has_due_cities(NOW + 1)
+    assert not CityRefresh.claim_due_cities(NOW + 1, 10, 600)
+    # The claim of a dead scheduler expires.
+    assert CityRefresh.claim_due_cities(NOW + 600, 10, 600)
+
+
+@pytest.mark.parametrize('done', [True, False])
+def test_refresh_forced_during_claim_is_kept(city_id, done):
+    scheduler = _create_scheduler()
+    CityRefresh.claim_due_cities(NOW, 10, 600)
+
+    refresh_cities([KYIV])
+    scheduler._release({'Kyiv': (city_id, 0)}, {'Kyiv': done})
+
+    assert CityRefresh.has_due_cities(NOW + 1)
+
+
+@pytest.mark.parametrize('done', [True, False])
+def test_release_moves_due_time(city_id, done):
+    scheduler = _create_scheduler()
+    CityRefresh.claim_due_cities(NOW, 10, 600)
+
+    scheduler._release({'Kyiv': (city_id, 0)}, {'Kyiv': done})
+
+    assert not CityRefresh.has_due_cities(NOW + 1)
+
+
+def test_run_once(city_id, openweathermap):
+    scheduler = _create_scheduler(
+        base_url=openweathermap.base_url, use_cache=False,
+        requests_per_minute=6000
+    )
+
+    stats = scheduler.run_once()
+
+    assert stats['fetched'] == 1
+    assert len(openweathermap.requests) == 1
+    assert scheduler.run_once()['fetched'] == 0
+
+
+def test_snapshot_mode_batches_due_cities(
+        city_id, openweathermap, monkeypatch
+):
+    monkeypatch.setattr(config, 'snapshot_mode', True)
+    scheduler = _create_scheduler(
+        base_url=openweathermap.base_url, use_cache=False,
+        requests_per_minute=6000, snapshot_min_cities=2,
+        snapshot_max_delay=600
+    )
+    # New cities are due at once, this one is due a minute ago.
+    with _db_connect(config.db_name) as cur:
+        cur.execute('UPDATE CityRefresh SET due_at = ?;', (NOW - 60,))
+
+    assert scheduler.run_once(NOW)['fetched'] == 0
+    assert not get_snapshots(config.db_name)
+
+    # The most overdue city waited too long.
+    assert scheduler.run_once(NOW + 600)['fetched'] == 1
+    assert len(get_snapshots(config.db_name)) == 1
+
+    for snapshot in get_snapshots(config.db_name):
+        close_pool(snapshot)
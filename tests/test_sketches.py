@@ -0,0 +1,166 @@
+import math
+import random
+from datetime import date, timedelta
+
+import pytest
+
+import config
+from weather_db import sketches
+from weather_db.connection_pool import close_pool
+from weather_db.db_manager import City, WeatherDb, WeatherForecast, _db_connect
+
+PERCENTILES = [0, 1, 5, 10, 25, 50, 75, 90, 95, 99, 100]
+# Indexes of the columns in the forecast rows.
+COLUMN_INDEXES = {'temp': 2, 'pcp': 3, 'wind_speed': 7}
+
+
+@pytest.fixture
+def city_id(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'db_name', str(tmp_path / 'weather.db'))
+    monkeypatch.setattr(config, 'snapshot_mode', False)
+
+    WeatherDb.create_tables()
+    City.insert_city('Kyiv', (50.45, 30.52))
+
+    yield City.get_city_id_by_name('Kyiv')
+
+    close_pool(config.db_name)
+
+
+def _generate_forecasts(city_id, days, rnd):
+    start_date = date(2015, 1, 1)
+
+    return [
+        (
+            city_id, (start_date + timedelta(days=day)).isoformat(),
+            round(rnd.gauss(5, 12), 2),
+            rnd.choice([None, 0.0, round(rnd.expovariate(0.2), 3)]),
+            50, 1013, 60, round(rnd.gammavariate(2.0, 2.0), 2)
+        )
+        for day in range(days)
+    ]
+
+
+def _get_column_values(forecasts, column_name):
+    index = COLUMN_INDEXES[column_name]
+
+    return sorted(
+        forecast[index] for forecast in forecasts
+        if forecast[index] is not None
+    )
+
+
+def _assert_percentiles(column_name, values):
+    distribution = WeatherForecast.select_distribution_of_column(
+        'Kyiv', column_name, PERCENTILES
+    )
+
+    assert distribution['count'] == len(values)
+    assert distribution['min'] == values[0]
+    assert distribution['max'] == values[-1]
+
+    for percentile in PERCENTILES:
+        exact = values[math.floor(percentile / 100 * (len(values) - 1))]
+        error = abs(distribution['percentiles'][percentile] - exact)
+
+        assert error <= (
+            sketches.RELATIVE_ACCURACY * abs(exact) + sketches.MIN_VALUE
+        ), (column_name, percentile, exact)
+
+
+def _assert_histogram(column_name, values, bins):
+    histogram = WeatherForecast.select_distribution_of_column(
+        'Kyiv', column_name, [50], bins
+    )['histogram']
+
+    assert len(histogram) == bins
+    assert sum(bin_['count'] for bin_ in histogram) == len(values)
+
+    for bin_ in histogram:
+        exact = sum(
+            bin_['from'] <= value < bin_['to'] for value in values
+        )
+        # Values within the accuracy of the edges can be counted
+        # in the neighbouring bin.
+        near_edges = sum(
+            abs(value - edge) <= (
+                sketches.RELATIVE_ACCURACY * abs(value) + sketches.MIN_VALUE
+            )
+            for value in values for edge in (bin_['from'], bin_['to'])
+        )
+
+        assert abs(bin_['count'] - exact) <= near_edges
+
+
+@pytest.mark.parametrize('column_name', sketches.SKETCHED_COLUMNS)
+def test_percentiles_match_brute_force(city_id, column_name):
+    forecasts = _generate_forecasts(city_id, 3000, random.Random(1))
+    WeatherForecast.insert_weather_forecasts(forecasts)
+
+    _assert_percentiles(
+        column_name, _get_column_values(forecasts, column_name)
+    )
+
+
+@pytest.mark.parametrize('column_name', sketches.SKETCHED_COLUMNS)
+def test_histogram_matches_brute_force(city_id, column_name):
+    forecasts = _generate_forecasts(city_id, 3000, random.Random(2))
+    WeatherForecast.insert_weather_forecasts(forecasts)
+
+    _assert_histogram(
+        column_name, _get_column_values(forecasts, column_name), 20
+    )
+
+
+def test_sketch_follows_updates_and_deletes(city_id):
+    rnd = random.Random(3)
+    forecasts = _generate_forecasts(city_id, 1000, rnd)
+    WeatherForecast.insert_weather_forecasts(forecasts)
+
+    # Half of the days are forecasted again with other values.
+    updated = _generate_forecasts(city_id, 500, rnd)
+    WeatherForecast.insert_weather_forecasts(updated)
+    forecasts[:500] = updated
+
+    with _db_connect(config.db_name) as cur:
+        cur.execute('DELETE FROM WeatherForecast WHERE "date" >= ?;', (
+            forecasts[900][1],
+        ))
+    del forecasts[900:]
+
+    for column_name in sketches.SKETCHED_COLUMNS:
+        _assert_percentiles(
+            column_name, _get_column_values(forecasts, column_name)
+        )
+
+    select_sketch = '''SELECT city_id, column_name, bucket, "count"
+        FROM WeatherSketch WHERE "count" > 0
+        ORDER BY city_id, column_name, bucket;'''
+
+    with _db_connect(config.db_name) as cur:
+        cur.execute(select_sketch)
+        maintained = cur.fetchall()
+
+    WeatherDb.rebuild_sketches()
+
+    with _db_connect(config.db_name) as cur:
+        cur.execute(select_sketch)
+        assert cur.fetchall() == maintained
+
+
+def test_percentiles_of_empty_sketch():
+    assert sketches.get_percentiles([(1, 0)], [50]) == {50: None}
+
+
+def test_bucket_value_is_within_accuracy():
+    for bucket in range(1, sketches.MAX_BUCKET + 1):
+        lower = sketches.MIN_VALUE * sketches.GAMMA ** (bucket - 1)
+        upper = sketches.MIN_VALUE * sketches.GAMMA ** bucket
+        value = sketches.get_bucket_value(bucket)
+
+        for bound in (lower, upper):
+            assert abs(value - bound) <= (
+                sketches.RELATIVE_ACCURACY * bound * (1 + 1e-9)
+            )
+
+        assert sketches.get_bucket_value(-bucket) == -value
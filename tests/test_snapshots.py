@@ -0,0 +1,166 @@
+import os
+import threading
+
+import pytest
+
+import config
+from weather_db.connection_pool import close_pool, get_pools_stats
+from weather_db.db_manager import _db_connect
+from weather_db.snapshots import (
+    build_snapshot, get_pointer_path, get_snapshots, pin_snapshot,
+    resolve_db_name, unpin_snapshot
+)
+
+
+@pytest.fixture
+def db_name(tmp_path, monkeypatch):
+    db_name = str(tmp_path / 'weather.db')
+    monkeypatch.setattr(config, 'db_name', db_name)
+    monkeypatch.setattr(config, 'snapshot_mode', True)
+
+    with _db_connect(db_name) as cur:
+        cur.execute('CREATE TABLE Item (name TEXT);')
+        cur.execute(
+            'CREATE TABLE CityRefresh '
+            '(city_id INTEGER PRIMARY KEY, due_at FLOAT);'
+        )
+
+    yield db_name
+
+    for path in (db_name, *get_snapshots(db_name)):
+        close_pool(path)
+
+
+def _insert_item(name):
+    with _db_connect(config.db_name) as cur:
+        cur.execute('INSERT INTO Item VALUES (?);', (name,))
+
+
+def _select_items():
+    with _db_connect(config.db_name, read_only=True) as cur:
+        cur.execute('SELECT name FROM Item ORDER BY name;')
+        return [name for name, in cur.fetchall()]
+
+
+def test_snapshot_is_published(db_name):
+    _insert_item('a')
+
+    token = pin_snapshot(db_name)
+    try:
+        with build_snapshot(db_name) as staging:
+            assert resolve_db_name(db_name) == staging
+            _insert_item('b')
+
+        # Pinned readers keep the snapshot of their start.
+        assert _select_items() == ['a']
+    finally:
+        unpin_snapshot(token)
+
+    assert _select_items() == ['a', 'b']
+    assert resolve_db_name(db_name) == get_snapshots(db_name)[-1]
+    assert not os.path.exists(staging)
+
+
+def test_pinned_reader_across_publishes(db_name):
+    with build_snapshot(db_name):
+        _insert_item('a')
+
+    token = pin_snapshot(db_name)
+    pinned = resolve_db_name(db_name)
+    try:
+        for name in 'bc':
+            with build_snapshot(db_name, keep=1):
+                _insert_item(name)
+
+            # The replaced snapshots are closed, the pinned one is kept.
+            assert _select_items() == ['a']
+            assert pinned in get_pools_stats()
+    finally:
+        unpin_snapshot(token)
+
+    assert _select_items() == ['a', 'b', 'c']
+    assert [
+        path for path in get_pools_stats()
+        if os.path.dirname(path) == os.path.dirname(db_name)
+    ] == [resolve_db_name(db_name)]
+
+
+def test_failed_snapshot_is_discarded(db_name):
+    with build_snapshot(db_name):
+        _insert_item('a')
+
+    with pytest.raises(RuntimeError):
+        with build_snapshot(db_name) as staging:
+            _insert_item('b')
+            raise RuntimeError
+
+    assert _select_items() == ['a']
+    assert not os.path.exists(staging)
+    assert len(get_snapshots(db_name)) == 1
+
+
+def test_old_snapshots_are_removed(db_name):
+    for name in 'abcd':
+        with build_snapshot(db_name, keep=2):
+            _insert_item(name)
+
+    snapshots = get_snapshots(db_name)
+
+    assert len(snapshots) == 2
+    with open(get_pointer_path(db_name), encoding='utf-8') as file:
+        assert file.read() == os.path.basename(snapshots[-1])
+    assert _select_items() == ['a', 'b', 'c', 'd']
+
+
+def test_builds_wait_for_each_other(db_name):
+    first_started = threading.Event()
+    release_first = threading.Event()
+
+    def build(name, started=None, release=None):
+        with build_snapshot(db_name):
+            if started is not None:
+                started.set()
+                release.wait(5)
+            _insert_item(name)
+
+    first = threading.Thread(
+        target=build, args=('a', first_started, release_first)
+    )
+    first.start()
+    first_started.wait(5)
+
+    second = threading.Thread(target=build, args=('b',))
+    second.start()
+    second.join(0.2)
+    # The second build waits for the lock of the first one.
+    assert second.is_alive()
+
+    release_first.set()
+    first.join(5)
+    second.join(5)
+
+    assert _select_items() == ['a', 'b']
+
+
+def test_carried_tables_are_copied_on_publish(db_name):
+    with build_snapshot(db_name):
+        pass
+
+    with _db_connect(db_name) as cur:
+        cur.execute('INSERT INTO CityRefresh VALUES (1, 100);')
+
+    def set_due(due_at):
+        with _db_connect(db_name) as cur:
+            cur.execute('UPDATE CityRefresh SET due_at = ?;', (due_at,))
+
+    with build_snapshot(db_name):
+        # Threads do not share the staging snapshot, so it is written
+        # to the active one, like the scheduler claims.
+        thread = threading.Thread(target=set_due, args=(0,))
+        thread.start()
+        thread.join(5)
+        _insert_item('a')
+
+    with _db_connect(db_name, read_only=True) as cur:
+        cur.execute('SELECT due_at FROM CityRefresh;')
+        assert cur.fetchall() == [(0,)]
@@ -0,0 +1,122 @@
+import random
+import time
+
+import pytest
+
+from weather_db.spatial_index import SpatialIndex, haversine_km
+
+
+def _make_cities(count: int, seed: int = 1) -> list:
+    rnd = random.Random(seed)
+    cities = []
+
+    for city_id in range(1, count + 1):
+        # Dense clusters, as real cities are, and scattered ones.
+        if city_id % 3:
+            lat = 50.45 + rnd.gauss(0, 0.5)
+            lon = 30.52 + rnd.gauss(0, 0.5)
+        else:
+            lat, lon = rnd.uniform(-90, 90), rnd.uniform(-180, 180)
+
+        cities.append((city_id, f'City {city_id}', lat, lon))
+
+    return cities
+
+
+def _brute_force(cities: list, lat: float, lon: float) -> list:
+    return sorted(
+        (haversine_km(lat, lon, city[2], city[3]), city) for city in cities
+    )
+
+
+def _distances(found: list) -> list:
+    return [round(distance, 6) for distance, _ in found]
+
+
+@pytest.fixture(scope='module')
+def cities() -> list:
+    return _make_cities(3000)
+
+
+@pytest.fixture(scope='module')
+def index(cities) -> SpatialIndex:
+    return SpatialIndex(cities, max_coarse_cell_cities=16)
+
+
+POINTS = (
+    (50.45, 30.52), (0.0, 0.0), (89.9, 10.0), (-89.9, -170.0),
+    (10.0, 179.95), (-33.9, -179.99), (51.0, 31.0)
+)
+
+
+@pytest.mark.parametrize('lat, lon', POINTS)
+@pytest.mark.parametrize('k', (1, 10, 200))
+def test_nearest_matches_brute_force(cities, index, lat, lon, k):
+    expected = _brute_force(cities, lat, lon)[:k]
+
+    assert _distances(index.nearest(lat, lon, k)) == _distances(expected)
+
+
+@pytest.mark.parametrize('lat, lon', POINTS)
+@pytest.mark.parametrize('radius', (5, 100, 3000))
+def test_within_radius_matches_brute_force(cities, index, lat, lon, radius):
+    expected = [
+        item for item in _brute_force(cities, lat, lon) if item[0] <= radius
+    ][:100]
+
+    assert _distances(index.within_radius(lat, lon, radius)) == (
+        _distances(expected)
+    )
+
+
+@pytest.mark.parametrize('bbox', (
+    (50.0, 30.0, 51.0, 31.0), (-10.0, -20.0, 40.0, 60.0),
+    (-60.0, 170.0, 60.0, -170.0), (-90.0, -180.0, 90.0, 180.0)
+))
+def test_within_bbox_matches_brute_force(cities, index, bbox):
+    min_lat, min_lon, max_lat, max_lon = bbox
+
+    def in_bbox(city) -> bool:
+        _, _, lat, lon = city
+        in_lon = (
+            lon >= min_lon or lon <= max_lon if min_lon > max_lon
+            else min_lon <= lon <= max_lon
+        )
+        return in_lon and min_lat <= lat <= max_lat
+
+    found = index.within_bbox(*bbox, limit=5000)
+
+    assert sorted(city[0] for _, city in found) == sorted(
+        city[0] for city in cities if in_bbox(city)
+    )
+
+
+@pytest.mark.parametrize('max_coarse_cell_cities', (1, 64))
+def test_nearest_with_k_above_number_of_cities(max_coarse_cell_cities):
+    cities = [
+        (city_id, f'City {city_id}', 50.45 + city_id * 0.001, 30.52)
+        for city_id in range(100)
+    ]
+    index = SpatialIndex(
+        cities, max_coarse_cell_cities=max_coarse_cell_cities
+    )
+
+    started = time.perf_counter()
+    found = index.nearest(50.45, 30.52, 200)
+
+    assert time.perf_counter() - started < 5
+    assert _distances(found) == _distances(
+        _brute_force(cities, 50.45, 30.52)
+    )
+
+
+def test_nearest_of_empty_index():
+    assert SpatialIndex([]).nearest(0.0, 0.0, 10) == []
+
+
+def test_incorrect_coordinates(index):
+    with pytest.raises(ValueError):
+        index.nearest(91.0, 0.0)
+
+    with pytest.raises(ValueError):
+        index.within_bbox(10.0, 0.0, 5.0, 1.0)
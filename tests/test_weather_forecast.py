@@ -0,0 +1,191 @@
+from datetime import date, timedelta
+
+import pytest
+
+import config
+from weather_db.connection_pool import close_pool
+from weather_db.db_manager import (
+    City, QueryPlanError, UpsertCounts, WeatherDb, WeatherForecast,
+    _db_connect
+)
+
+
+@pytest.fixture
+def city_id(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'db_name', str(tmp_path / 'weather.db'))
+    monkeypatch.setattr(config, 'snapshot_mode', False)
+
+    WeatherDb.create_tables()
+    City.insert_city('Kyiv', (50.45, 30.52))
+
+    yield City.get_city_id_by_name('Kyiv')
+
+    close_pool(config.db_name)
+
+
+def _forecast(city_id, date, temp):
+    return city_id, date, temp, None, 40, 1013, 60, 3.5
+
+
+def _select_temps():
+    return WeatherForecast.select_dated_records_of_given_column('Kyiv', 'temp')
+
+
+def test_insert_counts(city_id):
+    counts = WeatherForecast.insert_weather_forecasts([
+        _forecast(city_id, '2021-01-01', 1.0),
+        _forecast(city_id, '2021-01-02', 2.0),
+    ])
+
+    assert counts == UpsertCounts(inserted=2, updated=0, unchanged=0)
+
+
+def test_upsert_counts(city_id):
+    WeatherForecast.insert_weather_forecasts([
+        _forecast(city_id, '2021-01-01', 1.0),
+        _forecast(city_id, '2021-01-02', 2.0),
+    ])
+
+    counts = WeatherForecast.insert_weather_forecasts([
+        _forecast(city_id, '2021-01-01', 1.0),
+        _forecast(city_id, '2021-01-02', 5.0),
+        _forecast(city_id, '2021-01-03', 3.0),
+    ])
+
+    assert counts == UpsertCounts(inserted=1, updated=1, unchanged=1)
+    assert _select_temps() == [
+        ('2021-01-01', 1.0), ('2021-01-02', 5.0), ('2021-01-03', 3.0)
+    ]
+
+
+def test_upsert_without_skip_unchanged(city_id):
+    WeatherForecast.insert_weather_forecasts([
+        _forecast(city_id, '2021-01-01', 1.0)
+    ])
+
+    counts = WeatherForecast.insert_weather_forecasts(
+        [_forecast(city_id, '2021-01-01', 1.0)], skip_unchanged=False
+    )
+
+    assert counts == UpsertCounts(inserted=0, updated=1, unchanged=0)
+
+
+def test_duplicates_in_batch(city_id):
+    counts = WeatherForecast.insert_weather_forecasts([
+        _forecast(city_id, '2021-01-01', 1.0),
+        _forecast(city_id, '2021-01-02', 2.0),
+        _forecast(city_id, '2021-01-01', 4.0),
+    ])
+
+    assert counts == UpsertCounts(inserted=2, updated=0, unchanged=0)
+    assert _select_temps() == [
+        ('2021-01-01', 4.0), ('2021-01-02', 2.0)
+    ]
+
+    statistics = WeatherForecast.select_column_statistics('Kyiv', 'temp')
+    assert statistics['count'] == 2
+    assert statistics['mean'] == pytest.approx(3.0)
+
+
+def test_duplicates_of_existing_row_in_batch(city_id):
+    WeatherForecast.insert_weather_forecasts([
+        _forecast(city_id, '2021-01-01', 1.0)
+    ])
+
+    counts = WeatherForecast.insert_weather_forecasts([
+        _forecast(city_id, '2021-01-01', 2.0),
+        _forecast(city_id, '2021-01-01', 1.0),
+    ])
+
+    assert counts == UpsertCounts(inserted=0, updated=0, unchanged=1)
+    assert _select_temps() == [('2021-01-01', 1.0)]
+
+
+def test_mean_values_of_all_cities(city_id):
+    City.insert_city('Lviv', (49.84, 24.03))
+    WeatherForecast.insert_weather_forecasts([
+        _forecast(city_id, '2021-01-01', 1.0),
+        _forecast(city_id, '2021-01-02', 2.0),
+    ])
+
+    means = WeatherForecast.select_mean_values_of_columns(
+        column_names=['temp', 'pcp']
+    )
+
+    assert means == {
+        'Kyiv': {'temp': 1.5, 'pcp': None},
+        'Lviv': {'temp': None, 'pcp': None},
+    }
+
+
+def test_mean_values_of_listed_cities(city_id, monkeypatch):
+    monkeypatch.setattr(WeatherForecast, '_max_bound_names', 1)
+    City.insert_city('Lviv', (49.84, 24.03))
+    WeatherForecast.insert_weather_forecasts([
+        _forecast(city_id, '2021-01-01', 1.0),
+        _forecast(City.get_city_id_by_name('Lviv'), '2021-01-01', 3.0),
+    ])
+
+    means = WeatherForecast.select_mean_values_of_columns(
+        ['Lviv', 'Odesa', 'Kyiv'], ['temp']
+    )
+
+    assert means == {
+        'Lviv': {'temp': 3.0}, 'Odesa': {'temp': None}, 'Kyiv': {'temp': 1.0}
+    }
+
+
+def test_query_plans_use_indexes(city_id):
+    start_date = date(2020, 1, 1)
+    WeatherForecast.insert_weather_forecasts([
+        _forecast(city_id, (start_date + timedelta(days=day)).isoformat(), 0)
+        for day in range(1000)
+    ])
+
+    with _db_connect(config.db_name) as cur:
+        cur.execute('ANALYZE;')
+
+    plans = WeatherDb.check_query_plans()
+
+    assert 'select_latest_forecasts' in plans
+
+
+def test_query_plans_reject_scans(city_id):
+    with _db_connect(config.db_name) as cur:
+        cur.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index' "
+            "AND tbl_name = 'WeatherForecast';"
+        )
+        for name, in cur.fetchall():
+            cur.execute(f'DROP INDEX {name};')
+
+    with pytest.raises(QueryPlanError):
+        WeatherDb.check_query_plans()
+
+
+def test_one_index_on_city_and_date(city_id):
+    with _db_connect(config.db_name, read_only=True) as cur:
+        cur.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index' "
+            "AND tbl_name = 'WeatherForecast';"
+        )
+        assert cur.fetchall() == [('ux_weather_forecast_city_date',)]
+
+
+def test_drop_and_create_tables(city_id):
+    WeatherForecast.insert_weather_forecasts([
+        _forecast(city_id, '2021-01-01', 1.0)
+    ])
+
+    WeatherDb.drop_weather_forecast_table()
+
+    with _db_connect(config.db_name, read_only=True) as cur:
+        cur.execute('SELECT COUNT(*) FROM WeatherRollup;')
+        assert cur.fetchone() == (0,)
+        cur.execute('PRAGMA user_version;')
+        assert cur.fetchone() == (0,)
+
+    WeatherDb.create_tables()
+
+    assert _select_temps() == []
+    assert City.get_city_id_by_name('Kyiv') == city_id
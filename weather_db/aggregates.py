@@ -0,0 +1,135 @@
+"""This module contains sql of the WeatherAggregate table.
+
+For every (city_id, column) the table holds count, sum, sum of squares,
+min and max of the column values. It is maintained by triggers
+in the same transaction as changes of WeatherForecast,
+so mean, variance and extremes are read from a single row.
+
+"""
+from typing import Tuple
+
+AGGREGATED_COLUMNS = (
+    'temp', 'pcp', 'clouds', 'pressure', 'humidity', 'wind_speed'
+)
+
+SQL_FOR_CREATE_TABLE = (
+    '''CREATE TABLE IF NOT EXISTS WeatherAggregate
+    (
+        city_id INTEGER NOT NULL,
+        column_name VARCHAR(32) NOT NULL,
+        "count" INTEGER NOT NULL,
+        "sum" FLOAT NOT NULL,
+        sum_of_squares FLOAT NOT NULL,
+        "min" FLOAT,
+        "max" FLOAT,
+
+        PRIMARY KEY (city_id, column_name)
+    ) WITHOUT ROWID;
+    '''
+)
+
+
+def _get_sql_for_add(column: str) -> str:
+    """Adds the new value of the column to the aggregate."""
+
+    return f'''INSERT INTO WeatherAggregate(
+            city_id, column_name, "count", "sum", sum_of_squares, "min", "max"
+        ) VALUES (
+            new.city_id, '{column}', new.{column} IS NOT NULL,
+            COALESCE(new.{column}, 0),
+            COALESCE(new.{column} * new.{column}, 0),
+            new.{column}, new.{column}
+        )
+        ON CONFLICT(city_id, column_name) DO UPDATE SET
+            "count" = "count" + excluded."count",
+            "sum" = "sum" + excluded."sum",
+            sum_of_squares = sum_of_squares + excluded.sum_of_squares,
+            "min" = CASE
+                WHEN "min" IS NULL OR excluded."min" < "min"
+                THEN excluded."min" ELSE "min" END,
+            "max" = CASE
+                WHEN "max" IS NULL OR excluded."max" > "max"
+                THEN excluded."max" ELSE "max" END;
+    '''
+
+
+def _get_sql_for_remove(column: str) -> str:
+    """Removes the old value of the column from the aggregate.
+    Extremes are searched again only if the removed value was one of them.
+
+    """
+
+    return f'''UPDATE WeatherAggregate SET
+            "count" = "count" - (old.{column} IS NOT NULL),
+            "sum" = "sum" - COALESCE(old.{column}, 0),
+            sum_of_squares = (
+                sum_of_squares - COALESCE(old.{column} * old.{column}, 0)
+            ),
+            "min" = CASE WHEN old.{column} <= "min" THEN (
+                SELECT MIN({column}) FROM WeatherForecast
+                WHERE city_id = old.city_id
+            ) ELSE "min" END,
+            "max" = CASE WHEN old.{column} >= "max" THEN (
+                SELECT MAX({column}) FROM WeatherForecast
+                WHERE city_id = old.city_id
+            ) ELSE "max" END
+        WHERE city_id = old.city_id AND column_name = '{column}';
+    '''
+
+
+def get_sql_for_triggers() -> Tuple[str, ...]:
+    add = ''.join(_get_sql_for_add(column) for column in AGGREGATED_COLUMNS)
+    remove = ''.join(
+        _get_sql_for_remove(column) for column in AGGREGATED_COLUMNS
+    )
+    updated_columns = ', '.join(('city_id', *AGGREGATED_COLUMNS))
+
+    return (
+        f'''CREATE TRIGGER IF NOT EXISTS tr_weather_aggregate_insert
+        AFTER INSERT ON WeatherForecast
+        BEGIN
+            {add}
+        END;
+        ''',
+        f'''CREATE TRIGGER IF NOT EXISTS tr_weather_aggregate_update
+        AFTER UPDATE OF {updated_columns} ON WeatherForecast
+        BEGIN
+            {remove}
+            {add}
+        END;
+        ''',
+        f'''CREATE TRIGGER IF NOT EXISTS tr_weather_aggregate_delete
+        AFTER DELETE ON WeatherForecast
+        BEGIN
+            {remove}
+        END;
+        ''',
+    )
+
+
+def get_sql_for_rebuild() -> Tuple[str, ...]:
+    """Recalculates the whole WeatherAggregate table from WeatherForecast."""
+
+    selects = '\nUNION ALL\n'.join(
+        f'''SELECT city_id, '{column}', COUNT({column}),
+            COALESCE(SUM({column}), 0),
+            COALESCE(SUM({column} * {column}), 0),
+            MIN({column}), MAX({column})
+        FROM WeatherForecast GROUP BY city_id'''
+        for column in AGGREGATED_COLUMNS
+    )
+
+    return (
+        'DELETE FROM WeatherAggregate;',
+        f'''INSERT INTO WeatherAggregate(
+            city_id, column_name, "count", "sum", sum_of_squares, "min", "max"
+        )
+        {selects};
+        ''',
+    )
+
+
+if __name__ == '__main__':
+    from weather_db.db_manager import WeatherDb
+
+    WeatherDb.rebuild_aggregates()
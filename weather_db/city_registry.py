@@ -0,0 +1,60 @@
+"""This module contains an in-process cache of city name -> city id."""
+import threading
+from collections import OrderedDict
+from typing import Callable, Union
+
+
+class CityRegistry:
+    """Bounded LRU cache in front of the city id lookup.
+    Unknown cities are not cached, so they are found as soon as inserted.
+    Cache must be invalidated every time the City table is changed.
+
+    """
+
+    def __init__(
+            self, loader: Callable[[str], Union[int, None]],
+            max_size: int = 4096
+    ):
+        self._loader = loader
+        self._max_size = max_size
+
+        self._cities = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def get_city_id(self, name: str) -> Union[int, None]:
+        with self._lock:
+            city_id = self._cities.get(name)
+
+            if city_id is not None:
+                self._cities.move_to_end(name)
+                self.hits += 1
+                return city_id
+
+            self.misses += 1
+
+        city_id = self._loader(name)
+
+        if city_id is not None:
+            with self._lock:
+                self._cities[name] = city_id
+                self._cities.move_to_end(name)
+
+                if len(self._cities) > self._max_size:
+                    self._cities.popitem(last=False)
+
+        return city_id
+
+    def invalidate(self, name: str = None) -> None:
+        """Removes the given city from the cache or clears the whole cache."""
+
+        with self._lock:
+            if name is None:
+                self._cities.clear()
+            else:
+                self._cities.pop(name, None)
+
+    def __len__(self) -> int:
+        return len(self._cities)
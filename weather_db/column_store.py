@@ -0,0 +1,276 @@
+"""This module contains an in-memory columnar store of the forecasts.
+
+Forecasts of a city are loaded once into date-sorted columns
+(NumPy arrays or array('d') without NumPy), missing values are NaN.
+When the data version changes, only the cities whose forecasts
+were changed since they were loaded are read again.
+
+"""
+import math
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from itertools import islice
+from typing import Dict, List, NamedTuple, Tuple, Union
+
+from support_functions.calculators import iter_simple_moving_average
+from support_functions.metrics import registry
+from weather_db.db_manager import City, DataVersion, WeatherForecast
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional, array('d') is used without it.
+    np = None
+
+
+class CityColumns(NamedTuple):
+    # Data version, that was current before the columns were read.
+    version: int
+    dates: List[str]
+    columns: Dict[str, Union[array, 'np.ndarray']]
+
+
+def _build_city_columns(version: int, forecasts: List[tuple]) -> CityColumns:
+    column_names = WeatherForecast._available_columns
+
+    if forecasts:
+        dates, *values = zip(*forecasts)
+    else:
+        dates, values = (), [()] * len(column_names)
+
+    if np is not None:
+        # None is converted to NaN by the float dtype.
+        columns = {
+            name: np.array(column_values, dtype=float)
+            for name, column_values in zip(column_names, values)
+        }
+    else:
+        columns = {
+            name: array('d', (
+                math.nan if value is None else value
+                for value in column_values
+            ))
+            for name, column_values in zip(column_names, values)
+        }
+
+    return CityColumns(version, list(dates), columns)
+
+
+class ColumnStore:
+    """Bounded LRU cache of the city columns,
+    which is checked against the data version on every read.
+
+    """
+
+    def __init__(self, max_cities: int = 1024):
+        self._max_cities = max_cities
+
+        self._cities = OrderedDict()
+        self._lock = threading.Lock()
+        self._data_version = None
+
+        self.loads = 0
+
+    def refresh(self) -> int:
+        """Evicts the cities changed since they were loaded.
+        Does nothing while the data version is the same.
+        Returns the current data version.
+
+        """
+
+        data_version = DataVersion.get_version()
+
+        with self._lock:
+            if data_version == self._data_version:
+                return data_version
+
+            city_versions = DataVersion.get_city_versions()
+
+            for city_id, city_columns in list(self._cities.items()):
+                if city_versions.get(city_id, math.inf) > city_columns.version:
+                    del self._cities[city_id]
+
+            self._data_version = data_version
+
+        return data_version
+
+    def __len__(self) -> int:
+        return len(self._cities)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._cities.clear()
+            self._data_version = None
+
+    def get_city_columns(self, city_name: str) -> CityColumns:
+        # The version is read before the forecasts, so the forecasts
+        # changed in between are read again on the next refresh.
+        version = self.refresh()
+
+        city_id = City.get_cached_city_id_by_name(city_name)
+        if city_id is None:
+            return _build_city_columns(version, [])
+
+        with self._lock:
+            city_columns = self._cities.get(city_id)
+
+            if city_columns is not None:
+                self._cities.move_to_end(city_id)
+                return city_columns
+
+        city_columns = _build_city_columns(
+            version, WeatherForecast.select_columns_of_city(city_id)
+        )
+
+        with self._lock:
+            self.loads += 1
+
+            # Another thread has already refreshed the store
+            # to a newer version, so these columns could be outdated.
+            if version != self._data_version:
+                return city_columns
+
+            self._cities[city_id] = city_columns
+            self._cities.move_to_end(city_id)
+
+            if len(self._cities) > self._max_cities:
+                self._cities.popitem(last=False)
+
+        return city_columns
+
+    def _get_column(
+            self, city_name: str, column_name: str
+    ) -> Tuple[List[str], Union[array, 'np.ndarray']]:
+
+        if column_name not in WeatherForecast._available_columns:
+            raise ValueError(
+                'Pass the correct column. '
+                f'Available parameters: {WeatherForecast._available_columns}'
+            )
+
+        city_columns = self.get_city_columns(city_name)
+
+        return city_columns.dates, city_columns.columns[column_name]
+
+    def select_column_statistics(
+            self, city_name: str, column_name: str
+    ) -> dict:
+        """Same as WeatherForecast.select_column_statistics,
+        but calculated from the columns.
+
+        """
+
+        _, column = self._get_column(city_name, column_name)
+
+        if np is not None:
+            values = column[~np.isnan(column)]
+            count = len(values)
+
+            if count:
+                return {
+                    'count': count, 'mean': float(values.mean()),
+                    'std_dev': float(values.std()),
+                    'min': float(values.min()), 'max': float(values.max())
+                }
+        else:
+            values = [value for value in column if not math.isnan(value)]
+            count = len(values)
+
+            if count:
+                mean_value = math.fsum(values) / count
+                variance = math.fsum(
+                    (value - mean_value) ** 2 for value in values
+                ) / count
+
+                return {
+                    'count': count, 'mean': mean_value,
+                    'std_dev': math.sqrt(variance),
+                    'min': min(values), 'max': max(values)
+                }
+
+        return {
+            'count': 0, 'mean': None, 'std_dev': None,
+            'min': None, 'max': None
+        }
+
+    @staticmethod
+    def _fill_missing(
+            column: Union[array, 'np.ndarray'], missing: float
+    ) -> List[float]:
+
+        if np is not None:
+            return np.nan_to_num(column, nan=missing).tolist()
+
+        return [missing if math.isnan(value) else value for value in column]
+
+    def select_column_values(
+            self, city_name: str, column_name: str, missing: float = 0.0
+    ) -> List[float]:
+        """Returns the column values sorted by date,
+        missing values are replaced with the given one.
+
+        """
+
+        _, column = self._get_column(city_name, column_name)
+
+        return self._fill_missing(column, missing)
+
+    def select_dated_column_values(
+            self, city_name: str, column_name: str, missing: float = 0.0
+    ) -> List[tuple]:
+        """Returns (date, value) pairs of the column sorted by date."""
+
+        dates, column = self._get_column(city_name, column_name)
+
+        return list(zip(dates, self._fill_missing(column, missing)))
+
+    def select_moving_average_of_column(
+            self, city_name: str, column_name: str, n: int,
+            start_dt: str = None, end_dt: str = None
+    ) -> List[float]:
+        """Same as the averages of
+        WeatherForecast.select_moving_aggregates_of_column,
+        but calculated from the columns.
+
+        """
+
+        if n < 1:
+            raise ValueError('N must be a positive number!')
+
+        dates, column = self._get_column(city_name, column_name)
+
+        # The windows are filled by all the values before the end date.
+        end = bisect_right(dates, end_dt) if end_dt else len(dates)
+        if n > end:
+            raise ValueError(
+                'N cannot be greater than the length'
+                f' of the data! Maximum is {end}'
+            )
+
+        # Index of the first returned window in the list of full windows.
+        first = max(bisect_left(dates, start_dt or '') - (n - 1), 0)
+
+        if np is not None:
+            cumulative_sum = np.cumsum(np.nan_to_num(column[:end]))
+            window_sums = cumulative_sum[n - 1:].copy()
+            window_sums[1:] -= cumulative_sum[:-n]
+
+            return (window_sums[first:] / n).tolist()
+
+        values = (
+            0.0 if math.isnan(value) else value
+            for value in islice(column, end)
+        )
+        moving_average = iter_simple_moving_average(values, n)
+
+        return list(moving_average)[first:]
+
+
+column_store = ColumnStore()
+
+registry.gauge(
+    'weather_db_column_store_stats', 'Loads and size of the column store.',
+    lambda: {('loads',): column_store.loads, ('cities',): len(column_store)},
+    ('stat',)
+)
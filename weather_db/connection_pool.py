@@ -0,0 +1,256 @@
+"""This module contains a pool of long-lived sqlite connections.
+
+Connections are opened lazily, configured with pragmas once
+and then reused by every thread that works with the same database file.
+
+"""
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from queue import Empty, LifoQueue
+from typing import Dict, Iterator
+
+import config
+from support_functions.metrics import registry
+
+
+class PoolTimeoutError(sqlite3.OperationalError):
+    """Raised when no connection became free in the given time."""
+
+
+class ConnectionPool:
+    """Bounded pool of sqlite connections for a single database file."""
+
+    _pragmas = (
+        'PRAGMA journal_mode=WAL;',
+        'PRAGMA synchronous=NORMAL;',
+        'PRAGMA mmap_size=268435456;',
+        'PRAGMA cache_size=-16000;',
+        'PRAGMA temp_store=MEMORY;',
+    )
+
+    def __init__(
+            self, db_name: str, max_size: int = 8, timeout: float = 30.0
+    ):
+        self._db_name = db_name
+        self._max_size = max_size
+        self._timeout = timeout
+
+        self._idle = LifoQueue(maxsize=max_size)
+        self._lock = threading.Lock()
+        self._opened = 0
+        self._closed = False
+
+        self._stats = {
+            'opened': 0,
+            'closed': 0,
+            'acquired': 0,
+            'reused': 0,
+            'waits': 0,
+            'wait_time_total': 0.0,
+            'wait_time_max': 0.0,
+        }
+
+    @property
+    def db_name(self) -> str:
+        return self._db_name
+
+    def _open_connection(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self._db_name, timeout=self._timeout, check_same_thread=False
+        )
+
+        for pragma in self._pragmas:
+            conn.execute(pragma)
+
+        return conn
+
+    def _reserve_new_connection(self) -> bool:
+        with self._lock:
+            if self._opened >= self._max_size:
+                return False
+
+            self._opened += 1
+            self._stats['opened'] += 1
+
+        return True
+
+    def _record_wait(self, wait_time: float) -> None:
+        with self._lock:
+            self._stats['waits'] += 1
+            self._stats['wait_time_total'] += wait_time
+            self._stats['wait_time_max'] = max(
+                self._stats['wait_time_max'], wait_time
+            )
+
+    def _acquire(self) -> sqlite3.Connection:
+        try:
+            conn = self._idle.get_nowait()
+        except Empty:
+            conn = None
+
+        if conn is not None:
+            with self._lock:
+                self._stats['acquired'] += 1
+                self._stats['reused'] += 1
+            return conn
+
+        if self._reserve_new_connection():
+            try:
+                conn = self._open_connection()
+            except sqlite3.Error:
+                with self._lock:
+                    self._opened -= 1
+                raise
+
+            with self._lock:
+                self._stats['acquired'] += 1
+            return conn
+
+        started = time.perf_counter()
+        try:
+            conn = self._idle.get(timeout=self._timeout)
+        except Empty:
+            raise PoolTimeoutError(
+                f'No free connection to {self._db_name} '
+                f'in {self._timeout} seconds.'
+            ) from None
+        finally:
+            self._record_wait(time.perf_counter() - started)
+
+        with self._lock:
+            self._stats['acquired'] += 1
+            self._stats['reused'] += 1
+
+        return conn
+
+    def _release(self, conn: sqlite3.Connection) -> None:
+        if self._closed:
+            self._discard(conn)
+        else:
+            self._idle.put_nowait(conn)
+
+    def _discard(self, conn: sqlite3.Connection) -> None:
+        conn.close()
+
+        with self._lock:
+            self._opened -= 1
+            self._stats['closed'] += 1
+
+    @contextmanager
+    def connection(
+            self, read_only: bool = False
+    ) -> Iterator[sqlite3.Connection]:
+        """Gives a connection from the pool and returns it back after use.
+        Changes are committed only if read_only is False,
+        on error the transaction is rolled back.
+
+        """
+
+        conn = self._acquire()
+
+        try:
+            yield conn
+        except BaseException:
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                self._discard(conn)
+            else:
+                self._release(conn)
+            raise
+
+        try:
+            if read_only:
+                if conn.in_transaction:
+                    conn.rollback()
+            else:
+                conn.commit()
+        except sqlite3.Error:
+            self._discard(conn)
+            raise
+
+        self._release(conn)
+
+    def close(self) -> None:
+        """Closes all idle connections of the pool,
+        connections in use are closed when they are returned.
+
+        """
+
+        self._closed = True
+
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except Empty:
+                break
+
+            self._discard(conn)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['open'] = self._opened
+
+        stats['idle'] = self._idle.qsize()
+        stats['in_use'] = stats['open'] - stats['idle']
+        stats['max_size'] = self._max_size
+
+        return stats
+
+
+_pools: Dict[str, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_name: str) -> ConnectionPool:
+    """Returns the pool for the given database file, creating it if needed."""
+
+    with _pools_lock:
+        pool = _pools.get(db_name)
+
+        if pool is None:
+            pool = _pools[db_name] = ConnectionPool(
+                db_name, config.pool_max_size
+            )
+
+    return pool
+
+
+def close_pool(db_name: str) -> None:
+    """Closes the pool of the database file, if it was opened."""
+
+    with _pools_lock:
+        pool = _pools.pop(db_name, None)
+
+    if pool is not None:
+        pool.close()
+
+
+def close_pools() -> None:
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+
+    for pool in pools:
+        pool.close()
+
+
+def get_pools_stats() -> Dict[str, dict]:
+    with _pools_lock:
+        pools = list(_pools.items())
+
+    return {db_name: pool.stats() for db_name, pool in pools}
+
+
+registry.gauge(
+    'weather_db_pool_stats', 'Counters and sizes of the connection pools.',
+    lambda: {
+        (db_name, stat): value
+        for db_name, stats in get_pools_stats().items()
+        for stat, value in stats.items()
+    },
+    ('db', 'stat')
+)
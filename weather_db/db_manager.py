@@ -2,77 +2,229 @@
 basic functions for CRUD operations with the db.
 
 """
-import sqlite3
+import math
+import re
 from contextlib import contextmanager
-from typing import List, Union
+from typing import Dict, Iterator, List, NamedTuple, Tuple, Union
 
-from app import db_name as weather_db
+import config
+from support_functions.metrics import registry
+from weather_db import rollups, sketches
+from weather_db.aggregates import get_sql_for_rebuild
+from weather_db.city_registry import CityRegistry
+from weather_db.connection_pool import get_pool
+from weather_db.migrations import migrate, reset_schema_version
+from weather_db.query_metrics import TimedCursor
+from weather_db.snapshots import resolve_db_name
 
 
 @contextmanager
-def _db_connect(db_name) -> None:
-    conn = sqlite3.connect(db_name)
-    cur = conn.cursor()
+def _db_connect(db_name: str, read_only: bool = False) -> TimedCursor:
+    """Gives a cursor of a pooled connection, which times the statements.
+    For read_only queries the commit is skipped.
+    In the snapshot mode queries go to the active snapshot.
 
-    yield cur
+    """
 
-    conn.commit()
-    conn.close()
+    with get_pool(resolve_db_name(db_name)).connection(read_only) as conn:
+        cur = TimedCursor(conn.cursor())
+
+        try:
+            yield cur
+        finally:
+            cur.close()
+
+
+class QueryPlanError(AssertionError):
+    """Raised when a hot query does not use the expected index."""
+
+
+class UpsertCounts(NamedTuple):
+    inserted: int = 0
+    updated: int = 0
+    unchanged: int = 0
 
 
 class WeatherDb:
     """A class for initializing, deleting tables in the Weather database."""
 
+    # (dropped table or None for any, dependent table, statement)
+    _sql_for_dropped = (
+        (None, 'DataVersion', 'UPDATE DataVersion SET version = version + 1;'),
+        ('WeatherForecast', 'CityDataVersion', 'DELETE FROM CityDataVersion;'),
+        ('WeatherForecast', 'WeatherRollup', 'DELETE FROM WeatherRollup;'),
+        ('WeatherForecast', 'WeatherSketch', 'DELETE FROM WeatherSketch;'),
+        (
+            'City', 'CityTableVersion',
+            'UPDATE CityTableVersion SET version = version + 1;'
+        ),
+        ('City', 'CityRefresh', 'DELETE FROM CityRefresh;'),
+    )
+
+    # The tables are created by the first migration.
     @staticmethod
     def create_city_table() -> None:
-        with _db_connect(weather_db) as cur:
-            cur.execute(
-                '''CREATE TABLE IF NOT EXISTS City
-                (
-                    city_id INTEGER PRIMARY KEY,
-                    "name" VARCHAR(255) NOT NULL,
-                    latitude FLOAT,
-                    longitude FLOAT
-                );
-                '''
-            )
+        migrate(resolve_db_name(config.db_name), target_version=1)
 
     @staticmethod
     def create_weather_table() -> None:
-        with _db_connect(weather_db) as cur:
-            cur.execute(
-                '''CREATE TABLE IF NOT EXISTS WeatherForecast
-                    (
-                        forecast_id INTEGER PRIMARY KEY,
-                        date TEXT NOT NULL,
-                        temp FLOAT NOT NULL,
-                        pcp FLOAT,
-                        clouds INT NOT NULL,
-                        pressure INT NOT NULL,
-                        humidity TINYINT NOT NULL,
-                        wind_speed FLOAT NOT NULL,
-                    
-                        city_id INTEGER NOT NULL,
-                        
-                        CONSTRAINT fk_forecast_city FOREIGN KEY (city_id)
-                        REFERENCES City(city_id)
-                     );
-                '''
-            )
+        migrate(resolve_db_name(config.db_name), target_version=1)
 
     @classmethod
     def create_tables(cls) -> None:
         cls.create_city_table()
         cls.create_weather_table()
+        cls.migrate()
+
+    @staticmethod
+    def migrate() -> List[int]:
+        """Upgrades the schema of the database in place to the latest version.
+        Returns versions of the applied migrations.
+
+        """
+
+        return migrate(resolve_db_name(config.db_name))
+
+    @staticmethod
+    def check_query_plans() -> Dict[str, List[str]]:
+        """Checks with EXPLAIN QUERY PLAN that the hot queries
+        are answered from the indexes and do not scan WeatherForecast.
+        Returns plan details for every query.
+
+        """
+
+        column = WeatherForecast._available_columns[0]
+        # Any index of WeatherForecast is fine, the planner picks one
+        # by the statistics of the database.
+        forecast_index = r'SEARCH WeatherForecast USING (COVERING )?INDEX '
+        hot_queries = (
+            (
+                'get_city_id_by_name', 'USING COVERING INDEX ux_city_name',
+                City._sql_for_select_id_by_name, ('Kyiv',)
+            ),
+            (
+                'select_records_in_given_range', forecast_index,
+                WeatherForecast._sql_for_select_in_range,
+                (1, '2021-01-01', '2021-12-31')
+            ),
+            (
+                'select_column_statistics',
+                'SEARCH WeatherAggregate USING PRIMARY KEY',
+                WeatherForecast._sql_for_select_statistics, (1, column)
+            ),
+            (
+                'select_records_of_given_column', forecast_index,
+                WeatherForecast._sql_for_select_column.format(column=column),
+                (1,)
+            ),
+            (
+                'select_rollups_of_column',
+                'SEARCH WeatherRollup USING PRIMARY KEY',
+                WeatherForecast._sql_for_select_rollups,
+                (1, column, 'month', '2021-01-01', '2021-12-31')
+            ),
+            (
+                'select_latest_forecasts',
+                r'SEARCH latest USING (COVERING )?INDEX ',
+                WeatherForecast._sql_for_select_latest.format(
+                    placeholders='?'
+                ),
+                (1,)
+            ),
+            (
+                'select_distribution_of_column',
+                'SEARCH WeatherSketch USING PRIMARY KEY',
+                WeatherForecast._sql_for_select_sketch, (1, 'temp')
+            ),
+            (
+                'claim_due_cities',
+                'SEARCH CityRefresh USING INDEX ix_city_refresh_due_at',
+                CityRefresh._sql_for_select_due, (0, 0, 1)
+            ),
+        )
+
+        plans = {}
+        with _db_connect(config.db_name, read_only=True) as cur:
+            for query_name, expected_plan, sql, params in hot_queries:
+                cur.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+                details = [row[-1] for row in cur.fetchall()]
+
+                if not any(
+                        re.search(expected_plan, detail) for detail in details
+                ):
+                    raise QueryPlanError(
+                        f'{query_name} does not use {expected_plan}: '
+                        f'{details}'
+                    )
+                if any(
+                        detail.startswith('SCAN WeatherForecast')
+                        for detail in details
+                ):
+                    raise QueryPlanError(
+                        f'{query_name} scans WeatherForecast: {details}'
+                    )
+
+                plans[query_name] = details
+
+        return plans
+
+    @staticmethod
+    def rebuild_aggregates() -> None:
+        """Recalculates WeatherAggregate from WeatherForecast,
+        in case the aggregates drifted from the data.
+
+        """
+
+        with _db_connect(config.db_name) as cur:
+            for statement in get_sql_for_rebuild():
+                cur.execute(statement)
+
+            DataVersion.bump(cur)
+
+    @staticmethod
+    def rebuild_rollups() -> None:
+        """Recalculates WeatherRollup from WeatherForecast."""
+
+        with _db_connect(config.db_name) as cur:
+            for statement in rollups.get_sql_for_rebuild():
+                cur.execute(statement)
+
+            DataVersion.bump(cur)
+
+    @staticmethod
+    def rebuild_sketches() -> None:
+        """Recalculates WeatherSketch from WeatherForecast."""
+
+        with _db_connect(config.db_name) as cur:
+            for statement in sketches.get_sql_for_rebuild():
+                cur.execute(statement)
+
+            DataVersion.bump(cur)
 
     @staticmethod
     def _drop_table(table_name: str) -> None:
-        with _db_connect(weather_db) as cur:
+        with _db_connect(config.db_name) as cur:
             cur.execute(f"DROP TABLE {table_name}")
 
+            cur.execute("SELECT name FROM sqlite_master WHERE type = 'table';")
+            existing_tables = {name for name, in cur.fetchall()}
+
+            # Triggers are not fired by DROP TABLE, so the tables
+            # maintained by them are cleared or bumped here.
+            for dropped_table, table, statement in WeatherDb._sql_for_dropped:
+                if dropped_table in (None, table_name) and (
+                        table in existing_tables
+                ):
+                    cur.execute(statement)
+
+        # Indexes are dropped along with the table,
+        # so the migrations have to be applied again.
+        reset_schema_version(resolve_db_name(config.db_name))
+
     @classmethod
     def drop_city_table(cls) -> None:
         cls._drop_table('City')
+        city_registry.invalidate()
 
     @classmethod
     def drop_weather_forecast_table(cls) -> None:
@@ -84,31 +236,96 @@ class WeatherDb:
         cls.drop_weather_forecast_table()
 
 
+class DataVersion:
+    """Counter, that is incremented by every change of the data.
+    It is used to invalidate caches built from the data.
+
+    """
+
+    _sql_for_bump = 'UPDATE DataVersion SET version = version + 1;'
+
+    @staticmethod
+    def get_version() -> int:
+        with _db_connect(config.db_name, read_only=True) as cur:
+            cur.execute('SELECT version FROM DataVersion;')
+            version = cur.fetchone()
+
+        return version[0] if version else 0
+
+    @staticmethod
+    def get_city_versions() -> Dict[int, int]:
+        """Returns {city_id: data version of the last change
+        of the city forecasts}.
+
+        """
+
+        with _db_connect(config.db_name, read_only=True) as cur:
+            cur.execute('SELECT city_id, version FROM CityDataVersion;')
+            city_versions = dict(cur.fetchall())
+
+        return city_versions
+
+    @staticmethod
+    def get_city_table_version() -> int:
+        """Returns the counter of the City table changes."""
+
+        with _db_connect(config.db_name, read_only=True) as cur:
+            cur.execute('SELECT version FROM CityTableVersion;')
+            version = cur.fetchone()
+
+        return version[0] if version else 0
+
+    @classmethod
+    def bump(cls, cur: TimedCursor = None) -> None:
+        """Increments the version. If the cursor is passed,
+        the version is changed in its transaction.
+
+        """
+
+        if cur is not None:
+            cur.execute(cls._sql_for_bump)
+            return
+
+        with _db_connect(config.db_name) as cur:
+            cur.execute(cls._sql_for_bump)
+
+
 class City:
     """Class that contains methods for main operations with City table."""
 
     _sql_for_insert = (
         '''INSERT INTO City("name", latitude, longitude) VALUES (
             ?, ?, ?
-          );
+          )
+          ON CONFLICT("name") DO UPDATE SET
+            latitude = excluded.latitude, longitude = excluded.longitude
+          WHERE latitude IS NOT excluded.latitude
+            OR longitude IS NOT excluded.longitude;
           '''
     )
+    _sql_for_select_id_by_name = 'SELECT city_id FROM City WHERE name=?;'
 
     @classmethod
     def insert_city(cls, name: str, coordinates: tuple) -> None:
         lat, lon = coordinates
 
-        with _db_connect(weather_db) as cur:
+        with _db_connect(config.db_name) as cur:
             cur.execute(cls._sql_for_insert, (name, lat, lon))
+            DataVersion.bump(cur)
+
+        city_registry.invalidate(name)
 
     @classmethod
     def insert_cities(cls, cities_data: List[tuple]) -> None:
-        with _db_connect(weather_db) as cur:
+        with _db_connect(config.db_name) as cur:
             cur.executemany(cls._sql_for_insert, cities_data)
+            DataVersion.bump(cur)
+
+        city_registry.invalidate()
 
     @staticmethod
     def get_all_cities() -> List[tuple]:
-        with _db_connect(weather_db) as cur:
+        with _db_connect(config.db_name, read_only=True) as cur:
             cur.execute(
                 'SELECT city_id, "name", latitude, longitude FROM City;'
             )
@@ -118,19 +335,26 @@ class City:
 
     @staticmethod
     def get_city_id_by_name(name: str) -> Union[int, None]:
-        with _db_connect(weather_db) as cur:
-            cur.execute(
-                'SELECT city_id FROM City WHERE name=?;', (name,)
-            )
+        with _db_connect(config.db_name, read_only=True) as cur:
+            cur.execute(City._sql_for_select_id_by_name, (name,))
             city_id = cur.fetchone()
 
         return city_id[0] if city_id else None
 
+    @staticmethod
+    def get_cached_city_id_by_name(name: str) -> Union[int, None]:
+        """Same as get_city_id_by_name, but answered from
+        the in-process city registry when possible.
+
+        """
+
+        return city_registry.get_city_id(name)
+
     @staticmethod
     def get_city_data_by_id(city_id: int) -> tuple:
-        with _db_connect(weather_db) as cur:
+        with _db_connect(config.db_name, read_only=True) as cur:
             cur.execute(
-                'SELECT city_id, "name", latitude, longitude FROM City'
+                'SELECT city_id, "name", latitude, longitude FROM City '
                 'WHERE city_id=?;', (city_id,)
             )
             city = cur.fetchone()
@@ -138,50 +362,348 @@ class City:
         return city
 
 
+city_registry = CityRegistry(City.get_city_id_by_name)
+
+registry.gauge(
+    'weather_db_city_registry_stats', 'Hits, misses and size of the cache.',
+    lambda: {
+        ('hits',): city_registry.hits, ('misses',): city_registry.misses,
+        ('size',): len(city_registry)
+    },
+    ('stat',)
+)
+
+
+class CityRefresh:
+    """Class that contains methods for the refresh state of the cities,
+    which is kept by the refresh scheduler. Times are unix timestamps.
+
+    """
+
+    _sql_for_select_due = (
+        '''SELECT City.city_id, City."name", City.latitude, City.longitude,
+            CityRefresh.failures
+            FROM CityRefresh
+            -- CROSS JOIN keeps CityRefresh the outer loop,
+            -- so the cities are read in the order of the due_at index.
+            CROSS JOIN City ON City.city_id = CityRefresh.city_id
+            WHERE CityRefresh.due_at <= ? AND CityRefresh.claimed_until <= ?
+            AND City.latitude IS NOT NULL AND City.longitude IS NOT NULL
+            ORDER BY CityRefresh.due_at
+            LIMIT ?'''
+    )
+
+    @classmethod
+    def claim_due_cities(
+            cls, now: float, limit: int, lease_seconds: float
+    ) -> List[tuple]:
+        """Returns up to limit (city_id, name, lat, lon, failures)
+        of the due cities, the most overdue first. The cities are claimed
+        for lease_seconds, so other schedulers do not refresh them twice.
+        Claimed cities are due at the end of the claim, so a refresh
+        forced during the claim (see set_due) is seen by the release.
+
+        """
+
+        with _db_connect(config.db_name) as cur:
+            # The write lock is taken before the select,
+            # so two schedulers can not claim the same city.
+            cur.execute('BEGIN IMMEDIATE;')
+            cur.execute(cls._sql_for_select_due, (now, now, limit))
+            cities = cur.fetchall()
+
+            cur.executemany(
+                '''UPDATE CityRefresh SET claimed_until = ?1, due_at = ?1
+                WHERE city_id = ?2;''',
+                [(now + lease_seconds, city[0]) for city in cities]
+            )
+
+        return cities
+
+    @staticmethod
+    def set_refreshed(refreshed: List[tuple]) -> None:
+        """Releases the claims of the fetched cities.
+        Takes (last_fetched, due_at, city_id) rows,
+        refreshes forced during the claim are kept.
+
+        """
+
+        with _db_connect(config.db_name) as cur:
+            cur.executemany(
+                '''UPDATE CityRefresh SET last_fetched = ?1,
+                    due_at = CASE WHEN due_at < claimed_until
+                        THEN MIN(due_at, ?2) ELSE ?2 END,
+                    claimed_until = 0, failures = 0
+                WHERE city_id = ?3;''',
+                refreshed
+            )
+
+    @staticmethod
+    def set_failed(failed: List[tuple]) -> None:
+        """Releases the claims of the cities, which were not fetched.
+        Takes (due_at, city_id) rows, refreshes forced during the claim
+        are kept.
+
+        """
+
+        with _db_connect(config.db_name) as cur:
+            cur.executemany(
+                '''UPDATE CityRefresh SET
+                    due_at = CASE WHEN due_at < claimed_until
+                        THEN MIN(due_at, ?1) ELSE ?1 END,
+                    claimed_until = 0, failures = failures + 1
+                WHERE city_id = ?2;''',
+                failed
+            )
+
+    @staticmethod
+    def set_due(city_id: int, due_at: float) -> None:
+        """Moves the refresh of the city to due_at, unless it is due
+        earlier already. For a claimed city the refresh is done again
+        after the running one.
+
+        """
+
+        with _db_connect(config.db_name) as cur:
+            cur.execute(
+                '''UPDATE CityRefresh SET due_at = MIN(due_at, ?)
+                WHERE city_id = ?;''',
+                (due_at, city_id)
+            )
+
+    @staticmethod
+    def get_due_summary(now: float) -> Tuple[int, Union[float, None]]:
+        """Returns the number of the due cities, which are not claimed,
+        and the due time of the most overdue one.
+
+        """
+
+        with _db_connect(config.db_name, read_only=True) as cur:
+            cur.execute(
+                '''SELECT COUNT(*), MIN(due_at) FROM CityRefresh
+                WHERE due_at <= ? AND claimed_until <= ?;''',
+                (now, now)
+            )
+            count, due_at = cur.fetchone()
+
+        return count, due_at
+
+    @staticmethod
+    def has_due_cities(now: float) -> bool:
+        with _db_connect(config.db_name, read_only=True) as cur:
+            cur.execute(
+                'SELECT 1 FROM CityRefresh WHERE due_at <= ? LIMIT 1;', (now,)
+            )
+            city = cur.fetchone()
+
+        return city is not None
+
+
 class WeatherForecast:
     """Class that contains methods for main operations
      with WeatherForecast table.
 
      """
 
-    _sql_for_insert = (
-        '''INSERT INTO WeatherForecast(
+    _sql_for_create_staging = (
+        '''CREATE TEMP TABLE IF NOT EXISTS WeatherForecastStaging
+            (
+                city_id INTEGER, "date" TEXT, temp FLOAT, pcp FLOAT,
+                clouds INT, pressure INT, humidity TINYINT, wind_speed FLOAT
+            );'''
+    )
+    _sql_for_insert_staging = (
+        '''INSERT INTO temp.WeatherForecastStaging(
             city_id, "date", temp, pcp, clouds, pressure, humidity, wind_speed
         ) VALUES (
             ?, ?, ?, ?, ?, ?, ?, ?
         );'''
     )
+    # Of the staged rows of the same city and date the last one is kept.
+    _sql_for_dedupe_staging = (
+        '''DELETE FROM temp.WeatherForecastStaging WHERE rowid NOT IN (
+            SELECT MAX(rowid) FROM temp.WeatherForecastStaging
+            GROUP BY city_id, "date"
+        );'''
+    )
+    _sql_for_count_existing = (
+        '''SELECT COUNT(*) FROM temp.WeatherForecastStaging AS staging
+            JOIN WeatherForecast AS forecast
+            ON forecast.city_id = staging.city_id
+            AND forecast."date" = staging."date";'''
+    )
+    # "WHERE true" is needed by sqlite to parse ON CONFLICT after SELECT.
+    _sql_for_upsert = (
+        '''INSERT INTO WeatherForecast(
+            city_id, "date", temp, pcp, clouds, pressure, humidity, wind_speed
+        )
+        SELECT city_id, "date", temp, pcp, clouds,
+            pressure, humidity, wind_speed
+        FROM temp.WeatherForecastStaging WHERE true
+        ON CONFLICT(city_id, "date") DO UPDATE SET
+            temp = excluded.temp, pcp = excluded.pcp,
+            clouds = excluded.clouds, pressure = excluded.pressure,
+            humidity = excluded.humidity, wind_speed = excluded.wind_speed
+        {condition};'''
+    )
+    _sql_for_changed_condition = (
+        '''WHERE temp IS NOT excluded.temp OR pcp IS NOT excluded.pcp
+            OR clouds IS NOT excluded.clouds
+            OR pressure IS NOT excluded.pressure
+            OR humidity IS NOT excluded.humidity
+            OR wind_speed IS NOT excluded.wind_speed'''
+    )
     _available_columns = (
             'temp', 'pcp', 'clouds', 'pressure', 'humidity', 'wind_speed'
         )
+    _max_bound_names = 500
+    _sql_for_select_statistics = (
+        '''SELECT "count", "sum", sum_of_squares, "min", "max"
+            FROM WeatherAggregate WHERE city_id = ? AND column_name = ?'''
+    )
+    _sql_for_select_sketch = (
+        '''SELECT bucket, "count" FROM WeatherSketch
+            WHERE city_id = ? AND column_name = ?
+            ORDER BY bucket'''
+    )
+    _sql_for_select_in_range = (
+        '''SELECT forecast_id, "date", temp, pcp, clouds,
+            pressure, humidity, wind_speed
+            FROM WeatherForecast
+            WHERE city_id = ? AND "date" BETWEEN ? AND ?'''
+    )
+    # Date is unique for a city, so ordering by it is the same as
+    # ordering by ("date", forecast_id) and is served by the index.
+    _sql_for_select_page_in_range = (
+        '''SELECT forecast_id, "date", temp, pcp, clouds,
+            pressure, humidity, wind_speed
+            FROM WeatherForecast
+            WHERE city_id = ? AND "date" BETWEEN ? AND ?
+            AND ("date", forecast_id) > (?, ?)
+            ORDER BY "date"
+            LIMIT ?'''
+    )
+    _sql_for_select_column = (
+        '''SELECT {column}
+            FROM WeatherForecast WHERE city_id=?
+            ORDER BY "date"'''
+    )
+    # NULL values are counted as 0, the same way the API always did.
+    _sql_for_select_moving_aggregates = (
+        '''SELECT "date", moving_avg, moving_min, moving_max, moving_sum
+            FROM (
+                SELECT "date",
+                    AVG(value) OVER moving_window AS moving_avg,
+                    MIN(value) OVER moving_window AS moving_min,
+                    MAX(value) OVER moving_window AS moving_max,
+                    SUM(value) OVER moving_window AS moving_sum,
+                    ROW_NUMBER() OVER (ORDER BY "date") AS row_number
+                FROM (
+                    SELECT "date", COALESCE({column}, 0) AS value
+                    FROM WeatherForecast
+                    WHERE city_id = ? AND "date" <= ?
+                )
+                WINDOW moving_window AS (
+                    ORDER BY "date" ROWS BETWEEN ? PRECEDING AND CURRENT ROW
+                )
+            )
+            WHERE row_number >= ? AND "date" >= ?
+            ORDER BY "date"'''
+    )
+    _sql_for_count_records = (
+        '''SELECT COUNT(*) FROM WeatherForecast
+            WHERE city_id = ? AND "date" <= ?'''
+    )
+    _sql_for_select_city_columns = (
+        '''SELECT "date", temp, pcp, clouds, pressure, humidity, wind_speed
+            FROM WeatherForecast WHERE city_id=?
+            ORDER BY "date"'''
+    )
+    _sql_for_select_dated_column = (
+        '''SELECT "date", {column}
+            FROM WeatherForecast WHERE city_id=?
+            ORDER BY "date"'''
+    )
+    # Every city's latest forecast is found by the unique index.
+    _sql_for_select_latest = (
+        '''SELECT city_id, "date", temp, pcp, clouds,
+            pressure, humidity, wind_speed
+            FROM WeatherForecast
+            WHERE forecast_id IN (
+                SELECT (
+                    SELECT forecast_id FROM WeatherForecast AS latest
+                    WHERE latest.city_id = City.city_id
+                    ORDER BY latest."date" DESC LIMIT 1
+                )
+                FROM City WHERE City.city_id IN ({placeholders})
+            )'''
+    )
+    _sql_for_select_rollups = (
+        '''SELECT bucket, "count", "sum", "min", "max"
+            FROM WeatherRollup
+            WHERE city_id = ? AND column_name = ? AND period = ?
+            AND bucket BETWEEN ? AND ?
+            ORDER BY bucket'''
+    )
 
     @classmethod
     def insert_weather_forecast(
             cls,  city_name: str, date: str, temp: float, pcp: float,
             clouds: int, pressure: int, humidity: int, wind_speed: float
-    ) -> None:
-        city_id = City.get_city_id_by_name(city_name)
+    ) -> UpsertCounts:
+        city_id = City.get_cached_city_id_by_name(city_name)
 
-        with _db_connect(weather_db) as cur:
-            cur.execute(
-                cls._sql_for_insert,
-                (
-                    city_id, date, temp, pcp, clouds,
-                    pressure, humidity, wind_speed
-                )
-            )
+        return cls.insert_weather_forecasts([(
+            city_id, date, temp, pcp, clouds, pressure, humidity, wind_speed
+        )])
 
     @classmethod
     def insert_weather_forecasts(
-            cls, weather_forecasts_data: List[tuple]
-    ) -> None:
+            cls, weather_forecasts_data: List[tuple],
+            skip_unchanged: bool = True
+    ) -> UpsertCounts:
+        """Inserts forecasts or updates the existing ones
+        for the same city and date in one transaction.
+        If skip_unchanged is True, rows with the same values are not written.
+        Of the rows with the same (city_id, date) the last one is written.
+
+        """
+
+        condition = cls._sql_for_changed_condition if skip_unchanged else ''
+
+        with _db_connect(config.db_name) as cur:
+            cur.execute(cls._sql_for_create_staging)
+            cur.execute('DELETE FROM temp.WeatherForecastStaging;')
+            cur.executemany(
+                cls._sql_for_insert_staging, weather_forecasts_data
+            )
+
+            cur.execute(cls._sql_for_dedupe_staging)
+            staged = len(weather_forecasts_data) - cur.rowcount
 
-        with _db_connect(weather_db) as cur:
-            cur.executemany(cls._sql_for_insert, weather_forecasts_data)
+            cur.execute(cls._sql_for_count_existing)
+            existing = cur.fetchone()[0]
+
+            cur.execute(cls._sql_for_upsert.format(condition=condition))
+            written = cur.rowcount
+
+            if written:
+                # Only the buckets of the staged days are recalculated.
+                for statement in rollups.get_sql_for_refresh():
+                    cur.execute(statement)
+
+                DataVersion.bump(cur)
+
+            cur.execute('DELETE FROM temp.WeatherForecastStaging;')
+
+        inserted = staged - existing
+        updated = written - inserted
+
+        return UpsertCounts(inserted, updated, existing - updated)
 
     @staticmethod
     def select_all_weather_forecasts() -> List[tuple]:
-        with _db_connect(weather_db) as cur:
+        with _db_connect(config.db_name, read_only=True) as cur:
             cur.execute(
                 '''SELECT forecast_id, "date", temp, pcp, clouds, 
                     pressure, humidity, wind_speed, city_id
@@ -198,7 +720,19 @@ class WeatherForecast:
             cls, city_name: str, column_name: str
     ) -> float:
 
-        city_id = City.get_city_id_by_name(city_name)
+        return cls.select_column_statistics(city_name, column_name)['mean']
+
+    @classmethod
+    def select_column_statistics(
+            cls, city_name: str, column_name: str
+    ) -> dict:
+        """Returns count, mean, population standard deviation, min and max
+        of the column from the WeatherAggregate table.
+        NULL values are not counted, like in AVG.
+
+        """
+
+        city_id = City.get_cached_city_id_by_name(city_name)
 
         if column_name not in cls._available_columns:
             raise ValueError(
@@ -206,40 +740,200 @@ class WeatherForecast:
                 f'Available parameters: {cls._available_columns}'
             )
 
-        with _db_connect(weather_db) as cur:
-            cur.execute(
-                f'''SELECT AVG({column_name}) 
-                    FROM WeatherForecast WHERE city_id = ?''',
-                (city_id,)
+        with _db_connect(config.db_name, read_only=True) as cur:
+            cur.execute(cls._sql_for_select_statistics, (city_id, column_name))
+            aggregate = cur.fetchone()
+
+        if not aggregate or not aggregate[0]:
+            return {
+                'count': 0, 'mean': None, 'std_dev': None,
+                'min': None, 'max': None
+            }
+
+        count, total, sum_of_squares, min_value, max_value = aggregate
+
+        mean_value = total / count
+        variance = max(sum_of_squares / count - mean_value ** 2, 0.0)
+
+        return {
+            'count': count, 'mean': mean_value, 'std_dev': math.sqrt(variance),
+            'min': min_value, 'max': max_value
+        }
+
+    @classmethod
+    def select_distribution_of_column(
+            cls, city_name: str, column_name: str,
+            percentiles: List[float], bins: int = 10
+    ) -> dict:
+        """Returns count, min, max, the percentiles and the histogram
+        of bins of the same width between min and max of the column
+        from the WeatherSketch table (see weather_db.sketches
+        for the error bounds). NULL values are not counted.
+
+        """
+
+        city_id = City.get_cached_city_id_by_name(city_name)
+
+        if column_name not in sketches.SKETCHED_COLUMNS:
+            raise ValueError(
+                'Pass the correct column. '
+                f'Available parameters: {sketches.SKETCHED_COLUMNS}'
             )
-            avg_value = cur.fetchone()[0]
 
-        return avg_value
+        with _db_connect(config.db_name, read_only=True) as cur:
+            cur.execute(cls._sql_for_select_statistics, (city_id, column_name))
+            aggregate = cur.fetchone()
 
-    @staticmethod
+            cur.execute(cls._sql_for_select_sketch, (city_id, column_name))
+            buckets = cur.fetchall()
+
+        if not aggregate or not aggregate[0]:
+            return {
+                'count': 0, 'min': None, 'max': None,
+                'percentiles': dict.fromkeys(percentiles), 'histogram': []
+            }
+
+        count, _, _, min_value, max_value = aggregate
+
+        # Extremes are exact, so the values of the outer buckets
+        # are limited by them.
+        values = sketches.get_percentiles(buckets, percentiles)
+        values = {
+            percentile: min(max(value, min_value), max_value)
+            for percentile, value in values.items()
+        }
+
+        return {
+            'count': count, 'min': min_value, 'max': max_value,
+            'percentiles': values,
+            'histogram': sketches.get_histogram(
+                buckets, bins, min_value, max_value
+            )
+        }
+
+    @classmethod
+    def select_mean_values_of_columns(
+            cls, city_names: List[str] = None, column_names: List[str] = None
+    ) -> Dict[str, Dict[str, Union[float, None]]]:
+        """Returns {city: {column: mean}} for many cities and columns
+        with a single query per _max_bound_names cities.
+        None means all cities or all columns.
+
+        """
+
+        column_names = column_names or list(cls._available_columns)
+
+        wrong_columns = set(column_names) - set(cls._available_columns)
+        if wrong_columns:
+            raise ValueError(
+                f'Pass the correct columns, {sorted(wrong_columns)} are wrong.'
+                f' Available parameters: {cls._available_columns}'
+            )
+
+        column_placeholders = ', '.join('?' * len(column_names))
+
+        if city_names is None:
+            # Cities without the aggregates are joined with NULL columns.
+            means = {}
+
+            with _db_connect(config.db_name, read_only=True) as cur:
+                cur.execute(
+                    f'''SELECT City."name", aggregate.column_name,
+                        aggregate."sum" / aggregate."count"
+                        FROM City LEFT JOIN WeatherAggregate AS aggregate
+                        ON aggregate.city_id = City.city_id
+                        AND aggregate.column_name IN ({column_placeholders})
+                        AND aggregate."count" > 0
+                        ORDER BY City.city_id''',
+                    column_names
+                )
+
+                for city_name, column_name, mean_value in cur.fetchall():
+                    city_means = means.setdefault(
+                        city_name, dict.fromkeys(column_names)
+                    )
+
+                    if column_name is not None:
+                        city_means[column_name] = mean_value
+
+            return means
+
+        means = {name: dict.fromkeys(column_names) for name in city_names}
+        names = list(means)
+
+        with _db_connect(config.db_name, read_only=True) as cur:
+            # Names are bound in chunks, which stay below
+            # the SQLITE_MAX_VARIABLE_NUMBER of old SQLite versions.
+            for start in range(0, len(names), cls._max_bound_names):
+                chunk = names[start:start + cls._max_bound_names]
+                city_placeholders = ', '.join('?' * len(chunk))
+
+                cur.execute(
+                    f'''SELECT City."name", aggregate.column_name,
+                        aggregate."sum" / aggregate."count"
+                        FROM City JOIN WeatherAggregate AS aggregate
+                        ON aggregate.city_id = City.city_id
+                        WHERE City."name" IN ({city_placeholders})
+                        AND aggregate.column_name IN ({column_placeholders})
+                        AND aggregate."count" > 0''',
+                    (*chunk, *column_names)
+                )
+
+                for city_name, column_name, mean_value in cur.fetchall():
+                    means[city_name][column_name] = mean_value
+
+        return means
+
+    @classmethod
     def select_records_in_given_range(
-            city: str, start_dt: str, end_dt: str
+            cls, city: str, start_dt: str, end_dt: str
     ) -> List[tuple]:
-        city_id = City.get_city_id_by_name(city)
+        city_id = City.get_cached_city_id_by_name(city)
 
-        with _db_connect(weather_db) as cur:
+        with _db_connect(config.db_name, read_only=True) as cur:
             cur.execute(
-                '''SELECT forecast_id, "date", temp, pcp, clouds, 
-                    pressure, humidity, wind_speed
-                    FROM WeatherForecast 
-                    WHERE city_id = ? AND "date" BETWEEN ? AND ?''',
-                (city_id, start_dt, end_dt)
+                cls._sql_for_select_in_range, (city_id, start_dt, end_dt)
             )
             forecasts = cur.fetchall()
 
         return forecasts
 
+    @classmethod
+    def iter_records_in_given_range(
+            cls, city: str, start_dt: str, end_dt: str,
+            after: tuple = None, limit: int = None, batch_size: int = 500
+    ) -> Iterator[tuple]:
+        """Lazily yields records sorted by date.
+        after is the (date, forecast_id) of the last already seen record,
+        only records after it are returned (keyset pagination).
+
+        """
+
+        city_id = City.get_cached_city_id_by_name(city)
+        after_date, after_id = after or ('', 0)
+
+        with _db_connect(config.db_name, read_only=True) as cur:
+            cur.execute(
+                cls._sql_for_select_page_in_range,
+                (
+                    city_id, start_dt, end_dt, after_date, after_id,
+                    -1 if limit is None else limit
+                )
+            )
+
+            while True:
+                forecasts = cur.fetchmany(batch_size)
+                if not forecasts:
+                    break
+
+                yield from forecasts
+
     @classmethod
     def select_records_of_given_column(
             cls, city: str, column_name: str
     ) -> List[tuple]:
 
-        city_id = City.get_city_id_by_name(city)
+        city_id = City.get_cached_city_id_by_name(city)
 
         if column_name not in cls._available_columns:
             raise ValueError(
@@ -247,12 +941,165 @@ class WeatherForecast:
                 f'Available parameters: {cls._available_columns}'
             )
 
-        with _db_connect(weather_db) as cur:
+        with _db_connect(config.db_name, read_only=True) as cur:
             cur.execute(
-                f'''SELECT {column_name} 
-                FROM WeatherForecast WHERE city_id=?''',
+                cls._sql_for_select_column.format(column=column_name),
                 (city_id,)
             )
             columns_value = cur.fetchall()
 
         return columns_value
+
+    @classmethod
+    def select_dated_records_of_given_column(
+            cls, city: str, column_name: str
+    ) -> List[tuple]:
+        """Returns (date, value) pairs of the column sorted by date."""
+
+        city_id = City.get_cached_city_id_by_name(city)
+
+        if column_name not in cls._available_columns:
+            raise ValueError(
+                'Pass the correct column. '
+                f'Available parameters: {cls._available_columns}'
+            )
+
+        with _db_connect(config.db_name, read_only=True) as cur:
+            cur.execute(
+                cls._sql_for_select_dated_column.format(column=column_name),
+                (city_id,)
+            )
+            dated_values = cur.fetchall()
+
+        return dated_values
+
+    @classmethod
+    def select_latest_forecasts(cls, city_ids: List[int]) -> Dict[int, tuple]:
+        """Returns {city_id: (date, *available columns)}
+        of the latest date of every city, which has forecasts.
+
+        """
+
+        if not city_ids:
+            return {}
+
+        with _db_connect(config.db_name, read_only=True) as cur:
+            cur.execute(
+                cls._sql_for_select_latest.format(
+                    placeholders=', '.join('?' * len(city_ids))
+                ),
+                city_ids
+            )
+            forecasts = cur.fetchall()
+
+        return {city_id: forecast for city_id, *forecast in forecasts}
+
+    @classmethod
+    def select_rollups_of_column(
+            cls, city: str, column_name: str, period: str,
+            start_dt: str = None, end_dt: str = None
+    ) -> List[dict]:
+        """Returns count, mean, min and max of the column
+        (and sum for the summed columns) for every bucket of the period,
+        which starts between the start and end dates.
+
+        """
+
+        city_id = City.get_cached_city_id_by_name(city)
+
+        if column_name not in cls._available_columns:
+            raise ValueError(
+                'Pass the correct column. '
+                f'Available parameters: {cls._available_columns}'
+            )
+
+        if period not in rollups.PERIODS:
+            raise ValueError(
+                'Pass the correct period. '
+                f'Available periods: {tuple(rollups.PERIODS)}'
+            )
+
+        # Dates are ISO formatted strings, so they are compared as text.
+        start_dt = start_dt or ''
+        end_dt = end_dt or '9999-12-31'
+
+        with _db_connect(config.db_name, read_only=True) as cur:
+            cur.execute(
+                cls._sql_for_select_rollups,
+                (city_id, column_name, period, start_dt, end_dt)
+            )
+            buckets = cur.fetchall()
+
+        rollup = []
+        for bucket, count, total, min_value, max_value in buckets:
+            values = {
+                'bucket': bucket, 'count': count,
+                'mean': total / count if count else None,
+                'min': min_value, 'max': max_value
+            }
+
+            if column_name in rollups.SUMMED_COLUMNS:
+                values['sum'] = total
+
+            rollup.append(values)
+
+        return rollup
+
+    @classmethod
+    def select_columns_of_city(cls, city_id: int) -> List[tuple]:
+        """Returns (date, *available columns) rows sorted by date."""
+
+        with _db_connect(config.db_name, read_only=True) as cur:
+            cur.execute(cls._sql_for_select_city_columns, (city_id,))
+            forecasts = cur.fetchall()
+
+        return forecasts
+
+    @classmethod
+    def select_moving_aggregates_of_column(
+            cls, city: str, column_name: str, n: int,
+            start_dt: str = None, end_dt: str = None
+    ) -> List[tuple]:
+        """Calculates in the database moving average, min, max and sum
+        of the column over windows of n records.
+        Returns (date, avg, min, max, sum) rows sorted by date,
+        only full windows are returned. Start and end dates
+        restrict the returned rows, earlier records still fill the windows.
+
+        """
+
+        city_id = City.get_cached_city_id_by_name(city)
+
+        if column_name not in cls._available_columns:
+            raise ValueError(
+                'Pass the correct column. '
+                f'Available parameters: {cls._available_columns}'
+            )
+
+        if n < 1:
+            raise ValueError('N must be a positive number!')
+
+        # Dates are ISO formatted strings, so they are compared as text.
+        start_dt = start_dt or ''
+        end_dt = end_dt or '9999-12-31'
+
+        with _db_connect(config.db_name, read_only=True) as cur:
+            cur.execute(
+                cls._sql_for_select_moving_aggregates.format(
+                    column=column_name
+                ),
+                (city_id, end_dt, n - 1, n, start_dt)
+            )
+            moving_aggregates = cur.fetchall()
+
+            if not moving_aggregates:
+                cur.execute(cls._sql_for_count_records, (city_id, end_dt))
+                data_length = cur.fetchone()[0]
+
+                if n > data_length:
+                    raise ValueError(
+                        'N cannot be greater than the length'
+                        f' of the data! Maximum is {data_length}'
+                    )
+
+        return moving_aggregates
@@ -0,0 +1,291 @@
+"""This module contains versioned schema migrations of the Weather database.
+
+The current version is stored in PRAGMA user_version.
+Every migration is applied in its own transaction,
+so existing database files are upgraded in place.
+
+"""
+from typing import List, NamedTuple, Tuple
+
+from weather_db import aggregates, rollups, sketches
+from weather_db.connection_pool import get_pool
+
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    statements: Tuple[str, ...]
+
+
+MIGRATIONS: Tuple[Migration, ...] = (
+    Migration(
+        1, 'Initial City and WeatherForecast tables',
+        (
+            '''CREATE TABLE IF NOT EXISTS City
+            (
+                city_id INTEGER PRIMARY KEY,
+                "name" VARCHAR(255) NOT NULL,
+                latitude FLOAT,
+                longitude FLOAT
+            );
+            ''',
+            '''CREATE TABLE IF NOT EXISTS WeatherForecast
+            (
+                forecast_id INTEGER PRIMARY KEY,
+                date TEXT NOT NULL,
+                temp FLOAT NOT NULL,
+                pcp FLOAT,
+                clouds INT NOT NULL,
+                pressure INT NOT NULL,
+                humidity TINYINT NOT NULL,
+                wind_speed FLOAT NOT NULL,
+
+                city_id INTEGER NOT NULL,
+
+                CONSTRAINT fk_forecast_city FOREIGN KEY (city_id)
+                REFERENCES City(city_id)
+            );
+            ''',
+        )
+    ),
+    Migration(
+        2, 'Unique index on City name',
+        (
+            # Duplicated cities are merged into the one with the smallest id
+            # before the unique index can be created.
+            '''UPDATE WeatherForecast SET city_id = (
+                SELECT MIN(same_name.city_id)
+                FROM City AS current
+                JOIN City AS same_name ON same_name."name" = current."name"
+                WHERE current.city_id = WeatherForecast.city_id
+            )
+            WHERE city_id NOT IN (
+                SELECT MIN(city_id) FROM City GROUP BY "name"
+            ) AND city_id IN (SELECT city_id FROM City);
+            ''',
+            '''DELETE FROM City WHERE city_id NOT IN (
+                SELECT MIN(city_id) FROM City GROUP BY "name"
+            );
+            ''',
+            '''CREATE UNIQUE INDEX IF NOT EXISTS ux_city_name
+            ON City("name");
+            ''',
+        )
+    ),
+    Migration(
+        3, 'Covering index on WeatherForecast(city_id, date)',
+        (
+            '''CREATE INDEX IF NOT EXISTS ix_weather_forecast_city_date
+            ON WeatherForecast(
+                city_id, "date", temp, pcp, clouds,
+                pressure, humidity, wind_speed
+            );
+            ''',
+            'ANALYZE;',
+        )
+    ),
+    Migration(
+        4, 'Unique index on WeatherForecast(city_id, date)',
+        (
+            # Only the latest forecast for a day is kept.
+            '''DELETE FROM WeatherForecast WHERE forecast_id NOT IN (
+                SELECT MAX(forecast_id) FROM WeatherForecast
+                GROUP BY city_id, "date"
+            );
+            ''',
+            '''CREATE UNIQUE INDEX IF NOT EXISTS ux_weather_forecast_city_date
+            ON WeatherForecast(city_id, "date");
+            ''',
+        )
+    ),
+    Migration(
+        5, 'DataVersion counter of the data changes',
+        (
+            '''CREATE TABLE IF NOT EXISTS DataVersion
+            (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                version INTEGER NOT NULL
+            );
+            ''',
+            'INSERT OR IGNORE INTO DataVersion(id, version) VALUES (1, 0);',
+        )
+    ),
+    Migration(
+        6, 'WeatherAggregate table maintained by triggers',
+        (
+            aggregates.SQL_FOR_CREATE_TABLE,
+            *aggregates.get_sql_for_triggers(),
+            *aggregates.get_sql_for_rebuild(),
+        )
+    ),
+    Migration(
+        7, 'CityDataVersion of the last change of every city forecasts',
+        (
+            '''CREATE TABLE IF NOT EXISTS CityDataVersion
+            (
+                city_id INTEGER PRIMARY KEY,
+                version INTEGER NOT NULL
+            );
+            ''',
+            '''INSERT OR IGNORE INTO CityDataVersion(city_id, version)
+            SELECT DISTINCT city_id, (SELECT version FROM DataVersion)
+            FROM WeatherForecast;
+            ''',
+            # Changed cities get the data version,
+            # which will be set when the transaction bumps it.
+            *(
+                f'''CREATE TRIGGER IF NOT EXISTS
+                tr_city_data_version_{event.lower()}_{row}
+                AFTER {event} ON WeatherForecast
+                BEGIN
+                    INSERT INTO CityDataVersion(city_id, version) VALUES (
+                        {row}.city_id,
+                        (SELECT version FROM DataVersion) + 1
+                    )
+                    ON CONFLICT(city_id) DO UPDATE SET
+                        version = excluded.version;
+                END;
+                '''
+                for event, row in (
+                    ('INSERT', 'new'), ('UPDATE', 'old'),
+                    ('UPDATE', 'new'), ('DELETE', 'old')
+                )
+            ),
+        )
+    ),
+    Migration(
+        8, 'WeatherRollup of weeks, months and years',
+        (
+            rollups.SQL_FOR_CREATE_TABLE,
+            *rollups.get_sql_for_rebuild(),
+        )
+    ),
+    Migration(
+        9, 'CityTableVersion counter of the City table changes',
+        (
+            '''CREATE TABLE IF NOT EXISTS CityTableVersion
+            (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                version INTEGER NOT NULL
+            );
+            ''',
+            '''INSERT OR IGNORE INTO CityTableVersion(id, version)
+            VALUES (1, 0);
+            ''',
+            *(
+                f'''CREATE TRIGGER IF NOT EXISTS
+                tr_city_table_version_{event.lower()}
+                AFTER {event} ON City
+                BEGIN
+                    UPDATE CityTableVersion SET version = version + 1;
+                END;
+                '''
+                for event in ('INSERT', 'UPDATE', 'DELETE')
+            ),
+        )
+    ),
+    Migration(
+        10, 'CityRefresh state of the refresh scheduler',
+        (
+            # Times are unix timestamps, cities are due when due_at
+            # has passed and are claimed by a scheduler until claimed_until.
+            '''CREATE TABLE IF NOT EXISTS CityRefresh
+            (
+                city_id INTEGER PRIMARY KEY,
+                last_fetched FLOAT,
+                due_at FLOAT NOT NULL DEFAULT 0,
+                claimed_until FLOAT NOT NULL DEFAULT 0,
+                failures INTEGER NOT NULL DEFAULT 0
+            );
+            ''',
+            '''CREATE INDEX IF NOT EXISTS ix_city_refresh_due_at
+            ON CityRefresh(due_at);
+            ''',
+            '''INSERT OR IGNORE INTO CityRefresh(city_id)
+            SELECT city_id FROM City;
+            ''',
+            '''CREATE TRIGGER IF NOT EXISTS tr_city_refresh_insert
+            AFTER INSERT ON City
+            BEGIN
+                INSERT OR IGNORE INTO CityRefresh(city_id)
+                VALUES (new.city_id);
+            END;
+            ''',
+            '''CREATE TRIGGER IF NOT EXISTS tr_city_refresh_delete
+            AFTER DELETE ON City
+            BEGIN
+                DELETE FROM CityRefresh WHERE city_id = old.city_id;
+            END;
+            ''',
+        )
+    ),
+    Migration(
+        11, 'WeatherSketch quantile sketches maintained by triggers',
+        (
+            *sketches.SQL_FOR_CREATE_TABLES,
+            sketches.get_sql_for_fill_buckets(),
+            *sketches.get_sql_for_triggers(),
+            *sketches.get_sql_for_rebuild(),
+        )
+    ),
+    Migration(
+        12, 'Drop the covering index on WeatherForecast(city_id, date)',
+        (
+            # The unique index on the same columns is needed by the upsert,
+            # so the covering one only doubled the cost of every write.
+            'DROP INDEX IF EXISTS ix_weather_forecast_city_date;',
+        )
+    ),
+)
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+def get_schema_version(db_name: str) -> int:
+    with get_pool(db_name).connection(read_only=True) as conn:
+        return conn.execute('PRAGMA user_version;').fetchone()[0]
+
+
+def reset_schema_version(db_name: str) -> None:
+    """Marks the schema as not migrated,
+    for example after one of the tables was dropped.
+
+    """
+
+    with get_pool(db_name).connection() as conn:
+        conn.execute('PRAGMA user_version = 0;')
+
+
+def _apply_migration(db_name: str, migration: Migration) -> bool:
+    with get_pool(db_name).connection() as conn:
+        conn.execute('BEGIN IMMEDIATE;')
+
+        # Another process could have applied the migration
+        # while we were waiting for the write lock.
+        version = conn.execute('PRAGMA user_version;').fetchone()[0]
+        if version >= migration.version:
+            return False
+
+        for statement in migration.statements:
+            conn.execute(statement)
+
+        conn.execute(f'PRAGMA user_version = {migration.version};')
+
+    return True
+
+
+def migrate(db_name: str, target_version: int = LATEST_VERSION) -> List[int]:
+    """Upgrades the database to the target version.
+    Returns versions of the applied migrations.
+
+    """
+
+    current_version = get_schema_version(db_name)
+
+    applied = []
+    for migration in MIGRATIONS:
+        if current_version < migration.version <= target_version:
+            if _apply_migration(db_name, migration):
+                applied.append(migration.version)
+
+    return applied
@@ -0,0 +1,148 @@
+"""This module contains timing of the sql statements and the slow query log.
+
+Every statement is timed together with fetching of its rows.
+Statements slower than the threshold are logged to the
+weather_db.slow_queries logger with their EXPLAIN QUERY PLAN.
+
+"""
+import logging
+import re
+import sqlite3
+import time
+from functools import lru_cache
+from typing import Iterable, List, Union
+
+import config
+from support_functions.metrics import registry
+
+logger = logging.getLogger('weather_db.slow_queries')
+
+statement_seconds = registry.histogram(
+    'weather_db_statement_seconds',
+    'Time of the sql statements including fetching of the rows.',
+    ('statement',)
+)
+slow_statements = registry.counter(
+    'weather_db_slow_statements_total',
+    'Number of the statements slower than the slow query threshold.',
+    ('statement',)
+)
+
+_explained_statements = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE')
+
+
+def configure_slow_query_log(
+        threshold: Union[float, None], explain: bool = True
+) -> None:
+    """Sets the time in seconds after which statements are logged,
+    None disables the log. Query plans are logged if explain is True.
+
+    """
+
+    config.slow_query_seconds = threshold
+    config.slow_query_explain = explain
+
+
+@lru_cache(maxsize=1024)
+def get_statement_label(sql: str) -> str:
+    """Returns the sql in one line. Lists of placeholders
+    are collapsed, so IN (?, ?, ?) has the same label for any length.
+
+    """
+
+    label = ' '.join(sql.split())
+
+    return re.sub(r'\?(?:\s*,\s*\?)+', '?, ...', label)
+
+
+class TimedCursor:
+    """Proxy of sqlite3.Cursor, which times every statement.
+    The statement is finished by the next execute or by close.
+
+    """
+
+    def __init__(self, cursor: sqlite3.Cursor):
+        self._cursor = cursor
+
+        self._sql = None
+        self._params = None
+        self._elapsed = 0.0
+
+    def _timed(self, method, *args):
+        started = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            self._elapsed += time.perf_counter() - started
+
+    def _get_query_plan(self) -> List[str]:
+        statement_type = self._sql.split(None, 1)[0].upper()
+        if self._params is None or statement_type not in _explained_statements:
+            return []
+
+        try:
+            plan = self._cursor.connection.execute(
+                f'EXPLAIN QUERY PLAN {self._sql}', self._params
+            ).fetchall()
+        except sqlite3.Error as error:
+            return [f'Query plan is not available: {error}']
+
+        return [row[-1] for row in plan]
+
+    def _finish(self) -> None:
+        if self._sql is None:
+            return
+
+        label = get_statement_label(self._sql)
+        statement_seconds.observe(self._elapsed, label)
+
+        threshold = config.slow_query_seconds
+        if threshold is not None and self._elapsed >= threshold:
+            slow_statements.inc(label)
+
+            query_plan = (
+                self._get_query_plan() if config.slow_query_explain else []
+            )
+            logger.warning(
+                'Slow statement (%.3f s): %s | params: %r | query plan: %s',
+                self._elapsed, label, self._params, query_plan
+            )
+
+        self._sql = self._params = None
+        self._elapsed = 0.0
+
+    def execute(self, sql: str, params: Iterable = ()) -> 'TimedCursor':
+        self._finish()
+        self._sql, self._params = sql, params
+        self._timed(self._cursor.execute, sql, params)
+
+        return self
+
+    def executemany(
+            self, sql: str, seq_of_params: Iterable[Iterable]
+    ) -> 'TimedCursor':
+        self._finish()
+        # The parameters are not kept, they can be a generator.
+        self._sql, self._params = sql, None
+        self._timed(self._cursor.executemany, sql, seq_of_params)
+
+        return self
+
+    def fetchone(self) -> Union[tuple, None]:
+        return self._timed(self._cursor.fetchone)
+
+    def fetchmany(self, size: int = None) -> List[tuple]:
+        if size is None:
+            return self._timed(self._cursor.fetchmany)
+
+        return self._timed(self._cursor.fetchmany, size)
+
+    def fetchall(self) -> List[tuple]:
+        return self._timed(self._cursor.fetchall)
+
+    def close(self) -> None:
+        self._finish()
+        self._cursor.close()
+
+    def __getattr__(self, name: str):
+        return getattr(self._cursor, name)
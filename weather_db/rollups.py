@@ -0,0 +1,140 @@
+"""This module contains sql of the WeatherRollup table.
+
+For every (city_id, column, period, bucket) the table holds count, sum,
+min and max of the column values of the days in the bucket.
+Buckets are named by their first day: weeks start on Monday,
+months and years on their first day. Buckets touched by a write
+are recalculated in the same transaction (see get_sql_for_refresh),
+weeks and months from the days and years from the months,
+so a long range is read from a few rows per bucket.
+Writers, which change WeatherForecast bypassing
+WeatherForecast.insert_weather_forecasts (deletes included),
+refresh the buckets of the changed rows themselves
+or call WeatherDb.rebuild_rollups.
+
+"""
+from typing import Tuple
+
+from weather_db.aggregates import AGGREGATED_COLUMNS
+
+# sql of (first day, last day) of the bucket of the day.
+PERIODS = {
+    'week': (
+        "date({day}, 'weekday 0', '-6 days')", "date({day}, 'weekday 0')"
+    ),
+    'month': (
+        "date({day}, 'start of month')",
+        "date({day}, 'start of month', '+1 month', '-1 day')"
+    ),
+    'year': (
+        "date({day}, 'start of year')",
+        "date({day}, 'start of year', '+1 year', '-1 day')"
+    ),
+}
+
+# Columns, for which the sum of the bucket makes sense.
+SUMMED_COLUMNS = ('pcp',)
+
+SQL_FOR_CREATE_TABLE = (
+    '''CREATE TABLE IF NOT EXISTS WeatherRollup
+    (
+        city_id INTEGER NOT NULL,
+        column_name VARCHAR(32) NOT NULL,
+        period VARCHAR(8) NOT NULL,
+        bucket TEXT NOT NULL,
+        "count" INTEGER NOT NULL,
+        "sum" FLOAT NOT NULL,
+        "min" FLOAT,
+        "max" FLOAT,
+
+        PRIMARY KEY (city_id, column_name, period, bucket)
+    ) WITHOUT ROWID;
+    '''
+)
+
+
+def _get_sql_for_days_rollup(column: str) -> str:
+    return f'''SELECT bucket.city_id, '{column}', bucket.period,
+            bucket.bucket, COUNT(forecast.{column}),
+            COALESCE(SUM(forecast.{column}), 0),
+            MIN(forecast.{column}), MAX(forecast.{column})
+        FROM temp.WeatherRollupBucket AS bucket
+        JOIN WeatherForecast AS forecast
+        ON forecast.city_id = bucket.city_id
+        AND forecast."date" BETWEEN bucket.bucket AND bucket.last_day
+        WHERE bucket.period != 'year'
+        GROUP BY bucket.city_id, bucket.period, bucket.bucket'''
+
+
+def get_sql_for_refresh(
+        source: str = 'temp.WeatherForecastStaging'
+) -> Tuple[str, ...]:
+    """Recalculates the buckets of the (city_id, "date") rows
+    of the source table.
+
+    """
+
+    buckets = '\nUNION\n'.join(
+        f'''SELECT city_id, '{period}', {first_day.format(day='"date"')},
+            {last_day.format(day='"date"')}
+        FROM {source}'''
+        for period, (first_day, last_day) in PERIODS.items()
+    )
+    days_rollups = '\nUNION ALL\n'.join(
+        _get_sql_for_days_rollup(column) for column in AGGREGATED_COLUMNS
+    )
+    # Listed columns let the year rollup search the primary key.
+    columns = ', '.join(f"'{column}'" for column in AGGREGATED_COLUMNS)
+
+    return (
+        '''CREATE TEMP TABLE IF NOT EXISTS WeatherRollupBucket
+        (
+            city_id INTEGER, period VARCHAR(8), bucket TEXT, last_day TEXT
+        );''',
+        'DELETE FROM temp.WeatherRollupBucket;',
+        f'''INSERT INTO temp.WeatherRollupBucket(
+            city_id, period, bucket, last_day
+        )
+        {buckets};
+        ''',
+        # Updated rows can not leave the bucket,
+        # so every touched bucket still has days.
+        f'''INSERT OR REPLACE INTO WeatherRollup(
+            city_id, column_name, period, bucket,
+            "count", "sum", "min", "max"
+        )
+        {days_rollups};
+        ''',
+        f'''INSERT OR REPLACE INTO WeatherRollup(
+            city_id, column_name, period, bucket,
+            "count", "sum", "min", "max"
+        )
+        SELECT bucket.city_id, rollup.column_name, 'year', bucket.bucket,
+            SUM(rollup."count"), SUM(rollup."sum"),
+            MIN(rollup."min"), MAX(rollup."max")
+        FROM temp.WeatherRollupBucket AS bucket
+        JOIN WeatherRollup AS rollup
+        ON rollup.city_id = bucket.city_id
+        AND rollup.column_name IN ({columns})
+        AND rollup.period = 'month'
+        AND rollup.bucket BETWEEN bucket.bucket AND bucket.last_day
+        WHERE bucket.period = 'year'
+        GROUP BY bucket.city_id, rollup.column_name, bucket.bucket;
+        ''',
+        'DELETE FROM temp.WeatherRollupBucket;',
+    )
+
+
+def get_sql_for_rebuild() -> Tuple[str, ...]:
+    """Recalculates the whole WeatherRollup table from WeatherForecast."""
+
+    return (
+        'DELETE FROM WeatherRollup;',
+        *get_sql_for_refresh('WeatherForecast'),
+    )
+
+
+if __name__ == '__main__':
+    from weather_db.db_manager import WeatherDb
+
+    WeatherDb.rebuild_rollups()
@@ -0,0 +1,241 @@
+"""This module contains sql and math of the WeatherSketch table.
+
+For every (city_id, column) of SKETCHED_COLUMNS the table holds counts
+of the column values in logarithmic buckets (the DDSketch quantile sketch):
+bucket i > 0 counts the values in (MIN_VALUE * GAMMA ** (i - 1),
+MIN_VALUE * GAMMA ** i], bucket -i the same negative values
+and bucket 0 the values in [-MIN_VALUE, MIN_VALUE].
+Unlike in t-digest or KLL, values can be removed from the buckets,
+so the table is maintained by triggers like WeatherAggregate,
+updated forecasts included. A sketch has at most 2 * MAX_BUCKET + 1 rows
+however long the history is, sketches of several cities are merged
+by adding the counts of the same buckets.
+
+Error bounds: the p-th percentile is the value of rank
+floor(p / 100 * (count - 1)) of the sorted values, which is returned
+within RELATIVE_ACCURACY (1 %) of its value, or within MIN_VALUE
+for the values in [-MIN_VALUE, MIN_VALUE]. Values beyond MAX_VALUE
+are counted in the last bucket. Histogram bins count exactly the values,
+except for the values within 1 % of the bin edges,
+which can be counted in the neighbouring bin.
+
+"""
+import bisect
+import math
+from typing import Dict, List, Tuple
+
+SKETCHED_COLUMNS = ('temp', 'wind_speed', 'pcp')
+
+RELATIVE_ACCURACY = 0.01
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+MIN_VALUE = 0.01
+MAX_VALUE = 10000.0
+MAX_BUCKET = math.ceil(math.log(MAX_VALUE / MIN_VALUE, GAMMA))
+
+SQL_FOR_CREATE_TABLES = (
+    '''CREATE TABLE IF NOT EXISTS WeatherSketch
+    (
+        city_id INTEGER NOT NULL,
+        column_name VARCHAR(32) NOT NULL,
+        bucket INTEGER NOT NULL,
+        "count" INTEGER NOT NULL,
+
+        PRIMARY KEY (city_id, column_name, bucket)
+    ) WITHOUT ROWID;
+    ''',
+    # SQLite may be built without the math functions,
+    # so buckets are searched by their upper bounds.
+    '''CREATE TABLE IF NOT EXISTS SketchBucket
+    (
+        upper FLOAT PRIMARY KEY,
+        bucket INTEGER NOT NULL
+    ) WITHOUT ROWID;
+    ''',
+)
+
+
+def _get_upper_bound(bucket: int) -> float:
+    return MIN_VALUE * GAMMA ** bucket
+
+
+def get_bucket_value(bucket: int) -> float:
+    """Returns the value, which is within RELATIVE_ACCURACY
+    of all the values of the bucket.
+
+    """
+
+    if bucket == 0:
+        return 0.0
+
+    return math.copysign(
+        2 * _get_upper_bound(abs(bucket)) / (GAMMA + 1), bucket
+    )
+
+
+def get_sql_for_fill_buckets() -> str:
+    bounds = ',\n'.join(
+        f'({_get_upper_bound(bucket)!r}, {bucket})'
+        for bucket in range(1, MAX_BUCKET + 1)
+    )
+
+    return f'''INSERT OR IGNORE INTO SketchBucket(upper, bucket) VALUES
+        {bounds};
+    '''
+
+
+def _get_sql_for_bucket(value: str) -> str:
+    return f'''CASE
+            WHEN ABS({value}) <= {MIN_VALUE!r} THEN 0
+            ELSE (CASE WHEN {value} > 0 THEN 1 ELSE -1 END) * COALESCE((
+                SELECT bucket FROM SketchBucket
+                WHERE upper >= ABS({value}) ORDER BY upper LIMIT 1
+            ), {MAX_BUCKET})
+        END'''
+
+
+def _get_sql_for_add(column: str) -> str:
+    """Adds the new value of the column to the sketch."""
+
+    return f'''INSERT INTO WeatherSketch(
+            city_id, column_name, bucket, "count"
+        )
+        SELECT new.city_id, '{column}', {_get_sql_for_bucket(f'new.{column}')},
+            1
+        WHERE new.{column} IS NOT NULL
+        ON CONFLICT(city_id, column_name, bucket) DO UPDATE SET
+            "count" = "count" + 1;
+    '''
+
+
+def _get_sql_for_remove(column: str) -> str:
+    """Removes the old value of the column from the sketch.
+    Empty buckets are kept, they are reused by the next values.
+
+    """
+
+    return f'''UPDATE WeatherSketch SET "count" = "count" - 1
+        WHERE city_id = old.city_id AND column_name = '{column}'
+        AND bucket = {_get_sql_for_bucket(f'old.{column}')};
+    '''
+
+
+def get_sql_for_triggers() -> Tuple[str, ...]:
+    add = ''.join(_get_sql_for_add(column) for column in SKETCHED_COLUMNS)
+    remove = ''.join(
+        _get_sql_for_remove(column) for column in SKETCHED_COLUMNS
+    )
+
+    return (
+        f'''CREATE TRIGGER IF NOT EXISTS tr_weather_sketch_insert
+        AFTER INSERT ON WeatherForecast
+        BEGIN
+            {add}
+        END;
+        ''',
+        # Upserts change a few columns of a row,
+        # so only sketches of the changed columns are updated.
+        *(
+            f'''CREATE TRIGGER IF NOT EXISTS tr_weather_sketch_update_{column}
+            AFTER UPDATE OF city_id, {column} ON WeatherForecast
+            WHEN old.city_id != new.city_id OR old.{column} IS NOT new.{column}
+            BEGIN
+                {_get_sql_for_remove(column)}
+                {_get_sql_for_add(column)}
+            END;
+            '''
+            for column in SKETCHED_COLUMNS
+        ),
+        f'''CREATE TRIGGER IF NOT EXISTS tr_weather_sketch_delete
+        AFTER DELETE ON WeatherForecast
+        BEGIN
+            {remove}
+        END;
+        ''',
+    )
+
+
+def get_sql_for_rebuild() -> Tuple[str, ...]:
+    """Recalculates the whole WeatherSketch table from WeatherForecast."""
+
+    selects = '\nUNION ALL\n'.join(
+        f'''SELECT city_id, '{column}', bucket, COUNT(*) FROM (
+            SELECT city_id, {_get_sql_for_bucket(column)} AS bucket
+            FROM WeatherForecast WHERE {column} IS NOT NULL
+        )
+        GROUP BY city_id, bucket'''
+        for column in SKETCHED_COLUMNS
+    )
+
+    return (
+        'DELETE FROM WeatherSketch;',
+        f'''INSERT INTO WeatherSketch(city_id, column_name, bucket, "count")
+        {selects};
+        ''',
+    )
+
+
+def get_percentiles(
+        buckets: List[Tuple[int, int]], percentiles: List[float]
+) -> Dict[float, float]:
+    """Returns {percentile: value} of the (bucket, count) pairs
+    sorted by the bucket.
+
+    """
+
+    buckets = [(bucket, count) for bucket, count in buckets if count > 0]
+
+    cumulative_counts = []
+    total = 0
+    for _, count in buckets:
+        total += count
+        cumulative_counts.append(total)
+
+    values = {}
+    for percentile in percentiles:
+        if not total:
+            values[percentile] = None
+            continue
+
+        rank = math.floor(percentile / 100 * (total - 1))
+        index = bisect.bisect_right(cumulative_counts, rank)
+        values[percentile] = get_bucket_value(buckets[index][0])
+
+    return values
+
+
+def get_histogram(
+        buckets: List[Tuple[int, int]], bins: int,
+        min_value: float, max_value: float
+) -> List[dict]:
+    """Returns counts of the values in the bins of the same width
+    between min_value and max_value, a single bin if they are equal.
+
+    """
+
+    if max_value == min_value:
+        bins = 1
+
+    width = (max_value - min_value) / bins
+    counts = [0] * bins
+
+    for bucket, count in buckets:
+        index = 0
+        if width > 0:
+            index = int((get_bucket_value(bucket) - min_value) // width)
+
+        counts[min(max(index, 0), bins - 1)] += count
+
+    return [
+        {
+            'from': min_value + index * width,
+            'to': min_value + (index + 1) * width,
+            'count': count
+        }
+        for index, count in enumerate(counts)
+    ]
+
+
+if __name__ == '__main__':
+    from weather_db.db_manager import WeatherDb
+
+    WeatherDb.rebuild_sketches()
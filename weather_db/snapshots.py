@@ -0,0 +1,302 @@
+"""This module contains blue/green snapshots of the database.
+
+In the snapshot mode (snapshot_mode in config.py) the data is kept
+in snapshot files next to db_name, the active one is named
+in the pointer file <db_name>.active. Ingestion copies the active
+snapshot into a staging file, writes to it and publishes it
+by atomically replacing the pointer, so readers never wait
+on the writer and see either the old or the new data.
+Snapshots are built one at a time, also by several processes:
+a build holds the write lock of <db_name>.lock until it is published.
+Until the first snapshot is published db_name itself is active.
+
+"""
+import contextvars
+import glob
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import ContextManager, Dict, Iterator, List, Tuple
+
+import config
+from weather_db.connection_pool import close_pool, get_pool
+
+# (db_name, snapshot) used by the current request or ingestion.
+_pinned = contextvars.ContextVar('pinned_snapshot', default=None)
+
+# {db_name: (pointer file stat, active snapshot)}
+_active: Dict[str, Tuple[tuple, str]] = {}
+# {snapshot: number of the contexts pinned to it}
+_pin_counts: Dict[str, int] = {}
+_active_lock = threading.Lock()
+
+# Tables of the state, which is written to the active snapshot
+# while a new one is built (the refresh scheduler claims),
+# they are copied into the new snapshot before it is published.
+CARRIED_TABLES = ('CityRefresh',)
+
+
+def get_pointer_path(db_name: str) -> str:
+    return f'{db_name}.active'
+
+
+def get_lock_path(db_name: str) -> str:
+    return f'{db_name}.lock'
+
+
+def _split_db_name(db_name: str) -> Tuple[str, str]:
+    root, ext = os.path.splitext(db_name)
+
+    return root, ext or '.db'
+
+
+def get_snapshots(db_name: str) -> List[str]:
+    """Returns the published snapshots from the oldest to the newest."""
+
+    root, ext = _split_db_name(db_name)
+
+    snapshots = []
+    for path in glob.glob(f'{glob.escape(root)}-*{ext}'):
+        number = path[len(root) + 1:-len(ext)]
+
+        if number.isdigit():
+            snapshots.append((int(number), path))
+
+    return [path for _, path in sorted(snapshots)]
+
+
+def _close_unused_pool(db_name: str, snapshot: str) -> None:
+    """Closes the pool of the snapshot, unless it is active
+    or still pinned. Must be called with _active_lock held.
+
+    """
+
+    active = _active.get(db_name)
+
+    # Until the first snapshot is seen db_name is active.
+    if active is None or active[1] == snapshot or _pin_counts.get(snapshot):
+        return
+
+    close_pool(snapshot)
+
+
+def get_active_snapshot(db_name: str) -> str:
+    """Returns path of the active snapshot. The pointer file is read
+    again only when it was replaced, pool of the replaced snapshot
+    is closed, if no context is pinned to it.
+
+    """
+
+    pointer_path = get_pointer_path(db_name)
+
+    try:
+        stat = os.stat(pointer_path)
+    except FileNotFoundError:
+        return db_name
+
+    stat_key = stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    with _active_lock:
+        active = _active.get(db_name)
+        if active is not None and active[0] == stat_key:
+            return active[1]
+
+        with open(pointer_path, encoding='utf-8') as file:
+            snapshot = os.path.join(
+                os.path.dirname(db_name), file.read().strip()
+            )
+
+        _active[db_name] = stat_key, snapshot
+
+        replaced = active[1] if active is not None else db_name
+        if replaced != snapshot:
+            _close_unused_pool(db_name, replaced)
+
+    return snapshot
+
+
+def resolve_db_name(db_name: str) -> str:
+    """Returns the file, which the queries to db_name should go to."""
+
+    pinned = _pinned.get()
+    if pinned is not None and pinned[0] == db_name:
+        return pinned[1]
+
+    if config.snapshot_mode:
+        return get_active_snapshot(db_name)
+
+    return db_name
+
+
+def pin_snapshot(
+        db_name: str, snapshot: str = None
+) -> contextvars.Token:
+    """Makes all the queries of the current context go to the snapshot,
+    active one by default, until unpin_snapshot is called with the token.
+
+    """
+
+    snapshot = snapshot or resolve_db_name(db_name)
+
+    with _active_lock:
+        _pin_counts[snapshot] = _pin_counts.get(snapshot, 0) + 1
+
+    return _pinned.set((db_name, snapshot))
+
+
+def unpin_snapshot(token: contextvars.Token) -> None:
+    """Pool of a replaced snapshot is closed by its last unpin."""
+
+    db_name, snapshot = _pinned.get()
+    _pinned.reset(token)
+
+    with _active_lock:
+        _pin_counts[snapshot] -= 1
+        if not _pin_counts[snapshot]:
+            del _pin_counts[snapshot]
+            _close_unused_pool(db_name, snapshot)
+
+
+def _remove_database(path: str) -> None:
+    """Files still opened by other processes (on Windows)
+    are left for the next time.
+
+    """
+
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError:
+        return
+
+    for filepath in (f'{path}-wal', f'{path}-shm'):
+        try:
+            os.remove(filepath)
+        except OSError:
+            pass
+
+
+def _carry_tables(active: str, staging: str) -> None:
+    if not os.path.exists(active):
+        return
+
+    with get_pool(active).connection(read_only=True) as source:
+        with get_pool(staging).connection() as target:
+            for table in CARRIED_TABLES:
+                try:
+                    cursor = source.execute(f'SELECT * FROM {table};')
+                except sqlite3.OperationalError:
+                    # The table is not created yet.
+                    continue
+
+                placeholders = ', '.join('?' * len(cursor.description))
+                target.executemany(
+                    f'INSERT OR REPLACE INTO {table} '
+                    f'VALUES ({placeholders});',
+                    cursor
+                )
+
+
+def publish_snapshot(db_name: str, snapshot: str, keep: int = 2) -> None:
+    """Makes the snapshot active and removes the old ones,
+    the last keep snapshots are left for the requests still reading them.
+
+    """
+
+    pointer_path = get_pointer_path(db_name)
+    temp_path = f'{pointer_path}.tmp'
+
+    with open(temp_path, 'w', encoding='utf-8') as file:
+        file.write(os.path.basename(snapshot))
+        file.flush()
+        os.fsync(file.fileno())
+
+    os.replace(temp_path, pointer_path)
+
+    for old_snapshot in get_snapshots(db_name)[:-keep]:
+        with _active_lock:
+            _close_unused_pool(db_name, old_snapshot)
+        _remove_database(old_snapshot)
+
+
+@contextmanager
+def _lock_builds(db_name: str) -> Iterator[None]:
+    """Holds the write lock of the lock database, which is released
+    by the operating system also when the process dies.
+
+    """
+
+    conn = sqlite3.connect(
+        get_lock_path(db_name), timeout=config.snapshot_lock_timeout,
+        isolation_level=None
+    )
+    try:
+        conn.execute('BEGIN IMMEDIATE;')
+        yield
+    finally:
+        # The transaction is rolled back.
+        conn.close()
+
+
+@contextmanager
+def build_snapshot(db_name: str, keep: int = 2) -> Iterator[str]:
+    """Copies the active snapshot into a staging file,
+    pins it for the current context and publishes it
+    if the block is finished without errors.
+    Threads started in the block must run in a copy of the context.
+    The build lock is held for the whole block, otherwise a snapshot
+    copied before the publish of another one would lose its writes,
+    so other builds, also of other processes, wait for the block.
+
+    """
+
+    root, ext = _split_db_name(db_name)
+
+    with _lock_builds(db_name):
+        active = get_active_snapshot(db_name)
+        snapshot = f'{root}-{time.time_ns()}{ext}'
+        staging = f'{snapshot}.staging'
+
+        if os.path.exists(active):
+            target = sqlite3.connect(staging)
+            try:
+                with get_pool(active).connection(read_only=True) as conn:
+                    conn.backup(target)
+            finally:
+                target.close()
+
+        token = pin_snapshot(db_name, staging)
+        try:
+            yield staging
+
+            _carry_tables(get_active_snapshot(db_name), staging)
+
+            with get_pool(staging).connection() as conn:
+                conn.execute('PRAGMA wal_checkpoint(TRUNCATE);')
+        except BaseException:
+            close_pool(staging)
+            _remove_database(staging)
+            raise
+        finally:
+            unpin_snapshot(token)
+
+        # WAL files are removed with the last connection.
+        close_pool(staging)
+        os.replace(staging, snapshot)
+
+        publish_snapshot(db_name, snapshot, keep)
+
+
+def staging_snapshot(db_name: str) -> ContextManager:
+    """In the snapshot mode builds a new snapshot (see build_snapshot),
+    otherwise the writes go to the active database.
+
+    """
+
+    if config.snapshot_mode:
+        return build_snapshot(db_name)
+
+    return nullcontext()
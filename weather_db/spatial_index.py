@@ -0,0 +1,400 @@
+"""This module contains an in-memory spatial index of the cities.
+
+Cities are put into grids of cells of a fixed size in degrees.
+Nearest cities are searched in the cells in the order of their distance
+from the point, until no city of the other cells can be closer,
+radius and bounding box queries read only the cells they overlap.
+Dense areas and small areas are searched in the fine grid.
+The index is built again when the City table changes.
+
+"""
+import heapq
+import math
+import threading
+from collections import defaultdict
+from typing import Dict, Iterator, List, Tuple
+
+from support_functions.metrics import registry
+from weather_db.db_manager import City, DataVersion
+
+EARTH_RADIUS_KM = 6371.0088
+
+# (city_id, name, lat, lon)
+CityRow = Tuple[int, str, float, float]
+
+# Column of the pole node, which joins the cells of a polar row.
+_POLE = -1
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+
+    a = (
+        math.sin((lat2 - lat1) / 2) ** 2
+        + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    )
+
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def _check_coords(lat: float, lon: float) -> None:
+    if not -90 <= lat <= 90 or not -180 <= lon <= 180:
+        raise ValueError(
+            'Latitude must be in [-90, 90] and longitude in [-180, 180].'
+        )
+
+
+class _Grid:
+    """Cities in cells of cell_size degrees, all the searches
+    are exact whatever the cell size is.
+
+    """
+
+    def __init__(self, cities: List[CityRow], cell_size: float):
+        self.cell_size = cell_size
+        self._rows = math.ceil(180 / cell_size)
+        self._columns = math.ceil(360 / cell_size)
+
+        self._cells: Dict[Tuple[int, int], List[CityRow]] = defaultdict(list)
+
+        for city in cities:
+            self._cells[self._get_cell(city[2], city[3])].append(city)
+
+        self._size = len(cities)
+
+    def _get_row(self, lat: float) -> int:
+        return min(int((lat + 90) // self.cell_size), self._rows - 1)
+
+    def _get_column(self, lon: float) -> int:
+        return int((lon + 180) // self.cell_size) % self._columns
+
+    def _get_cell(self, lat: float, lon: float) -> Tuple[int, int]:
+        return self._get_row(lat), self._get_column(lon)
+
+    def _get_columns(self, first: int, last: int) -> List[int]:
+        """Columns from the first to the last one over the antimeridian."""
+
+        if last - first + 1 >= self._columns:
+            return list(range(self._columns))
+
+        return [column % self._columns for column in range(first, last + 1)]
+
+    def count_in_cell(self, lat: float, lon: float) -> int:
+        return len(self._cells.get(self._get_cell(lat, lon), ()))
+
+    def iter_cities_in_area(
+            self, min_lat: float, min_lon: float,
+            max_lat: float, max_lon: float
+    ) -> Iterator[CityRow]:
+        """Yields cities of the cells overlapping the area,
+        min_lon greater than max_lon means the area crosses
+        the antimeridian.
+
+        """
+
+        west_column = int((min_lon + 180) // self.cell_size)
+        east_column = int((max_lon + 180) // self.cell_size)
+        if min_lon > max_lon:
+            east_column += self._columns
+
+        columns = self._get_columns(west_column, east_column)
+
+        for row in range(self._get_row(min_lat), self._get_row(max_lat) + 1):
+            for column in columns:
+                yield from self._cells.get((row, column), ())
+
+    def _get_cell_distance_km(
+            self, lat: float, lon: float, cell: Tuple[int, int]
+    ) -> float:
+        """Returns the distance from the point to the closest point
+        of the cell, no city of the cell can be closer.
+
+        """
+
+        row, column = cell
+        if column == _POLE:
+            return math.radians(90 - abs(lat)) * EARTH_RADIUS_KM
+
+        south = row * self.cell_size - 90
+        north = min(south + self.cell_size, 90)
+        west = column * self.cell_size - 180
+
+        # Longitude of the point east of the west edge in [0, 360).
+        offset = (lon - west) % 360
+        if offset <= self.cell_size:
+            return math.radians(max(south - lat, lat - north, 0)) * (
+                EARTH_RADIUS_KM
+            )
+
+        # The closest point is on the closer of the edge meridians.
+        if offset - self.cell_size < 360 - offset:
+            edge_lon, lon_distance = west + self.cell_size, (
+                offset - self.cell_size
+            )
+        else:
+            edge_lon, lon_distance = west, 360 - offset
+
+        if lon_distance < 90:
+            # Latitude of the closest point of the whole meridian.
+            edge_lat = math.degrees(math.atan(
+                math.tan(math.radians(lat))
+                / math.cos(math.radians(lon_distance))
+            ))
+
+            return haversine_km(
+                lat, lon, min(max(edge_lat, south), north), edge_lon
+            )
+
+        return min(
+            haversine_km(lat, lon, south, edge_lon),
+            haversine_km(lat, lon, north, edge_lon)
+        )
+
+    def _iter_neighbours(
+            self, cell: Tuple[int, int]
+    ) -> Iterator[Tuple[int, int]]:
+        """Yields the adjacent cells over the antimeridian.
+        Cells of the polar rows are adjacent through the pole.
+
+        """
+
+        row, column = cell
+        if column == _POLE:
+            for pole_column in range(self._columns):
+                yield row, pole_column
+            return
+
+        for neighbour_row in range(
+                max(row - 1, 0), min(row + 1, self._rows - 1) + 1
+        ):
+            for shift in (-1, 0, 1):
+                yield neighbour_row, (column + shift) % self._columns
+
+        if row in (0, self._rows - 1):
+            yield row, _POLE
+
+    def nearest(
+            self, lat: float, lon: float, k: int
+    ) -> List[Tuple[float, CityRow]]:
+        """Searches the cells in the order of their distance
+        from the point, until no unsearched cell can have a closer city.
+        Every cell with a city closer than the k-th one is reached
+        through the cells crossed by the shortest way to it,
+        which are not farther.
+
+        """
+
+        k = min(k, self._size)
+        start = self._get_cell(lat, lon)
+
+        # Max-heap of the k closest cities by the negated distance.
+        closest = []
+        # Min-heap of the cells to search by their distance.
+        cells = [(0.0, start)]
+        seen = {start}
+
+        while k and cells:
+            cell_distance, cell = heapq.heappop(cells)
+
+            if len(closest) == k and -closest[0][0] <= cell_distance:
+                break
+
+            for city in self._cells.get(cell, ()):
+                distance = haversine_km(lat, lon, city[2], city[3])
+                item = -distance, city[0], city
+
+                if len(closest) < k:
+                    heapq.heappush(closest, item)
+                elif item > closest[0]:
+                    heapq.heapreplace(closest, item)
+
+            for neighbour in self._iter_neighbours(cell):
+                if neighbour not in seen:
+                    seen.add(neighbour)
+                    heapq.heappush(cells, (
+                        self._get_cell_distance_km(lat, lon, neighbour),
+                        neighbour
+                    ))
+
+        return sorted((-distance, city) for distance, _, city in closest)
+
+
+class SpatialIndex:
+    """Coarse grid for the sparse areas and large queries
+    and fine grid for the dense areas and small ones.
+
+    """
+
+    def __init__(
+            self, cities: List[CityRow], cell_size: float = 1.0,
+            fine_cell_size: float = 0.1, max_coarse_cell_cities: int = 64
+    ):
+        cities = [
+            city for city in cities
+            if city[2] is not None and city[3] is not None
+        ]
+
+        self._coarse = _Grid(cities, cell_size)
+        self._fine = _Grid(cities, fine_cell_size)
+        self._max_coarse_cell_cities = max_coarse_cell_cities
+        self._size = len(cities)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _get_grid(self, lat_extent: float, lon_extent: float) -> _Grid:
+        if max(lat_extent, lon_extent) < self._coarse.cell_size:
+            return self._fine
+
+        return self._coarse
+
+    def nearest(
+            self, lat: float, lon: float, k: int = 10
+    ) -> List[Tuple[float, CityRow]]:
+        """Returns up to k (distance in km, city) pairs sorted by distance."""
+
+        _check_coords(lat, lon)
+
+        # The fine grid is searched only when the k nearest cities
+        # are likely in the dense coarse cell, otherwise
+        # it would search many empty fine cells.
+        grid = self._coarse
+        cell_cities = self._coarse.count_in_cell(lat, lon)
+        if k <= cell_cities and cell_cities > self._max_coarse_cell_cities:
+            grid = self._fine
+
+        return grid.nearest(lat, lon, k)
+
+    def within_radius(
+            self, lat: float, lon: float, radius_km: float, limit: int = 100
+    ) -> List[Tuple[float, CityRow]]:
+        """Returns up to limit (distance in km, city) pairs
+        sorted by distance.
+
+        """
+
+        _check_coords(lat, lon)
+
+        radius = radius_km / EARTH_RADIUS_KM
+        south, north = lat - math.degrees(radius), lat + math.degrees(radius)
+
+        # Longitude extent of the circle, unless it contains a pole.
+        if south <= -90 or north >= 90 or radius >= math.pi / 2:
+            lon_extent = 180
+        else:
+            lon_extent = math.degrees(math.asin(min(
+                1.0, math.sin(radius) / math.cos(math.radians(lat))
+            )))
+
+        if lon_extent >= 180:
+            west, east = -180, 180
+        else:
+            west = (lon - lon_extent + 180) % 360 - 180
+            east = (lon + lon_extent + 180) % 360 - 180
+
+        grid = self._get_grid(north - south, 2 * lon_extent)
+        found = []
+
+        for city in grid.iter_cities_in_area(
+                max(south, -90), west, min(north, 90), east
+        ):
+            distance = haversine_km(lat, lon, city[2], city[3])
+
+            if distance <= radius_km:
+                found.append((distance, city))
+
+        return sorted(found)[:limit]
+
+    def within_bbox(
+            self, min_lat: float, min_lon: float,
+            max_lat: float, max_lon: float, limit: int = 100
+    ) -> List[Tuple[float, CityRow]]:
+        """Returns up to limit (distance in km from the box center, city)
+        pairs sorted by distance. If min_lon is greater than max_lon,
+        the box crosses the antimeridian.
+
+        """
+
+        _check_coords(min_lat, min_lon)
+        _check_coords(max_lat, max_lon)
+
+        if min_lat > max_lat:
+            raise ValueError('min_lat cannot be greater than max_lat.')
+
+        crosses_antimeridian = min_lon > max_lon
+
+        center_lat = (min_lat + max_lat) / 2
+        center_lon = (min_lon + max_lon) / 2 + 180 * crosses_antimeridian
+        if center_lon > 180:
+            center_lon -= 360
+
+        grid = self._get_grid(
+            max_lat - min_lat, (max_lon - min_lon) % 360
+        )
+        found = []
+
+        for city in grid.iter_cities_in_area(
+                min_lat, min_lon, max_lat, max_lon
+        ):
+            _, _, city_lat, city_lon = city
+
+            in_lon = (
+                city_lon >= min_lon or city_lon <= max_lon
+                if crosses_antimeridian
+                else min_lon <= city_lon <= max_lon
+            )
+
+            if in_lon and min_lat <= city_lat <= max_lat:
+                found.append((
+                    haversine_km(center_lat, center_lon, city_lat, city_lon),
+                    city
+                ))
+
+        return sorted(found)[:limit]
+
+
+class CityLocator:
+    """Spatial index of the City table,
+    which is checked against the City table version on every read.
+
+    """
+
+    def __init__(self, cell_size: float = 1.0):
+        self._cell_size = cell_size
+
+        self._index = SpatialIndex([], cell_size)
+        self._version = None
+        self._lock = threading.Lock()
+
+        self.builds = 0
+
+    def get_index(self) -> SpatialIndex:
+        version = DataVersion.get_city_table_version()
+
+        with self._lock:
+            if version == self._version:
+                return self._index
+
+            # Cities inserted while the index is built have a newer version,
+            # so they are indexed on the next read.
+            self._index = SpatialIndex(
+                City.get_all_cities(), self._cell_size
+            )
+            self._version = version
+            self.builds += 1
+
+            return self._index
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+
+city_locator = CityLocator()
+
+registry.gauge(
+    'weather_db_spatial_index_stats', 'Size and builds of the city index.',
+    lambda: {
+        ('size',): len(city_locator), ('builds',): city_locator.builds
+    },
+    ('stat',)
+)